@@ -0,0 +1,116 @@
+'''
+Microbenchmarks for the hot paths
+
+Benchmarks are registered with @benchmark. The decorated function does any
+setup and returns the callable to time, so setup cost isn't measured.
+'''
+import sys
+import json
+import time
+import timeit
+import platform
+import statistics
+
+BENCHMARKS = {}
+
+
+class BenchmarkSkipped(Exception):
+    pass
+
+
+def benchmark(name):
+    '''
+    Register a benchmark
+    '''
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, repeat=5, min_time=0.2):
+    '''
+    Time func. The number of calls per run is picked so a run takes at least
+    min_time seconds, the best run is what gets reported.
+    '''
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    runs = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+    best = min(runs)
+
+    return {
+        "ns_per_call": best * 1e9,
+        "median_ns_per_call": statistics.median(runs) * 1e9,
+        "calls_per_second": 1 / best if best else 0.0,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def run(names=None, repeat=5, min_time=0.2, out=sys.stdout):
+    '''
+    Run the benchmarks (all of them by default) and return the results
+    '''
+    results = {}
+    skipped = {}
+
+    for name, setup in sorted(BENCHMARKS.items()):
+        if names and not any(part in name for part in names):
+            continue
+
+        try:
+            func = setup()
+        except BenchmarkSkipped as e:
+            skipped[name] = str(e)
+            print(f"{name:<60} skipped: {e}", file=out)
+            continue
+
+        result = results[name] = measure(func, repeat, min_time)
+        print(f"{name:<60} {result['ns_per_call']:>12.1f} ns/call {result['calls_per_second']:>14.0f} calls/s", file=out)
+
+    return {
+        "created": time.time(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def compare(baseline, current, threshold=0.10, out=sys.stdout):
+    '''
+    Compare two sets of results. Returns the names of the benchmarks that got
+    more than threshold (fraction) slower.
+    '''
+    regressions = []
+
+    for name, result in sorted(current["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<60} {result['ns_per_call']:>12.1f} ns/call (new)", file=out)
+            continue
+
+        change = (result["ns_per_call"] - base["ns_per_call"]) / base["ns_per_call"]
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+
+        print(f"{name:<60} {base['ns_per_call']:>12.1f} -> {result['ns_per_call']:>12.1f} ns/call {change:>+8.1%}{flag}", file=out)
+
+    for name in sorted(set(baseline["results"]) - set(current["results"])):
+        print(f"{name:<60} missing from current results", file=out)
+
+    return regressions
+
+
+def load(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def save(results, path):
+    with open(path, "w") as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
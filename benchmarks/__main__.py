@@ -0,0 +1,92 @@
+'''
+Benchmark CLI
+
+    python -m benchmarks run -o results.json
+    python -m benchmarks compare baseline.json results.json
+    python -m benchmarks importtime
+    python -m benchmarks stress -n 1 4 16 -R 4 10
+'''
+import sys
+import json
+import importlib
+import argparse
+
+import benchmarks
+
+
+def main():
+    parser = argparse.ArgumentParser("benchmarks", description="Microbenchmarks for the Motivation hot paths")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run = subparsers.add_parser("run", help="Run the benchmarks")
+    run.add_argument("-o", "--output", action="store", help="Save the results to this JSON file")
+    run.add_argument("-k", "--filter", action="append", help="Only run benchmarks with this in their name")
+    run.add_argument("-r", "--repeat", action="store", type=int, default=5, help="Runs per benchmark, the best is reported")
+    run.add_argument("-b", "--baseline", action="store", help="Compare against these saved results when done")
+    run.add_argument("-t", "--threshold", action="store", type=float, default=0.10, help="Slowdown (fraction) that counts as a regression")
+
+    compare = subparsers.add_parser("compare", help="Compare two saved results")
+    compare.add_argument("baseline", help="Saved results to compare against")
+    compare.add_argument("current", help="Saved results to check")
+    compare.add_argument("-t", "--threshold", action="store", type=float, default=0.10, help="Slowdown (fraction) that counts as a regression")
+
+    importtime = subparsers.add_parser("importtime", help="Check the CLI import time budget")
+    importtime.add_argument("-b", "--budget-ms", action="store", type=float, help="Import time budget in milliseconds")
+
+    stress = subparsers.add_parser("stress", help="End to end stress test with emulated trainers")
+    stress.add_argument("-n", "--devices", action="store", type=int, nargs="+", help="Device counts to try")
+    stress.add_argument("-R", "--rates", action="store", type=float, nargs="+", help="Notifications per second per device to try")
+    stress.add_argument("-T", "--duration", action="store", type=float, default=5.0, help="Seconds to ride for each run")
+    stress.add_argument("-j", "--jitter", action="store", type=float, default=0.1, help="Fraction each notification interval varies by")
+    stress.add_argument("--dropout", action="store", type=float, default=0.0, help="Chance a notification is never sent")
+    stress.add_argument("-q", "--queue-size", action="store", type=int, default=0, help="Queue notifications, see ride -q")
+    stress.add_argument("--overflow", action="store", choices=["coalesce", "drop-oldest", "block"], default="coalesce",
+                        help="What a full queue does")
+    stress.add_argument("-o", "--output", action="store", help="Save the results to this JSON file")
+
+    args = parser.parse_args()
+
+    if args.command == "importtime":
+        from benchmarks.importtime import check, BUDGET_MS
+
+        failures = check(args.budget_ms or BUDGET_MS)
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        return 1 if failures else 0
+
+    if args.command == "stress":
+        from benchmarks.stress import sweep, DEVICES, RATES
+
+        results = sweep(args.devices or DEVICES, args.rates or RATES, args.duration, args.jitter, args.dropout,
+                        args.queue_size, args.overflow)
+        if args.output:
+            with open(args.output, "w") as fh:
+                json.dump(results, fh, indent=2)
+        return 0
+
+    if args.command == "run":
+        importlib.import_module("benchmarks.hotpaths")  # Registers the benchmarks
+
+        results = benchmarks.run(args.filter, args.repeat)
+        if args.output:
+            benchmarks.save(results, args.output)
+        if not args.baseline:
+            return 0
+        baseline = benchmarks.load(args.baseline)
+    elif args.command == "compare":
+        baseline = benchmarks.load(args.baseline)
+        results = benchmarks.load(args.current)
+    else:
+        parser.print_help()
+        return 1
+
+    print("")
+    regressions = benchmarks.compare(baseline, results, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+'''
+Benchmarks for the notification -> decode -> track -> gate hot paths using synthetic GATT objects and packets
+'''
+import struct
+from types import SimpleNamespace
+
+from benchmarks import benchmark, BenchmarkSkipped
+from motivation.gatt import GATTService, GATTCharacteristic
+from motivation.loader import TrainerPluginLoader
+from motivation.pipeline import NotificationPipeline, OVERFLOW_DROP_OLDEST
+from motivation.power import RawPowerTracker, AveragePowerTracker, RollingPowerTracker, EWMAPowerTracker
+from motivation.power import NormalizedPowerTracker
+from motivation.trainers.cycling_power import decode_measurement, CYCLING_POWER_MEASUREMENT_UUID, CYCLING_POWER_SERVICE_UUID
+from motivation.trainers.wahoo_kickr_snap import WahooKickrSnap
+
+# Example packet from a Kickr SNAP: accumulated torque + wheel revolution data
+KICKR_PACKET = bytearray.fromhex("14 00 c8 00 18 e5 8d 0a 00 00 3a f0")
+
+# Pedal balance, accumulated torque, wheel and crank revolution data
+FULL_PACKET = bytearray(struct.pack("<HhBHIHHH", 0x0035, 250, 100, 0x1234, 2701, 0xF03A, 55, 1024))
+
+TRACKERS = (RawPowerTracker, AveragePowerTracker, RollingPowerTracker, EWMAPowerTracker, NormalizedPowerTracker)
+
+
+def synthetic_services(count=12, chars_per_service=5):
+    '''
+    GATTServices shaped like a trainer's, the cycling power service is last
+    '''
+    services = []
+
+    for svc in range(count):
+        chars = []
+        for idx in range(chars_per_service):
+            uuid = f"0000{0x2b00 + svc * 16 + idx:04x}-0000-1000-8000-00805f9b34fb"
+            chars.append(SimpleNamespace(uuid=uuid, properties=["notify"], description="", descriptors=[], handle=None))
+
+        if svc == count - 1:
+            chars[0].uuid = CYCLING_POWER_MEASUREMENT_UUID
+
+        service = GATTService(None, SimpleNamespace(
+            uuid=f"0000{0x1900 + svc:04x}-0000-1000-8000-00805f9b34fb", description=f"Service {svc}", characteristics=chars))
+        service.characteristics = [GATTCharacteristic(None, char) for char in chars]
+        services.append(service)
+
+    return services
+
+
+def synthetic_trainer(tracker=None):
+    client = SimpleNamespace(debug=False)
+    trainer = WahooKickrSnap(tracker or RawPowerTracker(100), client)
+    trainer.build_dispatch(synthetic_services())
+    return trainer
+
+
+@benchmark("trainer.notification_handler[cycling_power]")
+def bench_notification_handler():
+    trainer = synthetic_trainer()
+    handler = trainer.notification_handler
+    return lambda: handler(CYCLING_POWER_MEASUREMENT_UUID, KICKR_PACKET)
+
+
+@benchmark("trainer.notification_handler[cycling_power,metrics]")
+def bench_notification_handler_metrics():
+    # The measured handler directly so metrics don't stay on for the other benchmarks. The
+    # decoder still checks metrics.enabled so this is the handler's share of the cost.
+    trainer = synthetic_trainer()
+    handler = trainer._measured_notification_handler
+    return lambda: handler(CYCLING_POWER_MEASUREMENT_UUID, KICKR_PACKET)
+
+
+@benchmark("pipeline.handler[full_queue]")
+def bench_pipeline_handler():
+    # What the BLE callback pays with a queue, a full one so the overflow path is included
+    pipeline = NotificationPipeline(synthetic_trainer(), None, 64, OVERFLOW_DROP_OLDEST)
+    handler = pipeline.handler
+    return lambda: handler(CYCLING_POWER_MEASUREMENT_UUID, KICKR_PACKET)
+
+
+@benchmark("pipeline.handler+drain[batch_of_8]")
+def bench_pipeline_drain():
+    pipeline = NotificationPipeline(synthetic_trainer(), None, 64, batch_size=8)
+    handler, drain = pipeline.handler, pipeline._drain
+
+    def run():
+        for _ in range(8):
+            handler(CYCLING_POWER_MEASUREMENT_UUID, KICKR_PACKET)
+        drain()
+    return run
+
+
+@benchmark("trainer.notification_handler[unknown_sender]")
+def bench_notification_handler_unknown():
+    trainer = synthetic_trainer()
+    handler = trainer.notification_handler
+    return lambda: handler("00002a19-0000-1000-8000-00805f9b34fb", b"d")
+
+
+@benchmark("trainer._handle_cycling_power")
+def bench_handle_cycling_power():
+    trainer = synthetic_trainer()
+    decoder = trainer._handle_cycling_power
+    return lambda: decoder(KICKR_PACKET)
+
+
+@benchmark("cycling_power.decode_measurement[kickr]")
+def bench_decode_kickr():
+    return lambda: decode_measurement(KICKR_PACKET)
+
+
+@benchmark("cycling_power.decode_measurement[full]")
+def bench_decode_full():
+    return lambda: decode_measurement(FULL_PACKET)
+
+
+def _tracker_benchmarks(cls):
+    '''
+    set_power/get_effective_power/pass_fail benchmarks for a tracker class. The
+    tracker is warmed up with a few minutes of 10 Hz data first.
+    '''
+    def warmed_up():
+        tracker = cls(150)
+        clock = [0.0]
+        for idx in range(3000):
+            clock[0] += 0.1
+            tracker.set_power(100 + idx % 200, clock[0])
+        return tracker, clock
+
+    def bench_set_power():
+        tracker, clock = warmed_up()
+
+        def set_power():
+            clock[0] += 0.1
+            tracker.set_power(200, clock[0])
+        return set_power
+
+    def bench_get_effective_power():
+        tracker, _ = warmed_up()
+        return tracker.get_effective_power
+
+    def bench_pass_fail():
+        tracker, _ = warmed_up()
+        return tracker.pass_fail
+
+    benchmark(f"{cls.__name__}.set_power")(bench_set_power)
+    benchmark(f"{cls.__name__}.get_effective_power")(bench_get_effective_power)
+    benchmark(f"{cls.__name__}.pass_fail")(bench_pass_fail)
+
+
+for _cls in TRACKERS:
+    _tracker_benchmarks(_cls)
+
+
+@benchmark("BLEClient.get_service_with_characteristic")
+def bench_get_service_with_characteristic():
+    try:
+        from motivation.ble import BLEClient
+    except ImportError as e:
+        raise BenchmarkSkipped(f"BLE support isn't installed ({e})")
+
+    device = SimpleNamespace(address="00:00:00:00:00:00", name="Synthetic", metadata={"uuids": [CYCLING_POWER_SERVICE_UUID]})
+    client = BLEClient(device, RawPowerTracker(100))
+    client.services = synthetic_services()
+    client._index_services()
+    return lambda: client.get_service_with_characteristic(CYCLING_POWER_MEASUREMENT_UUID)
+
+
+@benchmark("TrainerPluginLoader.get_by_uuid[supported]")
+def bench_get_by_uuid():
+    loader = TrainerPluginLoader.get()
+    return lambda: loader.get_by_uuid(CYCLING_POWER_SERVICE_UUID)
+
+
+@benchmark("TrainerPluginLoader.get_by_uuid[unsupported]")
+def bench_get_by_uuid_unsupported():
+    loader = TrainerPluginLoader.get()
+    return lambda: loader.get_by_uuid("cbbfe0e1-f7f3-4206-84e0-84cbb3d09dfc")
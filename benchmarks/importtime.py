@@ -0,0 +1,94 @@
+'''
+Import time budget for the CLI, measured with python -X importtime
+
+-h and argument errors must not import BLE support or the controller backends,
+and everything that does get imported has to fit in the budget.
+'''
+import sys
+import subprocess
+
+#: Modules the CLI must not import just to show help or reject arguments
+FORBIDDEN = (
+    "asyncio",
+    "bleak",
+    "motivation.ble",
+    "motivation.controller.unix",
+    "motivation.controller.win32",
+    "motivation.loader",
+    "motivation.session",
+    "motivation.trainers",
+    "numpy",
+    "win32com",
+)
+
+#: Command lines to check, none of them should get past argument parsing
+COMMAND_LINES = (
+    ("-h",),
+    ("ride", "-h"),
+    ("group", "-h"),
+    ("replay", "-h"),
+    ("analyze", "-h"),
+    ("ride",),  # Missing -p/-a
+)
+
+#: Default budget for the total (self) import time of one command line
+BUDGET_MS = 60.0
+
+
+def import_times(args):
+    '''
+    Run the CLI with -X importtime. Returns {module: self time in microseconds}.
+    '''
+    return python_import_times(["-m", "motivation.cli"] + list(args))
+
+
+def python_import_times(argv, cwd=None):
+    '''
+    Run python with -X importtime and these arguments. Returns {module: self time in microseconds}.
+    '''
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime"] + list(argv),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, cwd=cwd
+    )
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # The column header
+        times[fields[2].strip()] = int(fields[0])
+
+    return times
+
+
+def forbidden_imports(times):
+    '''
+    The FORBIDDEN modules (and their submodules) that were imported
+    '''
+    return sorted(name for name in times if any(name == mod or name.startswith(mod + ".") for mod in FORBIDDEN))
+
+
+def check(budget_ms=BUDGET_MS, out=sys.stdout):
+    '''
+    Check every command line against the budget. Returns a list of failures.
+    '''
+    failures = []
+
+    for args in COMMAND_LINES:
+        times = import_times(args)
+        total_ms = sum(times.values()) / 1000
+        cmdline = " ".join(("motivation.cli",) + args)
+
+        print(f"{cmdline:<40} {len(times):>4} modules {total_ms:>8.1f} ms", file=out)
+
+        forbidden = forbidden_imports(times)
+        if forbidden:
+            failures.append(f"{cmdline} imported {', '.join(forbidden)}")
+        if total_ms > budget_ms:
+            slowest = sorted(times.items(), key=lambda item: item[1], reverse=True)[:5]
+            failures.append(f"{cmdline} took {total_ms:.1f} ms to import (budget {budget_ms:.1f} ms), slowest: " +
+                            ", ".join(f"{name} {usec / 1000:.1f} ms" for name, usec in slowest))
+
+    return failures
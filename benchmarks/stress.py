@@ -0,0 +1,156 @@
+'''
+End to end stress test with emulated trainers (motivation.fakeble)
+
+Every cell of devices x notification rate scans for the fake trainers with
+BLEScanner, connects to all of them with a SessionManager and rides for a
+while. The emulator runs in the same process so CPU includes its share,
+which is small next to decoding.
+
+    lag      How late packets were delivered, the event loop falling behind
+    latency  The sample being stamped to the gate decision. With -q samples are
+             stamped when the packet arrives so this includes the queue wait
+
+A cell is backed up once the p99 lag is more than a notification interval or
+a queue had to drop packets.
+'''
+import sys
+import time
+import asyncio
+
+from motivation.ble import BLEScanner
+from motivation.fakeble import FakeFleet, FakeTrainer
+from motivation.power import RawPowerTracker
+from motivation.session import SessionManager
+
+DEVICES = (1, 4, 16, 64)
+RATES = (4.0, 10.0, 50.0)
+
+#: Seconds to ignore after connecting, before measuring
+WARMUP = 0.5
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def run_cell(devices, rate, duration=5.0, jitter=0.1, dropout=0.0, queue_size=0, overflow="coalesce"):
+    '''
+    Ride `devices` fake trainers sending `rate` notifications a second for
+    `duration` seconds. Returns a dict of results.
+    '''
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    fleet = FakeFleet([FakeTrainer(f"KICKR {idx}", rate=rate, jitter=jitter, dropout=dropout, seed=idx)
+                       for idx in range(devices)], advertise_interval=0.05)
+    fleet.install()
+
+    try:
+        found = BLEScanner(timeout=0.1).scan()
+        manager = SessionManager()
+        latencies = []
+        for device in found:
+            tracker = RawPowerTracker(100)
+            session = manager.add(device, tracker, queue_size=queue_size, overflow=overflow)
+            _measure_gate(session.gate, latencies)
+
+        window = {}
+
+        def start_window():
+            latencies.clear()
+            for trainer in fleet.trainers:
+                window[trainer.name] = (trainer.sent, len(trainer.lag))
+            window["start"] = (time.perf_counter(), time.process_time())
+
+        def stop():
+            window["stop"] = (time.perf_counter(), time.process_time())
+            manager.stop()
+
+        # Connecting is quick with no op delay, measure once everyone's riding
+        loop.call_later(WARMUP, start_window)
+        loop.call_later(WARMUP + duration, stop)
+        manager.run()
+    finally:
+        fleet.uninstall()
+        loop.close()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+    wall = window["stop"][0] - window["start"][0]
+    cpu = window["stop"][1] - window["start"][1]
+    lags = [lag for trainer in fleet.trainers for lag in trainer.lag[window[trainer.name][1]:]]
+    sent = sum(trainer.sent - window[trainer.name][0] for trainer in fleet.trainers)
+
+    dropped = 0
+    for session in manager:
+        if session.client.pipeline is not None:
+            stats = session.client.pipeline.stats
+            dropped += stats.coalesced + stats.dropped
+
+    lag_p99 = percentile(lags, 99)
+    return {
+        "devices": len(found),
+        "rate": rate,
+        "offered": devices * rate * (1 - dropout),
+        "delivered": sent / wall if wall else 0.0,
+        "cpu_percent": cpu / wall * 100 if wall else 0.0,
+        "lag_p50": percentile(lags, 50),
+        "lag_p99": lag_p99,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies, default=0.0),
+        "dropped": dropped,
+        "backed_up": lag_p99 > 1 / rate or dropped > 0,
+        "errors": sum(session.error is not None for session in manager),
+    }
+
+
+def _measure_gate(gate, latencies):
+    '''
+    Record the time from the sample being stamped to the gate's decision
+    '''
+    on_sample = gate.on_sample
+
+    def measured(power_tracker):
+        on_sample(power_tracker)
+        latencies.append(power_tracker.clock() - power_tracker.timestamp)
+
+    gate.on_sample = measured  # Picked up when the gate starts listening
+
+
+def sweep(devices=DEVICES, rates=RATES, duration=5.0, jitter=0.1, dropout=0.0, queue_size=0, overflow="coalesce",
+          out=sys.stdout):
+    '''
+    Run every cell, print a table as it goes and where each rate started backing up
+    '''
+    results = []
+    print(f"{'devices':>7} {'rate':>6} {'offered/s':>10} {'delivered/s':>12} {'cpu':>7} {'lag p50':>9} {'lag p99':>9} "
+          f"{'lat p50':>9} {'lat p99':>9} {'lat max':>9} {'dropped':>8}", file=out)
+
+    for rate in rates:
+        for count in devices:
+            result = run_cell(count, rate, duration, jitter, dropout, queue_size, overflow)
+            results.append(result)
+            print(f"{result['devices']:>7} {rate:>6.1f} {result['offered']:>10.0f} {result['delivered']:>12.0f} "
+                  f"{result['cpu_percent']:>6.1f}% {_ms(result['lag_p50'])} {_ms(result['lag_p99'])} "
+                  f"{_ms(result['latency_p50'])} {_ms(result['latency_p99'])} {_ms(result['latency_max'])} "
+                  f"{result['dropped']:>8}{'  BACKED UP' if result['backed_up'] else ''}", file=out)
+
+    print("", file=out)
+    for rate in rates:
+        cells = [result for result in results if result["rate"] == rate]
+        first = next((result for result in cells if result["backed_up"]), None)
+        if first is None:
+            print(f"{rate:.1f}Hz: kept up with {cells[-1]['devices']} devices "
+                  f"({cells[-1]['offered']:.0f} notifications/s)", file=out)
+        else:
+            print(f"{rate:.1f}Hz: backed up at {first['devices']} devices ({first['offered']:.0f} notifications/s)",
+                  file=out)
+
+    return results
+
+
+def _ms(secs):
+    return f"{secs * 1000:>7.2f}ms"
@@ -0,0 +1,341 @@
+'''
+Run the BLE side of a ride in its own process
+
+The acquisition process owns the BLEClient. It connects, decodes
+notifications and writes the samples (and raw notifications when recording)
+to a SampleRing in shared memory. AcquisitionClient stands in for BLEClient
+in the main process: it reads the ring and feeds the power tracker, so the
+gate, recorder, dashboard and status line use another core and never hold
+the acquisition process up. Log records and connection state come back on a
+multiprocessing queue, samples never go through it.
+
+Sample timestamps are taken in the acquisition process with perf_counter,
+which is the same system wide clock in every process.
+'''
+import time
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+import logging.handlers
+
+from bleak.exc import BleakError
+
+from motivation.ble import BLEClient, BLEClientConnectionFailed, UnsupportedTrainer
+from motivation.gate import PowerGate, GATE_ENABLED, GATE_DISABLED
+from motivation.gatt import GATTDevice
+from motivation.loader import TrainerPluginLoader
+from motivation.pipeline import OVERFLOW_COALESCE
+from motivation.power import PowerTracker
+from motivation.recorder import RECORD_SAMPLE, RECORD_NOTIFICATION, PAYLOAD_SIZE
+from motivation.shmring import SampleRing, SAMPLE_POWER, RING_SIZE
+
+LOGGER = logging.getLogger(__name__)
+
+#: Seconds between reads of the ring, the longest a sample waits before the gate sees it
+POLL_INTERVAL = 0.005
+
+#: Seconds between checks for a stop request in the acquisition process
+STOP_CHECK = 0.1
+
+#: Seconds to wait for the acquisition process to clean up before it's killed
+STOP_TIMEOUT = 10.0
+
+EVENT_LOG = "log"
+EVENT_LISTENING = "listening"
+EVENT_FAILED = "failed"
+EVENT_STOPPED = "stopped"
+
+
+class AcquisitionStats:
+    '''
+    What came through the ring and how long samples took to get from one process to the other
+    '''
+
+    def __init__(self):
+        self.samples = 0
+        self.notifications = 0
+        self.missed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.pipeline = None
+
+    @property
+    def mean_latency(self):
+        if not self.samples:
+            return 0.0
+        return self.total_latency / self.samples
+
+    def __str__(self):
+        text = (f"Ring samples: {self.samples}, Notifications: {self.notifications}, Missed: {self.missed}, "
+                f"Mean ring latency: {self.mean_latency * 1000:.3f}ms, Max ring latency: {self.max_latency * 1000:.3f}ms")
+        if self.pipeline:
+            text += f"\n\t{self.pipeline}"
+        return text
+
+
+class RingTracker(PowerTracker):
+    '''
+    Used in the acquisition process, samples go straight into the ring. The tracker in the main process does the rest.
+    '''
+
+    def __init__(self, ring):
+        super().__init__(0)
+        self.ring = ring
+
+    def set_power(self, power, timestamp=None):
+        self.power = power
+        self.updated = time.perf_counter()
+        self.ring.write_sample(self.clock() if timestamp is None else timestamp, power)
+
+    def get_effective_power(self):
+        return self.power
+
+
+class AdvertisedDevice:
+    '''
+    What the acquisition process needs to know about a scanned device. Bleak's own
+    device object can't always be pickled.
+    '''
+
+    def __init__(self, device):
+        self.address = device.address
+        self.name = device.name
+        self.details = None
+        self.metadata = device.metadata
+
+
+class EventLogHandler(logging.handlers.QueueHandler):
+    '''
+    Sends log records to the main process along with the other events
+    '''
+
+    def enqueue(self, record):
+        self.queue.put_nowait((EVENT_LOG, record))
+
+
+class AcquisitionClient:
+    '''
+    Stands in for BLEClient, takes the same arguments. The connection runs in
+    an acquisition process and samples come back through a SampleRing that's
+    read every poll_interval seconds on this process's event loop.
+    '''
+
+    def __init__(self, device, power_tracker, timeout=10, debug=False, stale_timeout=3.0, concurrency=4, recorder=None,
+                 lower_band=0.0, upper_band=0.0, min_dwell=0.0, reconnect=False, initial_backoff=1.0, max_backoff=30.0,
+                 queue_size=0, overflow=OVERFLOW_COALESCE, batch_size=32, full_enumeration=False, ring_size=RING_SIZE,
+                 poll_interval=POLL_INTERVAL, start_method="spawn"):
+        self.device = device
+        self.power_tracker = power_tracker
+        self.recorder = recorder
+        self.debug = debug
+        self.loop = asyncio.get_event_loop()
+        self.timings = {}
+        self.pipeline = None  # Any queueing happens in the acquisition process
+        self.stats = AcquisitionStats()
+        self.gate = PowerGate(self.power_tracker, self.loop, stale_timeout=stale_timeout, lower_band=lower_band,
+                              upper_band=upper_band, min_dwell=min_dwell, debug=debug)
+        self.ring_size = ring_size
+        self.poll_interval = poll_interval
+        self.context = multiprocessing.get_context(start_method)
+        self.client_options = {
+            "timeout": timeout, "debug": debug, "concurrency": concurrency, "reconnect": reconnect,
+            "initial_backoff": initial_backoff, "max_backoff": max_backoff, "queue_size": queue_size,
+            "overflow": overflow, "batch_size": batch_size, "full_enumeration": full_enumeration,
+        }
+        self.error = None
+        self._stopping = False
+        self._stop_event = None
+
+        # Fail here like BLEClient does rather than in the other process
+        try:
+            uuid = self.device.metadata.get("uuids", [])[0]
+        except IndexError:
+            raise UnsupportedTrainer()
+        if TrainerPluginLoader.get().get_by_uuid(uuid) is None:
+            raise UnsupportedTrainer()
+        self.uuid = uuid
+
+        if self.recorder is not None:
+            self.power_tracker.add_listener(self.recorder.record_sample)
+
+    def run(self):
+        '''
+        Run the client
+        '''
+        task = self.loop.create_task(self.run_async())
+
+        try:
+            self.loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            LOGGER.info("Clean exit...")
+            self.stop()
+            self.loop.run_until_complete(task)
+
+    def stop(self):
+        '''
+        Ask the acquisition process to disconnect
+        '''
+        self._stopping = True
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    async def run_async(self):
+        '''
+        Start the acquisition process and feed its samples to the tracker until it's done
+        '''
+        ring = SampleRing.create(self.ring_size)
+        reader = ring.reader(0)
+        events = self.context.Queue()
+        self._stop_event = self.context.Event()
+        if self._stopping:
+            self._stop_event.set()
+
+        # The acquisition process logs at the same levels as this one
+        levels = {"": logging.getLogger().level, "motivation": logging.getLogger("motivation").level}
+        process = self.context.Process(
+            target=acquire, name=f"motivation-acquisition-{self.device.address}", daemon=True,
+            args=(ring.name, self.uuid, AdvertisedDevice(self.device), self.client_options, self.recorder is not None,
+                  events, self._stop_event, levels)
+        )
+        listener = threading.Thread(target=self._read_events, args=(events,), name="motivation-acquisition-events",
+                                    daemon=True)
+
+        listener.start()
+        try:
+            process.start()
+
+            while process.is_alive():
+                self.consume(reader)
+                await asyncio.sleep(self.poll_interval)
+            self.consume(reader)  # Whatever it wrote on the way out
+        finally:
+            if process.is_alive():
+                self._stop_event.set()
+                await self.loop.run_in_executor(None, process.join, STOP_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            events.put(None)  # In case it died without saying it stopped
+            listener.join()
+            reader.close()  # Before the ring it reads from
+            ring.close()
+            if self.gate.running:
+                self.gate.stop()
+
+        if self.debug:
+            LOGGER.debug(self.gate.stats)
+            LOGGER.debug(f"Controller disabled {self.gate.transitions[GATE_DISABLED]} times, "
+                         f"enabled {self.gate.transitions[GATE_ENABLED]} times")
+            LOGGER.debug(self.stats)
+
+        if self.error is not None:
+            raise BLEClientConnectionFailed(self.error)
+
+    def consume(self, reader):
+        '''
+        Feed everything new in the ring to the tracker and recorder
+        '''
+        for timestamp, kind, channel, length, payload in reader.read():
+            if kind == RECORD_SAMPLE:
+                self.process_sample(timestamp, SAMPLE_POWER.unpack_from(payload)[0])
+            elif kind == RECORD_NOTIFICATION:
+                self.stats.notifications += 1
+                if self.recorder is not None:
+                    self.recorder.record_notification(reader.ring.sender(channel), payload[:min(length, PAYLOAD_SIZE)],
+                                                      timestamp)
+        self.stats.missed = reader.missed
+
+    def process_sample(self, timestamp, power):
+        if not self.gate.running:
+            self.gate.start()  # Samples can beat the listening event here
+        self.power_tracker.set_power(power, timestamp)
+
+        stats = self.stats
+        latency = self.power_tracker.clock() - timestamp
+        stats.samples += 1
+        stats.total_latency += latency
+        if latency > stats.max_latency:
+            stats.max_latency = latency
+
+    def _read_events(self, events):
+        '''
+        Runs on its own thread until the acquisition process is done
+        '''
+        while True:
+            event = events.get()
+            if event is None:
+                return
+
+            kind, value = event
+            if kind == EVENT_LOG:
+                logging.getLogger(value.name).handle(value)
+            elif kind == EVENT_LISTENING:
+                self.loop.call_soon_threadsafe(self._listening, value)
+            elif kind == EVENT_FAILED:
+                self.error = value
+            elif kind == EVENT_STOPPED:
+                self.stats.reconnects, self.stats.downtime, self.stats.pipeline = value
+                return
+
+    def _listening(self, timings):
+        self.timings.update(timings)
+        if not self.gate.running:
+            self.gate.start()
+
+
+def acquire(ring_name, uuid, device, client_options, recording, events, stop_event, levels):
+    '''
+    Acquisition process entry point. Connects and writes samples to the ring
+    until stop_event is set or the connection is done.
+    '''
+    # Cntrl-C goes to every process, the main one stops this one when it's ready
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    root_logger = logging.getLogger()
+    root_logger.handlers = [EventLogHandler(events)]
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    ring = SampleRing.attach(ring_name)
+    client = None
+
+    try:
+        # The main process has the stale timer, this gate never sees a sample
+        client = BLEClient(GATTDevice(uuid, device), RingTracker(ring), stale_timeout=0, **client_options)
+        if recording:
+            client.trainer.recorder = ring
+        loop.run_until_complete(_acquire(client, events, stop_event))
+    except (BleakError, BLEClientConnectionFailed, asyncio.TimeoutError, OSError) as e:
+        events.put((EVENT_FAILED, str(e) or type(e).__name__))
+    except Exception as e:
+        LOGGER.exception(f"Acquisition failed: {e}")
+        events.put((EVENT_FAILED, str(e) or type(e).__name__))
+    finally:
+        summary = (0, 0.0, None)
+        if client is not None:
+            pipeline = str(client.pipeline.stats) if client.pipeline is not None else None
+            summary = (client.reconnects, client.downtime, pipeline)
+        events.put((EVENT_STOPPED, summary))
+        ring.close()
+        loop.close()
+
+
+async def _acquire(client, events, stop_event):
+    task = client.loop.create_task(client.run_async())
+    listening = False
+
+    while not task.done():
+        if stop_event.is_set():
+            client.stop()
+        if not listening and client.gate.running:
+            events.put((EVENT_LISTENING, dict(client.timings)))
+            listening = True
+        await asyncio.wait((task,), timeout=STOP_CHECK)
+
+    await task
@@ -0,0 +1,353 @@
+'''
+Offline analysis of recorded sessions with NumPy
+
+Session files are memory mapped as arrays of fixed size records and read a
+chunk at a time, only the decoded samples are kept. Each session is
+resampled to 1 second (a sample's power holds until the next one, like the
+rolling tracker) and everything else is vectorized over that. Totals across
+sessions are a running mean-max curve and a seconds-per-watt histogram so
+memory only depends on the longest session, not on how many there are.
+'''
+import os
+import time
+
+import numpy as np
+
+from motivation.recorder import HEADER, RECORD, RECORD_SAMPLE, SESSION_EXT, SessionReader
+
+#: Same layout as recorder.RECORD with the sample payload split out
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("kind", "u1"),
+    ("channel", "u1"),
+    ("length", "<u2"),
+    ("power", "<f4"),
+    ("effective", "<f4"),
+    ("rest", "V28"),
+])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+#: Records read from a file at a time
+CHUNK_SIZE = 1 << 16
+
+#: Seconds without a sample before power counts as 0 (dropouts, stopped pedalling)
+MAX_GAP = 5.0
+
+#: Durations (seconds) for the mean-max power curve
+CURVE_DURATIONS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+#: The efforts called out in the summary
+BEST_EFFORTS = ((5, "5s"), (60, "1min"), (300, "5min"), (1200, "20min"))
+
+#: Coggan power zones as fractions of FTP, the last zone has no upper bound
+ZONES = (
+    ("Z1 Active Recovery", 0.55),
+    ("Z2 Endurance", 0.75),
+    ("Z3 Tempo", 0.90),
+    ("Z4 Threshold", 1.05),
+    ("Z5 VO2 Max", 1.20),
+    ("Z6 Anaerobic", 1.50),
+    ("Z7 Neuromuscular", None),
+)
+
+#: Highest power (watts) kept in the histogram used for percentiles
+MAX_POWER = 3000
+
+
+def session_files(paths):
+    '''
+    Session files from a list of files and directories (searched recursively), oldest first
+    '''
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                found.extend(os.path.join(root, name) for name in files if name.endswith(SESSION_EXT))
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+def load_samples(path, chunk_size=CHUNK_SIZE):
+    '''
+    (timestamps, power, effective power) arrays for a session, read in chunks
+    '''
+    with SessionReader(path) as reader:
+        count = len(reader)
+        header = reader.header
+
+    if not count:
+        empty = np.empty(0)
+        return header, empty, empty, empty
+
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+    parts = []
+    for start in range(0, count, chunk_size):
+        chunk = records[start:start + chunk_size]
+        parts.append(chunk[chunk["kind"] == RECORD_SAMPLE][["timestamp", "power", "effective"]])
+    samples = np.concatenate(parts)
+    del records
+
+    order = np.argsort(samples["timestamp"], kind="stable")  # Written in batches, make sure
+    samples = samples[order]
+    return (header, samples["timestamp"].astype(np.float64), samples["power"].astype(np.float64),
+            samples["effective"].astype(np.float64))
+
+
+def resample(timestamps, values, max_gap=MAX_GAP):
+    '''
+    Hold each value until the next sample, one value per second. Values more
+    than max_gap seconds old count as 0.
+    '''
+    if not len(timestamps):
+        return np.empty(0)
+
+    grid = np.arange(timestamps[0], timestamps[-1] + 1.0, 1.0)
+    idx = np.searchsorted(timestamps, grid, side="right") - 1
+    out = values[idx]
+    out[grid - timestamps[idx] > max_gap] = 0.0
+    return out
+
+
+def rolling_mean(power, seconds):
+    '''
+    Mean of every `seconds` long window of 1 second power
+    '''
+    if len(power) < seconds:
+        return np.empty(0)
+    csum = np.concatenate(([0.0], np.cumsum(power)))
+    return (csum[seconds:] - csum[:-seconds]) / seconds
+
+
+def mean_max(power, durations=CURVE_DURATIONS):
+    '''
+    Best average power for each duration, NaN if the session is shorter
+    '''
+    curve = np.full(len(durations), np.nan)
+    for idx, seconds in enumerate(durations):
+        means = rolling_mean(power, seconds)
+        if len(means):
+            curve[idx] = means.max()
+    return curve
+
+
+def normalized_power(power):
+    '''
+    4th root of the mean of the 30s rolling average to the 4th
+    '''
+    rolling = rolling_mean(power, 30)
+    if not len(rolling):
+        return float(power.mean()) if len(power) else 0.0
+    return float(np.mean(rolling ** 4) ** 0.25)
+
+
+def zone_edges(ftp):
+    return np.array([ftp * upper for _, upper in ZONES if upper is not None])
+
+
+def time_in_zones(histogram, ftp):
+    '''
+    Seconds in each zone from a seconds-per-watt histogram
+    '''
+    watts = np.arange(len(histogram))
+    return np.bincount(np.digitize(watts, zone_edges(ftp)), weights=histogram, minlength=len(ZONES)).astype(np.int64)
+
+
+def timeline(passing, width=60):
+    '''
+    Squash a per second pass/fail array into a width character strip. A
+    character is a fail if any second in it failed.
+    '''
+    if not len(passing):
+        return ""
+    bins = np.array_split(passing, min(width, len(passing)))
+    return "".join("#" if chunk.all() else "." for chunk in bins)
+
+
+def fail_segments(passing):
+    '''
+    (start second, length) of every stretch of failing seconds
+    '''
+    padded = np.concatenate(([True], passing, [True]))
+    changes = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    starts, ends = changes[::2], changes[1::2]
+    return list(zip(starts.tolist(), (ends - starts).tolist()))
+
+
+class SessionSummary:
+    '''
+    Numbers for one session
+    '''
+
+    def __init__(self, path, header, power):
+        self.path = path
+        self.name = header.device_name
+        self.created = header.created
+        self.duration = len(power)
+        self.average = float(power.mean()) if len(power) else 0.0
+        self.normalized = normalized_power(power)
+        self.curve = mean_max(power)
+        self.intensity = None
+        self.tss = None
+        self.passing = None  # Fraction of seconds at or above the threshold
+        self.fails = []
+        self.timeline = ""
+
+    def set_passing(self, passing, width=60):
+        '''
+        Keep what the report needs from the per second pass/fail array, not the array
+        '''
+        self.passing = float(passing.mean()) if len(passing) else 0.0
+        self.fails = fail_segments(passing)
+        self.timeline = timeline(passing, width)
+
+    def set_ftp(self, ftp):
+        self.intensity = self.normalized / ftp
+        self.tss = self.duration * self.normalized * self.intensity / (ftp * 3600) * 100
+
+    def best(self, seconds):
+        value = self.curve[CURVE_DURATIONS.index(seconds)]
+        return None if np.isnan(value) else float(value)
+
+
+class Analysis:
+    '''
+    Running totals over any number of sessions
+    '''
+
+    def __init__(self, ftp=None, threshold=None, average=False, max_gap=MAX_GAP, width=60):
+        self.ftp = ftp
+        self.threshold = threshold
+        self.average = average  # Check the threshold against effective (average) power instead of raw power
+        self.max_gap = max_gap
+        self.width = width
+        self.sessions = []
+        self.curve = np.full(len(CURVE_DURATIONS), np.nan)
+        self.histogram = np.zeros(MAX_POWER + 1, dtype=np.int64)  # Seconds by watt
+
+    def add(self, path):
+        '''
+        Analyze a session file and add it to the totals
+        '''
+        header, timestamps, power, effective = load_samples(path)
+        power = resample(timestamps, power, self.max_gap)
+        effective = resample(timestamps, effective, self.max_gap)
+
+        summary = SessionSummary(path, header, power)
+        self.curve = np.fmax(self.curve, summary.curve)
+
+        self.histogram += np.bincount(np.clip(power, 0, MAX_POWER).astype(np.int64), minlength=MAX_POWER + 1)
+
+        if self.threshold is not None:
+            summary.set_passing((effective if self.average else power) >= self.threshold, self.width)
+
+        self.sessions.append(summary)
+        return summary
+
+    def finish(self):
+        '''
+        Work out the FTP dependent numbers once every session is in. Returns seconds per zone.
+        '''
+        ftp = self.estimated_ftp()
+        if not ftp:
+            return np.zeros(len(ZONES), dtype=np.int64)
+
+        for summary in self.sessions:
+            summary.set_ftp(ftp)
+        return time_in_zones(self.histogram, ftp)
+
+    def estimated_ftp(self):
+        '''
+        The FTP given, otherwise 95% of the best 20 minutes
+        '''
+        if self.ftp:
+            return self.ftp
+        best_20 = self.curve[CURVE_DURATIONS.index(1200)]
+        if np.isnan(best_20):
+            return None
+        return float(best_20) * 0.95
+
+    def percentile(self, q):
+        '''
+        Pedalling power percentile (0-100) over every session
+        '''
+        pedalling = self.histogram[1:]
+        total = pedalling.sum()
+        if not total:
+            return 0
+        return int(np.searchsorted(np.cumsum(pedalling), total * q / 100)) + 1
+
+    def suggestions(self):
+        '''
+        (options, why) threshold suggestions from past rides
+        '''
+        if not self.sessions or not self.histogram[1:].any():
+            return []
+
+        def nearest_5(watts):
+            return int(round(watts / 5.0) * 5)
+
+        suggestions = [
+            (f"--power-threshold {nearest_5(self.percentile(25))}", "you were above it 75% of the time you were pedalling"),
+        ]
+
+        averages = np.array([s.average for s in self.sessions[-10:] if s.duration])
+        if len(averages):
+            suggestions.append((f"--average-power {nearest_5(np.median(averages))}",
+                                f"median average power of your last {len(averages)} sessions"))
+
+        best_5 = self.curve[CURVE_DURATIONS.index(300)]
+        if not np.isnan(best_5):
+            suggestions.append((f"--average-power {nearest_5(best_5 * 0.75)} -m rolling -W 300",
+                                "75% of your best 5 minutes"))
+        return suggestions
+
+
+def _watts(value):
+    return "-" if value is None or np.isnan(value) else f"{value:.0f}w"
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def report(analysis, zones):
+    '''
+    Text report for an analysis
+    '''
+    lines = []
+
+    for s in analysis.sessions:
+        date = time.strftime("%Y-%m-%d %H:%M", time.localtime(s.created))
+        line = (f"{date} {s.name:<16} {_duration(s.duration)} avg {s.average:.0f}w NP {s.normalized:.0f}w "
+                + " ".join(f"{label} {_watts(s.best(secs))}" for secs, label in BEST_EFFORTS))
+        if s.intensity is not None:
+            line += f" IF {s.intensity:.2f} TSS {s.tss:.0f}"
+        lines.append(line)
+
+        if s.passing is not None:
+            longest = max((length for _, length in s.fails), default=0)
+            lines.append(f"    {s.timeline} {s.passing * 100:.0f}% passing, {len(s.fails)} fails, longest {longest}s")
+
+    lines.append("")
+    lines.append("Mean-max power:")
+    lines.append("    " + "  ".join(f"{secs}s {_watts(value)}" for secs, value in zip(CURVE_DURATIONS, analysis.curve)))
+
+    ftp = analysis.estimated_ftp()
+    if ftp:
+        total = zones.sum() or 1
+        lines.append("")
+        lines.append(f"Time in zones (FTP {ftp:.0f}w{'' if analysis.ftp else ', estimated from your best 20 minutes'}):")
+        for (name, _), seconds in zip(ZONES, zones):
+            lines.append(f"    {name:<20} {_duration(seconds)} {seconds / total * 100:5.1f}%")
+
+    suggestions = analysis.suggestions()
+    if suggestions:
+        lines.append("")
+        lines.append("Suggested thresholds:")
+        for options, why in suggestions:
+            lines.append(f"    {options}  ({why})")
+
+    return "\n".join(lines)
@@ -1,22 +1,27 @@
 '''
 Handle the bluetooth device specifics
 '''
-import os
-import sys
 import time
+import random
 import asyncio
-import argparse
-import traceback
-import threading
+import logging
 
 from bleak import BleakClient
 from bleak import discover
 from bleak.exc import BleakError
 
+try:
+    from bleak import BleakScanner
+except ImportError:  # Bleak < 0.7, scanning falls back to discover()
+    BleakScanner = None
+
 from motivation.loader import TrainerPluginLoader
-from motivation.controller import disable_controller
-from motivation.power import PowerTracker
-from motivation.gatt import GATTDevice, GATTCharacteristic, GATTDescriptor, GATTService
+from motivation.gate import PowerGate, GATE_ENABLED, GATE_DISABLED
+from motivation.gatt import GATTDevice, GATTFailedToNotify
+from motivation.gatt import parse_services, notify_services, stop_notify_services
+from motivation.pipeline import NotificationPipeline, OVERFLOW_COALESCE
+
+LOGGER = logging.getLogger(__name__)
 
 
 class BLEClientConnectionFailed(Exception):
@@ -27,18 +32,62 @@ class UnsupportedTrainer(Exception):
     pass
 
 
+class Backoff:
+    '''
+    Exponential backoff with jitter so a room full of clients doesn't retry in lockstep
+    '''
+
+    def __init__(self, initial=1.0, maximum=30.0, factor=2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next(self):
+        '''
+        Seconds to wait before the next attempt, somewhere between half and all of the backoff
+        '''
+        delay = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempts = 0
+
+
 class BLEClient:
     '''
     Acts as a client. Connects to a server, subscribes to events, etc...
     '''
 
-    def __init__(self, device, power_tracker, timeout=10, debug=False):
+    #: Seconds between link checks while listening with reconnect on
+    LINK_CHECK = 2.0
+
+    def __init__(self, device, power_tracker, timeout=10, debug=False, stale_timeout=3.0, concurrency=4, recorder=None,
+                 lower_band=0.0, upper_band=0.0, min_dwell=0.0, reconnect=False, initial_backoff=1.0, max_backoff=30.0,
+                 queue_size=0, overflow=OVERFLOW_COALESCE, batch_size=32, full_enumeration=False):
         self.device = device
         self.timeout = timeout
+        self.concurrency = concurrency
         self.power_tracker = power_tracker
+        self.recorder = recorder
         self.debug = debug
         self.loop = asyncio.get_event_loop()
         self.services = []
+        self._char_index = {}
+        self.timings = {}
+        self.gate = PowerGate(self.power_tracker, self.loop, stale_timeout=stale_timeout, lower_band=lower_band,
+                              upper_band=upper_band, min_dwell=min_dwell, debug=debug)
+        self.full_enumeration = full_enumeration  # Read and subscribe to everything, not just what the plugin needs
+        self.reconnect = reconnect
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+        self.downtime = 0.0
+        self._connected = False
+        self._disconnected_at = None
+        self._stopping = False
+        self._stop_event = None
 
         # Technically this is a list, but we only care about the first UUID maybe?
         try:
@@ -53,108 +102,340 @@ class BLEClient:
             raise UnsupportedTrainer()
         self.trainer = trainer_cls(self.power_tracker, self)
 
+        if self.recorder is not None:
+            self.trainer.recorder = self.recorder
+            self.power_tracker.add_listener(self.recorder.record_sample)
+
+        # Notifications are handled in Bleak's callback unless they're queued
+        self.pipeline = None
+        if queue_size:
+            self.pipeline = NotificationPipeline(self.trainer, self.loop, queue_size, overflow, batch_size)
+
     def get_service_with_characteristic(self, char_uuid):
+        return self._char_index.get(char_uuid)
+
+    def _index_services(self):
+        '''
+        Build the lookup tables used when notifications come in. Only done once after discovery.
+        '''
+        self._char_index = {}
         for service in self.services:
-            char = service.get_characteristic(char_uuid)
-            if char:
-                return service
-        return None
+            for char in service.characteristics:
+                self._char_index[char.uuid] = service
+
+        self.trainer.build_dispatch(self.services)
 
     def run(self):
         '''
         Run the client
         '''
+        task = self.loop.create_task(self.run_async())
+
         try:
-            self.loop.run_until_complete(self._run())
+            try:
+                self.loop.run_until_complete(task)
+            except KeyboardInterrupt:
+                # Let the task finish up so the notifications get cleaned up
+                LOGGER.info("Clean exit...")
+                self.stop()
+                self.loop.run_until_complete(task)
         except BleakError:
             raise BLEClientConnectionFailed()
 
-    async def _run(self):
+    def stop(self):
+        '''
+        Ask the client to disconnect
+        '''
+        self._stopping = True
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    async def run_async(self):
+        '''
+        Connect to a chosen device and listen until stop() is called. Doesn't
+        touch the loop so several clients can run on one.
+
+        With reconnect on a lost link is reconnected with jittered exponential
+        backoff. The tracker, gate and recorder carry on through the outage
+        (the stale timer disables the controller while it's down).
+        '''
+        self._stop_event = asyncio.Event()
+        if self._stopping:
+            self._stop_event.set()
+
+        backoff = Backoff(self.initial_backoff, self.max_backoff)
+        if self.pipeline is not None:
+            self.pipeline.start()
+
+        try:
+            while not self._stopping:
+                try:
+                    await self._connect_and_listen()
+                except (BleakError, BLEClientConnectionFailed, GATTFailedToNotify, asyncio.TimeoutError, OSError) as e:
+                    if not self.reconnect or not self.gate.running:
+                        raise  # Never got going, this isn't a dropped link
+                    if self.debug:
+                        LOGGER.debug(f"Connection error: {e}")
+
+                if self._stopping or not self.reconnect:
+                    break
+
+                if self._connected:
+                    # The link just dropped, start the backoff over
+                    self._disconnected_at = time.perf_counter()
+                    LOGGER.info(f"Lost the connection to {self.device.name}, reconnecting...")
+                    backoff.reset()
+
+                delay = backoff.next()
+                if self.debug:
+                    LOGGER.debug(f"Reconnecting to {self.device.address} in {delay:.1f}s (attempt {backoff.attempts})")
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self.pipeline is not None:
+                await self.pipeline.stop()
+            if self.gate.running:
+                self.gate.stop()
+
+        if self.debug:
+            LOGGER.debug(self.gate.stats)
+            LOGGER.debug(f"Controller disabled {self.gate.transitions[GATE_DISABLED]} times, "
+                         f"enabled {self.gate.transitions[GATE_ENABLED]} times")
+            if self.pipeline is not None:
+                LOGGER.debug(self.pipeline.stats)
+            if self.reconnects:
+                LOGGER.debug(f"Reconnected {self.reconnects} times, {self.downtime:.1f}s without a connection")
+
+    async def _connect_and_listen(self):
         '''
-        Connect to a chosen device
+        One connection. Returns when stop() is called or the link drops.
         '''
+        # Bounds how many reads/subscriptions are in flight at once. Without it everything is sequential.
+        limiter = asyncio.Semaphore(self.concurrency) if self.concurrency > 1 else None
+        start = time.perf_counter()
+        self._connected = False
+
         async with BleakClient(self.device.address, loop=self.loop, timeout=self.timeout) as client:
             # Make sure we're connected
             is_connected = await client.is_connected()
             if not is_connected:
                 raise BLEClientConnectionFailed()
+            self.timings["connect"] = time.perf_counter() - start
+
+            disconnected = asyncio.Event()
+            if hasattr(client, "set_disconnected_callback"):
+                # Might be called from another thread
+                client.set_disconnected_callback(lambda _: self.loop.call_soon_threadsafe(disconnected.set))
+
+            # Only touch what the plugin asked for unless we're reverse engineering a trainer
+            reads, subscriptions = None, None
+            if not self.full_enumeration:
+                reads, subscriptions = self.trainer.startup_reads(), self.trainer.subscriptions()
 
             # Parse the services and populate self.services
-            for service in client.services:
-                gatt_service = GATTService(client, service)
-                await gatt_service.parse()
-                self.services.append(gatt_service)
+            phase_start = time.perf_counter()
+            self.services = await parse_services(client, limiter, reads)
+            self._index_services()
+            self.timings["discovery"] = time.perf_counter() - phase_start
 
-                # Setup handlers for all notifications
-                await gatt_service.notify(self.trainer.notification_handler)
+            # Setup handlers for all notifications
+            phase_start = time.perf_counter()
+            handler = self.trainer.notification_handler if self.pipeline is None else self.pipeline.handler
+            await notify_services(self.services, handler, limiter, subscriptions)
+            self.timings["subscribe"] = time.perf_counter() - phase_start
 
             if self.debug:
                 for service in self.services:
-                    print(service.print_service())
-                    print("")  # For the newline
+                    LOGGER.debug(service.print_service())  # Ends with a newline, keeps them apart
+
+                LOGGER.debug(", ".join(f"{phase.capitalize()}: {secs:.3f}s" for phase, secs in self.timings.items()))
+                chars = [char for service in self.services for char in service.characteristics]
+                LOGGER.debug(f"Subscribed to {sum(char.notifying for char in chars)} of {len(chars)} characteristics, "
+                             f"read {sum(char.value is not None for char in chars)}")
+
+            if self.gate.running:
+                self.reconnects += 1
+                self.downtime += time.perf_counter() - self._disconnected_at
+                LOGGER.info(f"Reconnected to {self.device.name}")
+            else:
+                # Samples drive the gate from here on out, it keeps going through reconnects
+                LOGGER.info("Listening for notifications. Cntrl-C to exit...")
+                self.gate.start()
+            self._connected = True
 
             try:
-                # Run the main loop
-                print("Listening for notifications. Cntrl-C to exit...")
-                while 1:
-                    if not self.power_tracker.pass_fail():
-                        #
-                        # Hacky code that kindof "disables" the controller...but not really. Just makes it real hard to play
-                        #
-                        print("YOU'RE DOING BAD!!")
-                        disable_controller()
-
-                    time.sleep(0.1)
-            except KeyboardInterrupt:
-                print("Clean exit...")
+                await self._wait_for_stop_or_disconnect(client, disconnected)
             except Exception as e:
-                print(f"Unhandled exception {e}")
+                LOGGER.exception(f"Unhandled exception {e}")
+
+            if disconnected.is_set():
+                return  # Nothing to unsubscribe from
+
+            LOGGER.info("Stopping notifications. Please wait (don't hit cntrl-c again dummy, we're working on it)...")
+
+            try:
+                await stop_notify_services(self.services, limiter)
+            except GATTFailedToNotify as e:
+                # The link went while we were unsubscribing, same as a disconnect
+                LOGGER.warning(f"Couldn't stop notifications, the connection's gone: {e}")
+
+    async def _wait_for_stop_or_disconnect(self, client, disconnected):
+        '''
+        Wait to be told to stop. With reconnect on also wait for the link to
+        drop, the link is checked every LINK_CHECK seconds in case the backend
+        doesn't have a disconnected callback.
+        '''
+        if not self.reconnect:
+            await self._stop_event.wait()
+            return
 
-            print("Stopping notifications. Please wait (don't hit cntrl-c again dummy, we're working on it)...")
+        stop = self.loop.create_task(self._stop_event.wait())
+        dropped = self.loop.create_task(disconnected.wait())
+        try:
+            while not (stop.done() or dropped.done()):
+                await asyncio.wait((stop, dropped), timeout=self.LINK_CHECK, return_when=asyncio.FIRST_COMPLETED)
+                if not (stop.done() or dropped.done()) and not await self._is_connected(client):
+                    disconnected.set()
+                    break
+        finally:
+            stop.cancel()
+            dropped.cancel()
 
-            for service in self.services:
-                await service.stop_notify()
+    async def _is_connected(self, client):
+        '''
+        Some backends raise instead of saying no when the link's gone
+        '''
+        try:
+            return await client.is_connected()
+        except (BleakError, OSError) as e:
+            if self.debug:
+                LOGGER.debug(f"Link check failed: {e}")
+            return False
 
 
 class BLEScanner:
     '''
     Class to handle scanning and connecting to devices
+
+    Supported trainers are streamed as they advertise. Bleak versions with
+    BleakScanner use its detection callback, older ones get short discover()
+    rounds so devices still show up about a round after they're seen.
     '''
 
-    def __init__(self, debug=False):
+    #: Seconds per discover() round when there's no detection callback
+    ROUND = 1.0
+
+    def __init__(self, debug=False, timeout=5.0):
         # Create an event loop
         self.loop = asyncio.get_event_loop()
         self.debug = debug
+        self.timeout = timeout
 
     def scan(self):
         '''
-        Synchronous scan
+        Synchronous scan, every supported device seen in the scan window
         '''
         return self.loop.run_until_complete(self._scan())
 
+    def find(self, address=None, timeout=None):
+        '''
+        Synchronous scan that stops at the first supported device, or the one
+        with this address. None if it isn't seen in time.
+        '''
+        return self.loop.run_until_complete(self._find(address, timeout))
+
     async def _scan(self):
         '''
         Scan for Blutooth LE devices
         '''
-        ret_devices = []
+        return [dev async for dev in self.stream()]
+
+    async def _find(self, address=None, timeout=None):
+        address = address.upper() if address else None
+        devices = self.stream(timeout)
+        try:
+            async for dev in devices:
+                if address is None or dev.address.upper() == address:
+                    return dev
+        finally:
+            await devices.aclose()  # Stops the scanner now rather than whenever it's garbage collected
+        return None
+
+    async def stream(self, timeout=None):
+        '''
+        Yield supported GATTDevices as soon as they're seen, each one once
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        seen = set()
+        unsupported = set()
+
+        if BleakScanner is not None:
+            advertisements = self._advertisements(timeout)
+        else:
+            advertisements = self._discover_rounds(timeout)
+
+        try:
+            async for d, uuids in advertisements:
+                if d.address in seen:
+                    continue
+
+                # Service UUIDs can turn up in a later advertisement so unsupported devices get looked at again
+                dev = self._supported(d, uuids)
+                if dev is None:
+                    if self.debug and d.address not in unsupported:
+                        print(f"Found unsupported device: {d.name}")
+                    unsupported.add(d.address)
+                    continue
+
+                seen.add(d.address)
+                if self.debug:
+                    print(str(dev))
+                yield dev
+        finally:
+            await advertisements.aclose()
+
+    def _supported(self, d, uuids):
         loader = TrainerPluginLoader.get()
-        devices = await discover()
+        for uuid in uuids:
+            if loader.is_supported_device(uuid):
+                return GATTDevice(uuid, d, {"uuids": list(uuids)})
+        return None
 
-        for d in devices:
-            supported = False
+    async def _advertisements(self, timeout):
+        '''
+        (device, service UUIDs) from the detection callback, which might be called on another thread
+        '''
+        queue = asyncio.Queue()
+
+        def detected(d, advertisement_data=None):
+            uuids = advertisement_data.service_uuids if advertisement_data is not None else d.metadata.get("uuids", [])
+            self.loop.call_soon_threadsafe(queue.put_nowait, (d, uuids))
 
-            uuids = d.metadata.get("uuids", [])
-            for uuid in uuids:
-                if loader.is_supported_device(uuid):
-                    dev = GATTDevice(uuid, d)
-                    ret_devices.append(dev)
-                    supported = True
+        scanner = BleakScanner()
+        scanner.register_detection_callback(detected)
+        deadline = self.loop.time() + timeout
 
-                    if self.debug and supported:
-                        print(str(dev))
+        await scanner.start()
+        try:
+            while True:
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    yield await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
                     break
+        finally:
+            await scanner.stop()
 
-            if self.debug and not supported:
-                print(f"Found unsupported device: {d.name}")
+    async def _discover_rounds(self, timeout):
+        deadline = self.loop.time() + timeout
 
-        return ret_devices
+        while True:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            for d in await discover(timeout=min(self.ROUND, remaining)):
+                yield d, d.metadata.get("uuids", [])
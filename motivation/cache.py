@@ -0,0 +1,48 @@
+'''
+Small on-disk cache for things that are expensive to work out at startup
+'''
+import os
+import json
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+def cache_dir():
+    '''
+    Where cache files go. Set MOTIVATION_CACHE_DIR to override it.
+    '''
+    path = os.environ.get("MOTIVATION_CACHE_DIR")
+    if path:
+        return path
+
+    base = os.environ.get("LOCALAPPDATA") if os.name == "nt" else os.environ.get("XDG_CACHE_HOME")
+    base = base or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "motivation")
+
+
+def load(name):
+    '''
+    Load a cached JSON document, None if it's missing or unreadable
+    '''
+    try:
+        with open(os.path.join(cache_dir(), name)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def save(name, data):
+    '''
+    Save a JSON document to the cache. Failures are ignored, it's only a cache.
+    '''
+    path = os.path.join(cache_dir(), name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        with open(tmp_path, "w") as fh:
+            json.dump(data, fh)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        LOGGER.debug(f"Failed to write cache file {path}: {e}")
@@ -1,15 +1,14 @@
 '''
 Motivation CLI
+
+Only the standard library is imported up front so -h and argument errors are
+fast. BLE (bleak, asyncio, plugins, controller backends) and everything else is
+imported by the sub-command that needs it.
 '''
 import os
 import sys
-import asyncio
 import logging
 import argparse
-import traceback
-
-from motivation.ble import BLEScanner, BLEClient, BLEClientConnectionFailed
-from motivation.power import RawPowerTracker, AveragePowerTracker
 
 
 def clear_screen():
@@ -61,29 +60,352 @@ def select_device(scanner):
     return device
 
 
-def main_cli():
+#: Cache file for the last device ridden, used by --last
+LAST_DEVICE = "last-device.json"
+
+
+def find_device(scanner, args):
     '''
-    Entry Point
+    Stop scanning as soon as the trainer asked for shows up, otherwise let the user pick
+    '''
+    from motivation import cache
+
+    address = args.address
+    if args.last:
+        last = cache.load(LAST_DEVICE) or {}
+        address = last.get("address")
+        if not address:
+            print("No trainer has been used yet, pick one.")
+
+    if not address and not args.first:
+        device = select_device(scanner)
+    else:
+        print(f"Looking for {address or 'the first compatible device'}...")
+        device = scanner.find(address)
+        if device is None:
+            print(f"{address or 'No compatible device'} wasn't found. Is it awake?")
+            sys.exit(1)
+        print(f"Found: {device.name} ({device.address})")
+
+    cache.save(LAST_DEVICE, {"address": device.address, "name": device.name})
+    return device
+
+
+def select_devices(scanner):
+    '''
+    Allow the user to select several devices from one scan
+    '''
+    clear_screen()
+
+    while 1:
+        print("Looking for compatible devices...")
+
+        devices = scanner.scan()
+
+        print("\nChoose your devices:")
+        print("\t0. Rescan")
+        for idx, d in enumerate(devices):
+            print(f"\t{idx + 1}. {d.name} ({d.address})")
+
+        try:
+            choice = input("\nWhich devices (e.g. 1 3 4, or all)? ").strip()
+        except KeyboardInterrupt:
+            print("Exit...")
+            sys.exit(0)
+
+        if choice == "0":
+            clear_screen()
+            continue
+        break
+
+    if choice.lower() == "all":
+        choices = list(range(1, len(devices) + 1))
+    else:
+        try:
+            choices = [int(c) for c in choice.replace(",", " ").split()]
+            if not choices or any(c > len(devices) or c < 1 for c in choices):
+                raise ValueError("no")
+        except ValueError:
+            print("Invalid. You're bad at computers.")
+            sys.exit(1)
+
+    selected = [devices[c - 1] for c in sorted(set(choices))]
+    print(f"Choice: {', '.join(d.name for d in selected)}")
+    return selected
+
+
+#: Sub-commands. Without one the command line is treated as "ride" like it always was
+COMMANDS = ("ride", "group", "replay", "analyze")
+
+
+def threshold_arg(value):
+    '''
+    Watts, anything else is a workout
+    '''
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def create_parser():
+    '''
+    Build the argument parser
     '''
     parser = argparse.ArgumentParser("Fit Gaming Motivation!", description="Keeps you motivated while gaming or you can't game.")
-    parser.add_argument("-t", "--timeout", action="store", type=int, help="Connection timeout", required=False, default=10)
-    parser.add_argument("-w", "--write-out", action="store", help="Record raw data in this directory", default="data")
-    parser.add_argument("-d", "--debug", action="store_true", help="Enable debug logging to stdout")
-    parser.add_argument("-v", "--verbose", action="store_true", help="More output. This will include Bleak library output.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    # Shared by the sub-commands
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-d", "--debug", action="store_true", help="Enable debug logging to stdout")
+    common.add_argument("-v", "--verbose", action="store_true", help="More output. This will include Bleak library output.")
+    common.add_argument("--metrics-port", action="store", type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    common.add_argument("--dashboard-port", action="store", type=int, help="Serve a live dashboard on http://127.0.0.1:PORT/")
+    common.add_argument("--dashboard-fps", action="store", type=float, default=10.0, help="Dashboard updates per second")
+    common.add_argument("--status-rate", action="store", type=float, default=2.0,
+                        help="Times a second the status line is redrawn, 0 turns it off. Only shown on a terminal without -d")
+    common.add_argument("--stats-interval", action="store", type=float, help="Print pipeline metrics every STATS_INTERVAL seconds")
+
+    group = common.add_mutually_exclusive_group(required=True)
+    group.add_argument("-p", "--power-threshold", action="store", type=threshold_arg, metavar="WATTS|WORKOUT",
+                       help="Under this value you can't play games. A workout file (or the name of one in your config) changes it as you ride")
+    group.add_argument("-a", "--average-power", action="store", type=threshold_arg, metavar="WATTS|WORKOUT",
+                       help="Under this average power or you can't play. Takes a workout like -p")
+    common.add_argument("--ftp", action="store", type=float, help="FTP for workouts with percentages. Defaults to the one in your profile")
+    common.add_argument("-m", "--average-mode", action="store", choices=["session", "rolling", "ewma", "normalized"], default="session",
+                        help="How -a/--average-power is averaged. Whole session, rolling window, exponentially weighted or Normalized Power")
+    common.add_argument("-W", "--window", action="store", type=float, default=30.0,
+                        help="Seconds for the rolling window or the EWMA time constant")
+    common.add_argument("-H", "--hysteresis", action="store", type=float, nargs=2, default=(0.0, 0.0), metavar=("BELOW", "ABOVE"),
+                        help="Watts below the threshold before the controller is disabled and above it before it's enabled again")
+    common.add_argument("-D", "--dwell", action="store", type=float, default=0.0,
+                        help="Minimum seconds the controller stays enabled/disabled before it can change again")
+
+    # Shared by the sub-commands that connect to trainers
+    connect = argparse.ArgumentParser(add_help=False)
+    connect.add_argument("-t", "--timeout", action="store", type=int, help="Connection timeout", required=False, default=10)
+    connect.add_argument("-S", "--scan-timeout", action="store", type=float, default=5.0, help="Seconds to scan for devices")
+    connect.add_argument("-w", "--write-out", action="store", help="Record raw data in this directory", default="data")
+    connect.add_argument("-s", "--stale-timeout", action="store", type=float, help="Seconds without power data before the controller is disabled", default=3.0)
+    connect.add_argument("-r", "--reconnect", action="store_true", help="Reconnect if the trainer drops the connection instead of exiting")
+    connect.add_argument("-B", "--max-backoff", action="store", type=float, default=30.0,
+                         help="Longest wait in seconds between reconnect attempts")
+    connect.add_argument("-q", "--queue-size", action="store", type=int, default=0,
+                         help="Queue up to QUEUE_SIZE notifications and decode them in batches instead of in the BLE callback")
+    connect.add_argument("--overflow", action="store", choices=["coalesce", "drop-oldest", "block"], default="coalesce",
+                         help="What to do when the queue is full. Keep the latest from each sender, drop the oldest or wait for room")
+    connect.add_argument("--full-enumeration", action="store_true",
+                         help="Read every characteristic and descriptor and subscribe to everything, not just what the trainer plugin uses. "
+                              "With -d unknown notifications are dumped, handy for adding a new trainer")
+    connect.add_argument("-P", "--acquisition-process", action="store_true",
+                         help="Connect and decode in a separate process that hands samples over in shared memory, so the gate, "
+                              "recording and UI don't share a core with the BLE stack. Needs Python 3.8+")
+    connect.add_argument("-c", "--concurrency", action="store", type=int, help="Max BLE reads/subscriptions in flight while connecting. 1 does them one at a time", default=4)
+
+    ride = subparsers.add_parser("ride", parents=[common, connect], help="Connect to a trainer and ride (default)")
+    found = ride.add_mutually_exclusive_group()
+    found.add_argument("-A", "--address", action="store", help="Connect to the trainer with this address as soon as it's seen")
+    found.add_argument("-f", "--first", action="store_true", help="Connect to the first compatible trainer seen")
+    found.add_argument("-l", "--last", action="store_true", help="Connect to the last trainer used as soon as it's seen")
+    ride.add_argument("-g", "--gamepad", action="store", help="Gamepad device to gate on Linux, e.g. /dev/input/event5. Found automatically by default")
+
+    subparsers.add_parser("group", parents=[common, connect],
+                          help="Connect to several trainers at once and report on every rider. The controller isn't touched")
+
+    replay = subparsers.add_parser("replay", parents=[common], help="Replay recorded sessions without a trainer")
+    replay.add_argument("sessions", nargs="+", help="Session files recorded with -w/--write-out")
+    replay.add_argument("-x", "--speed", action="store", type=float, default=1.0,
+                        help="Replay speed. 1 is real time, 10 is 10x, 0 is as fast as possible")
 
-    group = parser.add_mutually_exclusive_group(required=True)
-    group.add_argument("-p", "--power-threshold", action="store", type=int, help="Under this value you can't play games")
-    group.add_argument("-a", "--average-power", action="store", type=int, help="Under this average power or you can't play")
-    args = parser.parse_args()
+    analyze = subparsers.add_parser("analyze", help="Power curve, zones, NP/IF/TSS and threshold suggestions from recorded sessions")
+    analyze.add_argument("sessions", nargs="*", default=["data"], help="Session files or directories of them (default: data)")
+    analyze.add_argument("-d", "--debug", action="store_true", help="Enable debug logging to stdout")
+    analyze.add_argument("-v", "--verbose", action="store_true", help="More output")
+    analyze.add_argument("-f", "--ftp", action="store", type=float, help="Functional Threshold Power. Defaults to the one in your profile or estimated from your best 20 minutes")
+    threshold = analyze.add_mutually_exclusive_group()
+    threshold.add_argument("-p", "--power-threshold", action="store", type=int, help="Show when power was under this value")
+    threshold.add_argument("-a", "--average-power", action="store", type=int,
+                           help="Show when the recorded effective (average) power was under this value")
+
+    return parser
+
+
+def setup_logging(args):
+    '''
+    Setup logging. Records go through a queue to stdout so nothing waits on the
+    console, stop() what's returned to flush it.
+    '''
+    from motivation.console import ConsoleLogging
 
-    # Setup logging
     level = logging.DEBUG if args.verbose else logging.INFO
-    root_logger = logging.getLogger()
-    root_logger.setLevel(level)
-    log_stdout_handler = logging.StreamHandler(sys.stdout)
-    log_stdout_handler.setLevel(level)
-    root_logger.addHandler(log_stdout_handler)
+    console_logging = ConsoleLogging(level, debug_loggers=("motivation",) if args.debug else ())
+    console_logging.start()
+    return console_logging
+
+
+def flush_logging():
+    '''
+    Make sure queued log messages are out before printing a summary
+    '''
+    from motivation.console import ConsoleLogging
+
+    console_logging = ConsoleLogging.get()
+    if console_logging is not None:
+        console_logging.flush()
+
+
+def start_status(args):
+    '''
+    Start the status line if stdout is a terminal. Not with -d, the debug output would scroll it away.
+    '''
+    if not args.status_rate or args.debug or not sys.stdout.isatty():
+        return None
+
+    import asyncio
+    from motivation.console import Console, StatusLine
+
+    status = StatusLine(Console.get(), asyncio.get_event_loop(), args.status_rate)
+    status.start()
+    return status
+
+
+def client_class(args):
+    '''
+    BLEClient, or AcquisitionClient with -P/--acquisition-process
+    '''
+    if not args.acquisition_process:
+        from motivation.ble import BLEClient
+        return BLEClient
+
+    # Anything else that's missing (bleak, say) is a real error, not the Python version
+    import importlib.util
+    if importlib.util.find_spec("multiprocessing.shared_memory") is None:
+        print("-P/--acquisition-process needs Python 3.8 or later for multiprocessing.shared_memory")
+        sys.exit(1)
 
+    from motivation.acquisition import AcquisitionClient
+    return AcquisitionClient
+
+
+def create_tracker(args):
+    '''
+    Create the power tracker the user asked for
+    '''
+    from motivation.power import RawPowerTracker, AveragePowerTracker, RollingPowerTracker, EWMAPowerTracker
+    from motivation.power import NormalizedPowerTracker
+
+    schedule = load_schedule(args)
+    # A workout starts at its first target
+    req_power = schedule.target(0) if schedule is not None else args.power_threshold or args.average_power
+
+    if args.power_threshold:
+        tracker = RawPowerTracker(req_power)
+    elif args.average_power and args.average_mode == "rolling":
+        tracker = RollingPowerTracker(req_power, args.window)
+    elif args.average_power and args.average_mode == "ewma":
+        tracker = EWMAPowerTracker(req_power, args.window)
+    elif args.average_power and args.average_mode == "normalized":
+        tracker = NormalizedPowerTracker(req_power)
+    elif args.average_power:
+        tracker = AveragePowerTracker(req_power)
+    else:
+        print("One of -a/--average-power or -p/--power-threshold are required.")
+        sys.exit(1)
+
+    if schedule is not None:
+        tracker.set_schedule(schedule)
+    return tracker
+
+
+_schedules = {}
+
+
+def load_schedule(args):
+    '''
+    The workout from -p/-a if it's not a number, compiled once per run
+    '''
+    name = args.power_threshold or args.average_power
+    if not isinstance(name, str):
+        return None
+
+    if name not in _schedules:
+        from motivation.config import load_workout, InvalidConfig
+        from motivation.workout import InvalidWorkout
+
+        try:
+            schedule = load_workout(name, args.ftp)
+        except (InvalidConfig, InvalidWorkout) as e:
+            print(f"Can't load workout {name}: {e}")
+            sys.exit(1)
+
+        minutes, seconds = divmod(int(schedule.duration), 60)
+        print(f"Workout {schedule.name}: {minutes}:{seconds:02d} long, {len(schedule) - 1} steps")
+        _schedules[name] = schedule
+
+    return _schedules[name]
+
+
+def start_metrics(args):
+    '''
+    Turn on metrics if they were asked for. Returns what needs stopping when we're done.
+    '''
+    if not args.metrics_port and not args.stats_interval:
+        return []
+
+    from motivation import metrics
+    metrics.enable()
+    started = []
+
+    if args.metrics_port:
+        server = metrics.MetricsServer(args.metrics_port)
+        try:
+            server.start()
+        except OSError as e:
+            print(f"Failed to serve metrics on port {args.metrics_port}: {e}")
+            sys.exit(1)
+        print(f"Metrics at http://{server.host}:{server.port}/metrics")
+        started.append(server)
+
+    if args.stats_interval:
+        dumper = metrics.StatsDumper(args.stats_interval)
+        dumper.start()
+        started.append(dumper)
+
+    return started
+
+
+def stop_metrics(args, started):
+    for thing in started:
+        thing.stop()
+
+    if args.stats_interval:
+        from motivation import metrics
+        print(metrics.REGISTRY.summary())
+
+
+def start_dashboard(args):
+    '''
+    Start the dashboard if it was asked for, riders get added to it once they're set up
+    '''
+    if not args.dashboard_port:
+        return None
+
+    from motivation.dashboard import DashboardServer
+
+    dashboard = DashboardServer(args.dashboard_port, fps=args.dashboard_fps)
+    try:
+        dashboard.start()
+    except OSError as e:
+        print(f"Failed to serve the dashboard on port {args.dashboard_port}: {e}")
+        sys.exit(1)
+    print(f"Dashboard at http://{dashboard.host}:{dashboard.port}/")
+    return dashboard
+
+
+def ride_cli(args):
+    '''
+    Connect to a trainer and gate the controller
+    '''
     # Validate some arguments
     if not os.path.isdir(args.write_out):
         try:
@@ -92,37 +414,232 @@ def main_cli():
             print(f"Failed to create directory for output data: {e}")
             sys.exit(1)
 
-    tracker = None
+    tracker = create_tracker(args)
+    client_cls = client_class(args)
 
-    if args.power_threshold:
-        tracker = RawPowerTracker(args.power_threshold)
-    elif args.average_power:
-        tracker = AveragePowerTracker(args.average_power)
-    else:
-        print("One of -a/--average-power or -p/--power-threshold are required.")
+    from motivation.ble import BLEScanner, BLEClientConnectionFailed
+    from motivation.controller import open_controller, close_controller, ControllerUnavailable
+    from motivation.recorder import SessionRecorder
+
+    scanner = BLEScanner(debug=args.debug, timeout=args.scan_timeout)
+
+    # Get the user's device selection
+    device = find_device(scanner, args)
+
+    dashboard = status = None
+    failure = None
+    try:
+        # Datetime stamped file for this activity, created when the recording starts
+        recorder = SessionRecorder(args.write_out, device.uuid, device.name)
+
+        # Run the ble code
+        client = client_cls(device, tracker, args.timeout, args.debug, args.stale_timeout, args.concurrency, recorder,
+                            args.hysteresis[0], args.hysteresis[1], args.dwell, reconnect=args.reconnect,
+                            max_backoff=args.max_backoff, queue_size=args.queue_size, overflow=args.overflow,
+                            full_enumeration=args.full_enumeration)
+
+        dashboard = start_dashboard(args)
+        if dashboard is not None:
+            dashboard.add_source(device.name, tracker, client.gate)
+
+        status = start_status(args)
+        if status is not None:
+            status.add_source(device.name, tracker, client.gate)
+
+        # Opened once the client is built so nothing before here can exit with the gamepad grabbed
+        open_controller(args.gamepad)
+        with recorder:
+            client.run()
+    except ControllerUnavailable as e:
+        failure = str(e)
+    except BLEClientConnectionFailed:
+        failure = f"Failed to connect to device {device.name} ({device.address}). Try again with a longer timeout."
+    finally:
+        close_controller()
+        if status is not None:
+            status.stop()
+        if dashboard is not None:
+            dashboard.stop()
+
+    if failure is not None:
+        print(failure)
         sys.exit(1)
 
-    # TODO: Create a recorder object. Recorder object will create datetime stamped files for this activity
+    flush_logging()
+    print(f"Recorded {recorder.written} records to {recorder.path}")
+    if recorder.error is not None:
+        print(f"Recording stopped early: {recorder.error}")
 
-    scanner = BLEScanner(debug=args.debug)
 
-    # Get the user's device selection
-    device = select_device(scanner)
+def group_cli(args):
+    '''
+    Connect to several trainers on one event loop, each rider gets their own tracker and gate
+    '''
+    if not os.path.isdir(args.write_out):
+        try:
+            os.mkdir(args.write_out)
+        except OSError as e:
+            print(f"Failed to create directory for output data: {e}")
+            sys.exit(1)
+
+    from motivation.ble import BLEScanner
+    from motivation.recorder import SessionRecorder
+    from motivation.session import SessionManager
+
+    client_cls = client_class(args)
+    scanner = BLEScanner(debug=args.debug, timeout=args.scan_timeout)
+    devices = select_devices(scanner)
+
+    manager = SessionManager(debug=args.debug)
+    for device in devices:
+        recorder = SessionRecorder(args.write_out, device.uuid, device.name, tag=device.address)
+        manager.add(device, create_tracker(args), recorder, client_cls=client_cls, timeout=args.timeout,
+                    stale_timeout=args.stale_timeout, concurrency=args.concurrency, lower_band=args.hysteresis[0],
+                    upper_band=args.hysteresis[1], min_dwell=args.dwell, reconnect=args.reconnect, max_backoff=args.max_backoff,
+                    queue_size=args.queue_size, overflow=args.overflow, full_enumeration=args.full_enumeration)
+
+    dashboard = start_dashboard(args)
+    if dashboard is not None:
+        for session in manager:
+            dashboard.add_source(session.name, session.power_tracker, session.gate)
 
-    # Run the ble code
-    client = BLEClient(device, tracker, args.timeout, args.debug)
+    status = start_status(args)
+    if status is not None:
+        for session in manager:
+            status.add_source(session.name, session.power_tracker, session.gate)
 
     try:
-        client.run()
-    except BLEClientConnectionFailed:
-        print(f"Failed to connect to device {device.name} ({device.address}). Try again with a longer timeout.")
+        manager.run()
+    finally:
+        if status is not None:
+            status.stop()
+        if dashboard is not None:
+            dashboard.stop()
+
+    flush_logging()
+    print(manager.report())
+
+
+def replay_cli(args):
+    '''
+    Feed recorded sessions through the trainer plugin, tracker and gate
+    '''
+    from motivation.recorder import SessionReader, InvalidSessionFile
+    from motivation.replay import ReplayClient, UnsupportedSession
+
+    dashboard = start_dashboard(args)
+
+    for path in args.sessions:
+        tracker = create_tracker(args)
+
+        try:
+            reader = SessionReader(path)
+        except (OSError, InvalidSessionFile) as e:
+            print(f"Failed to open {path}: {e}")
+            sys.exit(1)
+
+        with reader:
+            try:
+                client = ReplayClient(reader, tracker, args.speed, args.debug, args.hysteresis[0], args.hysteresis[1], args.dwell)
+            except UnsupportedSession as e:
+                print(f"Can't replay {path}: {e}")
+                sys.exit(1)
+
+            if dashboard is not None:
+                dashboard.add_source(reader.header.device_name, tracker, client.gate)
+
+            print(f"Replaying {path} ({reader.header.device_name})...")
+            stats = client.run()
+            flush_logging()
+
+            if dashboard is not None:
+                dashboard.remove_source(tracker)
+
+        print(stats)
+        print(f"Effective power: {tracker.get_effective_power():.1f}w, {client.gate.stats}")
+        if args.debug:
+            for timestamp, state, eff_power in client.gate.history:
+                print(f"\t{timestamp:8.1f}s {state} ({eff_power:.1f}w)")
+
+    if dashboard is not None:
+        dashboard.stop()
+
+
+def analyze_cli(args):
+    '''
+    Crunch the numbers on recorded sessions
+    '''
+    try:
+        from motivation.analytics import Analysis, session_files, report
+    except ImportError as e:
+        print(f"analyze needs NumPy: {e}")
         sys.exit(1)
+    from motivation.recorder import InvalidSessionFile
+
+    paths = session_files(args.sessions)
+    if not paths:
+        print(f"No sessions found in {', '.join(args.sessions)}")
+        sys.exit(1)
+
+    ftp = args.ftp
+    if not ftp:
+        from motivation.config import profile_ftp, InvalidConfig
+
+        try:
+            ftp = profile_ftp()
+        except InvalidConfig as e:
+            print(e)
+
+    threshold = args.power_threshold or args.average_power
+    analysis = Analysis(ftp=ftp, threshold=threshold, average=bool(args.average_power))
+
+    for path in paths:
+        try:
+            analysis.add(path)
+        except (OSError, InvalidSessionFile) as e:
+            print(f"Skipping {path}: {e}")
+
+    zones = analysis.finish()
+    print(report(analysis, zones))
+
+
+def main_cli(argv=None):
+    '''
+    Entry Point
+    '''
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ("-h", "--help")):
+        argv.insert(0, "ride")
+
+    args = create_parser().parse_args(argv)
+    console_logging = setup_logging(args)
+
+    try:
+        if args.command == "analyze":
+            analyze_cli(args)
+            return
+
+        started = start_metrics(args)
+
+        try:
+            if args.command == "replay":
+                replay_cli(args)
+            elif args.command == "group":
+                group_cli(args)
+            else:
+                ride_cli(args)
+        finally:
+            stop_metrics(args, started)
+    finally:
+        console_logging.stop()
 
 
 if __name__ == "__main__":
     try:
         main_cli()
     except Exception as e:
+        import traceback
+
         # Catch any unhandled exceptions and create a bug report file
         bugreport = os.path.join(os.path.expanduser("~"), "motivation_bugreport.txt")
 
@@ -1,3 +1,96 @@
 '''
 Handles the config file for Motivation
+
+The config directory has config.json (your profile, e.g. {"ftp": 250}) and a
+workouts directory of workout files (see motivation.workout). Only the
+workout that's asked for is read and compiled, which is quick even for a long
+one, so there's nothing cached.
 '''
+import os
+import json
+
+from motivation.workout import InvalidWorkout, compile_workout
+
+CONFIG_FILE = "config.json"
+WORKOUTS_DIR = "workouts"
+WORKOUT_EXT = ".json"
+
+_config = None
+
+
+class InvalidConfig(Exception):
+    pass
+
+
+def config_dir():
+    '''
+    Where the config lives. Set MOTIVATION_CONFIG_DIR to override it.
+    '''
+    path = os.environ.get("MOTIVATION_CONFIG_DIR")
+    if path:
+        return path
+
+    base = os.environ.get("APPDATA") if os.name == "nt" else os.environ.get("XDG_CONFIG_HOME")
+    base = base or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "motivation")
+
+
+def load_config():
+    '''
+    The config file as a dict, empty if there isn't one. Only read once.
+    '''
+    global _config
+    if _config is None:
+        try:
+            with open(os.path.join(config_dir(), CONFIG_FILE)) as fh:
+                config = json.load(fh)
+        except FileNotFoundError:
+            config = {}
+        except (OSError, ValueError) as e:
+            raise InvalidConfig(f"Can't read {CONFIG_FILE}: {e}")
+        if not isinstance(config, dict):
+            raise InvalidConfig(f"{CONFIG_FILE} should be an object")
+        _config = config
+    return _config
+
+
+def profile_ftp():
+    '''
+    FTP from the profile, None if it isn't set
+    '''
+    return load_config().get("ftp")
+
+
+def find_workout(name):
+    '''
+    Path to a workout file, either a path or the name of one in the workouts directory
+    '''
+    if os.path.isfile(name):
+        return name
+
+    library = os.path.join(config_dir(), WORKOUTS_DIR)
+    for candidate in (name, name + WORKOUT_EXT):
+        path = os.path.join(library, candidate)
+        if os.path.isfile(path):
+            return path
+
+    raise InvalidWorkout(f"No workout called {name}, workouts go in {library}")
+
+
+def load_workout(name, ftp=None):
+    '''
+    Compiled Schedule for a workout. Percentages are of `ftp`, the workout's or the profile's.
+    '''
+    path = find_workout(name)
+    ftp = ftp or profile_ftp()
+
+    try:
+        with open(path) as fh:
+            workout = json.load(fh)
+    except (OSError, ValueError) as e:
+        raise InvalidWorkout(f"Can't read {path}: {e}")
+
+    schedule = compile_workout(workout, ftp)
+    if not schedule.name:
+        schedule.name = os.path.splitext(os.path.basename(path))[0]
+    return schedule
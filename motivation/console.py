@@ -0,0 +1,182 @@
+'''
+Console output that stays off the notification path
+
+Log records are put on a bounded queue and written to the terminal by a
+QueueListener thread, so logging from a BLE callback never waits on a slow
+console. If the terminal can't keep up records are dropped (and counted)
+rather than queued forever. A StatusLine redraws one line in place at a fixed
+rate with the latest power, effective power and controller state, however
+fast samples come in.
+'''
+import sys
+import queue
+import shutil
+import logging
+import threading
+import logging.handlers
+
+#: Most log records waiting for the console before new ones are dropped
+MAX_QUEUED = 1000
+
+
+class Console:
+    '''
+    Owns the terminal: log messages scroll above the status line
+    '''
+
+    _instance = None
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.lock = threading.Lock()
+        self.status = ""
+        Console._instance = self
+
+    @classmethod
+    def get(cls):
+        '''
+        The last console created, None if there isn't one
+        '''
+        return cls._instance
+
+    def write(self, message):
+        with self.lock:
+            if self.status:
+                self.out.write("\r" + " " * len(self.status) + "\r")
+            self.out.write(message + "\n")
+            if self.status:
+                self.out.write(self.status)
+            self.out.flush()
+
+    def set_status(self, text):
+        text = text[:shutil.get_terminal_size().columns - 1]  # A wrapped line can't be redrawn
+        with self.lock:
+            if text == self.status:
+                return
+            # Pad with spaces rather than ANSI erase codes so old Windows consoles work
+            self.out.write("\r" + text.ljust(len(self.status)))
+            self.out.flush()
+            self.status = text
+
+    def clear_status(self):
+        with self.lock:
+            if self.status:
+                self.out.write("\r" + " " * len(self.status) + "\r")
+                self.out.flush()
+                self.status = ""
+
+
+class ConsoleHandler(logging.Handler):
+    '''
+    Writes records to a Console, runs on the listener thread
+    '''
+
+    def __init__(self, console):
+        super().__init__()
+        self.console = console
+
+    def emit(self, record):
+        try:
+            self.console.write(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    QueueHandler that drops records when the queue is full instead of growing it
+    '''
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ConsoleLogging:
+    '''
+    Routes the root logger through a queue to the console. stop() flushes what's left.
+    '''
+
+    _instance = None
+
+    def __init__(self, level=logging.INFO, debug_loggers=(), console=None, max_queued=MAX_QUEUED):
+        self.console = console or Console()
+        self.handler = DroppingQueueHandler(queue.Queue(max_queued))
+        self.listener = logging.handlers.QueueListener(self.handler.queue, ConsoleHandler(self.console))
+        self.level = level
+        self.debug_loggers = debug_loggers
+        ConsoleLogging._instance = self
+
+    @classmethod
+    def get(cls):
+        return cls._instance
+
+    def flush(self):
+        '''
+        Wait for everything logged so far to be written, so a print() after this comes after it
+        '''
+        self.handler.queue.join()
+
+    def start(self):
+        root_logger = logging.getLogger()
+        root_logger.setLevel(self.level)
+        root_logger.addHandler(self.handler)
+        for name in self.debug_loggers:
+            logging.getLogger(name).setLevel(logging.DEBUG)
+        self.listener.start()
+
+    def stop(self):
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        self.console.clear_status()
+        if self.handler.dropped:
+            self.console.write(f"Dropped {self.handler.dropped} log messages, the console couldn't keep up")
+
+
+class StatusLine:
+    '''
+    Redraws the console's status line `rate` times a second from the event loop
+    '''
+
+    def __init__(self, console, loop, rate=2.0):
+        self.console = console
+        self.loop = loop
+        self.rate = rate
+        self.sources = []
+        self._timer = None
+
+    def add_source(self, name, power_tracker, gate):
+        self.sources.append((name, power_tracker, gate))
+
+    def remove_source(self, power_tracker):
+        self.sources = [source for source in self.sources if source[1] is not power_tracker]
+
+    def start(self):
+        self._timer = self.loop.call_later(1 / self.rate, self._tick)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.console.clear_status()
+
+    def render(self):
+        '''
+        The status text for every source
+        '''
+        parts = []
+        for name, tracker, gate in self.sources:
+            text = (f"{tracker.power:4.0f}w  Effective {tracker.get_effective_power():6.1f}w / "
+                    f"{tracker.get_required_power():.0f}w  Controller {gate.state}")
+            parts.append(f"{name}: {text}" if len(self.sources) > 1 else text)
+        return " | ".join(parts)
+
+    def _tick(self):
+        self._timer = self.loop.call_later(1 / self.rate, self._tick)
+        self.console.set_status(self.render())
@@ -1,28 +1,87 @@
 '''
 OS Agnostive controller disabling functionality
+
+The platform backend is imported and set up the first time it's used, not at
+import time, and only once.
 '''
 import os
 
 
+class ControllerUnavailable(Exception):
+    pass
+
+
+class ControllerBackend:
+    '''
+    The platform functions that enable/disable the controller
+    '''
+
+    def __init__(self, name, disable, enable, open=None, close=None):
+        self.name = name
+        self.disable = disable
+        self.enable = enable
+        self.open = open  # Optional, sets up anything the backend holds on to
+        self.close = close
+
+
+_backend = None
+
+
+def get_backend():
+    '''
+    Get the backend for this platform
+    '''
+    global _backend
+
+    if _backend is None:
+        if os.name == "nt":
+            from motivation.controller.win32 import win32_disable_controller, win32_enable_controller
+            from motivation.controller.win32 import win32_close_controller
+            _backend = ControllerBackend("win32", win32_disable_controller, win32_enable_controller,
+                                         close=win32_close_controller)
+        else:
+            from motivation.controller.unix import unix_disable_controller, unix_enable_controller
+            from motivation.controller.unix import unix_open_controller, unix_close_controller
+            _backend = ControllerBackend("unix", unix_disable_controller, unix_enable_controller,
+                                         unix_open_controller, unix_close_controller)
+
+    return _backend
+
+
 def disable_controller():
     '''
     Disabled the controller
     '''
-    if os.name == "nt":
-        from motivation.controller.win32 import win32_disable_controller
-        win32_disable_controller()
-    else:
-        from motivation.controller.unix import unix_disable_controller
-        unix_disable_controller()
+    (_backend or get_backend()).disable()
 
 
 def enable_controller():
     '''
     Re-enables the controller
     '''
-    if os.name == "nt":
-        from motivation.controller.win32 import win32_enable_controller
-        win32_enable_controller()
-    else:
-        from motivation.controller.unix import unix_enable_controller
-        unix_enable_controller()
+    (_backend or get_backend()).enable()
+
+
+def open_controller(device=None):
+    '''
+    Set the backend up before riding so any problem shows up now rather than
+    on the first disable. device is the controller to use, for backends that
+    work on a specific one.
+    '''
+    backend = _backend or get_backend()
+    if backend.open is None:
+        return
+
+    try:
+        backend.open(device)
+    except (ImportError, OSError) as e:
+        raise ControllerUnavailable(f"Can't open the controller with the {backend.name} backend: {e}")
+
+
+def close_controller():
+    '''
+    Release anything the backend is holding on to
+    '''
+    backend = _backend or get_backend()
+    if backend.close is not None:
+        backend.close()
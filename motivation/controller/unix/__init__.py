@@ -1,11 +1,213 @@
 '''
-Unix methods for enabling/disabling a controller
+Linux methods for enabling/disabling a controller
+
+The gamepad's evdev device is opened and grabbed once so nothing else sees its
+input, and a uinput virtual copy of it is created for games to use instead.
+A thread forwards every event from the real device to the virtual one while
+the controller is enabled and drops them while it's disabled, so a gate change
+takes effect on the very next input event. Disabling also lets go of every
+button and puts the sticks and triggers back at rest, so nothing held down
+keeps the game going. Needs the evdev package and access to /dev/input and
+/dev/uinput.
 '''
+import os
+import select
+import logging
+import threading
+
+from motivation.controller import ControllerUnavailable
+
+LOGGER = logging.getLogger(__name__)
+
+#: Set this to the gamepad's /dev/input/event* path to skip looking for one
+GAMEPAD_ENV = "MOTIVATION_GAMEPAD"
+
+
+class GamepadNotFound(ControllerUnavailable):
+    pass
+
+
+class EvdevProxy:
+    '''
+    Forwards input from a grabbed evdev device to a uinput device while enabled.
+    evdev can be swapped for a stand-in with the same InputDevice, UInput,
+    ecodes and list_devices names, like motivation.fakeevdev.
+    '''
+
+    def __init__(self, path=None, evdev=None):
+        if evdev is None:
+            import evdev
+        self.evdev = evdev
+        self.path = path or os.environ.get(GAMEPAD_ENV) or self.find_gamepad()
+        self.enabled = True
+        self.forwarded = 0
+        self.dropped = 0
+        self.device = None
+        self.uinput = None
+        self._pressed = set()  # Keys/buttons the virtual device has down
+        self._rest = {}  # Absolute axis -> the value it has when nothing's touching it
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = None  # Pipe that tells the forwarding thread to stop
+
+    def find_gamepad(self):
+        '''
+        The first input device with gamepad buttons
+        '''
+        ecodes = self.evdev.ecodes
+        for path in sorted(self.evdev.list_devices()):
+            device = self.evdev.InputDevice(path)
+            try:
+                if ecodes.BTN_GAMEPAD in device.capabilities().get(ecodes.EV_KEY, []):
+                    return path
+            finally:
+                device.close()
+        raise GamepadNotFound(f"No gamepad found, set {GAMEPAD_ENV} to its /dev/input/event* device")
+
+    def open(self):
+        '''
+        Open and grab the gamepad, create the virtual one and start forwarding
+        '''
+        device = self.evdev.InputDevice(self.path)
+        try:
+            device.grab()
+            self.uinput = self.evdev.UInput.from_device(device, name=f"{device.name} (motivation)")
+        except Exception:
+            device.close()  # Ungrabs it too
+            raise
+        self.device = device
+        self._rest = self._rest_positions()
+        LOGGER.debug(f"Proxying {self.device.name} ({self.path})")
+
+        self._wakeup = os.pipe()
+        self._thread = threading.Thread(target=self._forward, name="evdev-proxy", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        '''
+        Stop forwarding and release the gamepad
+        '''
+        if self.device is None:
+            return
+
+        if self._thread is not None:
+            os.write(self._wakeup[1], b"\0")
+            self._thread.join()
+        for fd in self._wakeup:
+            os.close(fd)
+
+        self.enable()
+        try:
+            self.device.ungrab()
+        except OSError:
+            pass  # Unplugged
+        self.device.close()
+        self.uinput.close()
+        self.device = self.uinput = self._thread = self._wakeup = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        '''
+        Drop input from now on. Anything that's held down is let go of and the
+        axes go back to rest so the game doesn't see a button stuck on or a
+        stick still pushed.
+        '''
+        ecodes = self.evdev.ecodes
+        with self._lock:
+            self.enabled = False
+            if self.uinput is None:
+                return
+
+            for code in self._pressed:
+                self.uinput.write(ecodes.EV_KEY, code, 0)
+            for code, value in self._rest.items():
+                self.uinput.write(ecodes.EV_ABS, code, value)
+            self.uinput.syn()
+            self._pressed.clear()
+
+    def _rest_positions(self):
+        '''
+        Where each absolute axis sits untouched, from its absinfo. Triggers rest
+        at their minimum, sticks and hats in the middle of their range.
+        '''
+        ecodes = self.evdev.ecodes
+        triggers = {ecodes.ABS_Z, ecodes.ABS_RZ, ecodes.ABS_GAS, ecodes.ABS_BRAKE}
+        rest = {}
+
+        for code, absinfo in self.device.capabilities().get(ecodes.EV_ABS, []):
+            if code in triggers:
+                rest[code] = absinfo.min
+            elif absinfo.min <= 0 <= absinfo.max:
+                rest[code] = 0
+            else:
+                rest[code] = (absinfo.min + absinfo.max) // 2
+        return rest
+
+    def _forward(self):
+        ev_key = self.evdev.ecodes.EV_KEY
+        device = self.device
+        wakeup = self._wakeup[0]
+
+        while True:
+            readable = select.select([device.fd, wakeup], [], [])[0]
+            if wakeup in readable:
+                return
+
+            try:
+                events = list(device.read())
+            except BlockingIOError:
+                continue
+            except OSError:
+                return  # Unplugged
+
+            with self._lock:
+                if not self.enabled:
+                    self.dropped += len(events)
+                    continue
+
+                for event in events:
+                    self.uinput.write_event(event)
+                    self.forwarded += 1
+                    if event.type == ev_key:
+                        if event.value:
+                            self._pressed.add(event.code)
+                        else:
+                            self._pressed.discard(event.code)
+
+
+_proxy = None
+
+
+def unix_open_controller(path=None, evdev=None):
+    '''
+    Open the gamepad before riding so any problem shows up now, not when the
+    gate first disables it. evdev is for swapping in a stand-in.
+    '''
+    global _proxy
+
+    if _proxy is None:
+        proxy = EvdevProxy(path, evdev)
+        proxy.open()
+        _proxy = proxy
+
+
+def unix_close_controller():
+    global _proxy
+
+    if _proxy is not None:
+        _proxy.close()
+        _proxy = None
 
 
 def unix_disable_controller():
-    raise NotImplementedError
+    if _proxy is None:
+        LOGGER.warning("The controller wasn't opened, it can't be disabled")
+        return
+    _proxy.disable()
 
 
 def unix_enable_controller():
-    raise NotImplementedError
+    if _proxy is not None:
+        _proxy.enable()
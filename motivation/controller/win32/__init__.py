@@ -1,14 +1,53 @@
 '''
 Windows methods for enabling/disabling a controller
+
+There's no way to cut a controller off here, so disabling pauses the game by
+pressing space and enabling presses it again. That assumes space toggles
+pause and that the game wasn't paused some other way in between, e.g. by
+hand, there's no telling whether a game is paused. This only keeps track of
+whether the last press was ours so close() can un-pause.
 '''
-import win32com.client
+_shell = None
+_paused = False  # We pressed space to pause and haven't pressed it again
+
 
-shell = win32com.client.Dispatch("WScript.Shell")
+def _get_shell():
+    '''
+    The WScript.Shell COM object is created the first time it's needed
+    '''
+    global _shell
+
+    if _shell is None:
+        import win32com.client
+        _shell = win32com.client.Dispatch("WScript.Shell")
+    return _shell
 
 
 def win32_disable_controller():
-    shell.SendKeys(" ", 0)
+    '''
+    Pause the game. The gate only calls this when the controller goes from enabled to disabled.
+    '''
+    global _paused
+
+    if not _paused:
+        (_shell or _get_shell()).SendKeys(" ", 0)
+        _paused = True
 
 
 def win32_enable_controller():
-    raise NotImplementedError
+    '''
+    Space toggles pause so the same key press un-pauses the game
+    '''
+    global _paused
+
+    if _paused:
+        (_shell or _get_shell()).SendKeys(" ", 0)
+        _paused = False
+
+
+def win32_close_controller():
+    '''
+    Don't leave the game paused on the way out
+    '''
+    if _paused:
+        win32_enable_controller()
@@ -0,0 +1,280 @@
+'''
+Live dashboard served over HTTP/WebSocket from the BLE event loop
+
+The notification path never touches the dashboard. A timer reads the
+trackers and gates `fps` times a second and builds one JSON frame, only if
+something changed. Each viewer has a single frame slot and its own sender
+task, a newer frame replaces one that hasn't gone out yet, so a slow browser
+only ever misses frames and never holds anything else up.
+'''
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+
+from motivation.gate import GATE_DISABLED
+
+LOGGER = logging.getLogger(__name__)
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+#: Biggest message taken from a viewer, they don't have anything to say
+MAX_CLIENT_MESSAGE = 4096
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Motivation</title>
+<style>
+body { font-family: sans-serif; background: #111; color: #eee; margin: 2em; }
+.rider { display: inline-block; width: 18em; margin: 0 1em 1em 0; padding: 1em; border-radius: 0.5em; background: #333; }
+.rider.enabled { border-left: 0.5em solid #2a2; }
+.rider.disabled { border-left: 0.5em solid #c22; }
+.name { font-size: 1.2em; font-weight: bold; }
+.power { font-size: 3em; }
+.status { color: #888; }
+</style>
+</head>
+<body>
+<h1>Motivation</h1>
+<div id="riders"></div>
+<p class="status" id="status">Connecting...</p>
+<script>
+function escape(text) {
+    var div = document.createElement("div");
+    div.textContent = text;
+    return div.innerHTML;
+}
+function connect() {
+    var ws = new WebSocket("ws://" + location.host + "/ws");
+    var status = document.getElementById("status");
+    ws.onopen = function() { status.textContent = "Live"; };
+    ws.onclose = function() { status.textContent = "Disconnected, retrying..."; setTimeout(connect, 1000); };
+    ws.onmessage = function(msg) {
+        var frame = JSON.parse(msg.data);
+        document.getElementById("riders").innerHTML = frame.riders.map(function(r) {
+            return '<div class="rider ' + r.state + '"><div class="name">' + escape(r.name) + '</div>' +
+                '<div class="power">' + Math.round(r.power) + 'w</div>' +
+                '<div>Effective: ' + r.effective.toFixed(1) + 'w / ' + Math.round(r.required) + 'w</div>' +
+                '<div>Controller ' + r.state + ', disabled ' + r.disabled + ' times</div></div>';
+        }).join("");
+    };
+}
+connect();
+</script>
+</body>
+</html>
+"""
+
+
+def encode_frame(payload, opcode=OP_TEXT):
+    '''
+    A single unmasked server -> client WebSocket frame
+    '''
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x80 | opcode, length))
+    elif length < 65536:
+        header = bytes((0x80 | opcode, 126)) + length.to_bytes(2, "big")
+    else:
+        header = bytes((0x80 | opcode, 127)) + length.to_bytes(8, "big")
+    return header + payload
+
+
+async def read_frame(reader):
+    '''
+    Read one client -> server frame. Returns (opcode, payload).
+    '''
+    head = await reader.readexactly(2)
+    opcode = head[0] & 0x0F
+    masked = head[1] & 0x80
+    length = head[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+    if length > MAX_CLIENT_MESSAGE:
+        raise ConnectionError("Message too big")
+
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[idx % 4] for idx, b in enumerate(payload))
+    return opcode, payload
+
+
+class Viewer:
+    '''
+    One connected browser. Only the latest frame is kept.
+    '''
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.frame = None
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.skipped = 0
+
+    def offer(self, frame):
+        if self.frame is not None:
+            self.skipped += 1  # Never went out, the new one replaces it
+        self.frame = frame
+        self.ready.set()
+
+    async def send_frames(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                frame, self.frame = self.frame, None
+                if frame is None:
+                    continue
+                self.writer.write(frame)
+                await self.writer.drain()  # Only this viewer waits if it's slow
+                self.sent += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Gone, closing wakes the read in _websocket which drops this viewer
+            self.writer.close()
+
+
+class DashboardServer:
+    '''
+    Serves the dashboard page at / and frames at /ws. /state has the latest
+    frame as plain JSON.
+    '''
+
+    def __init__(self, port, host="127.0.0.1", fps=10.0):
+        self.port = port
+        self.host = host
+        self.fps = fps
+        self.loop = asyncio.get_event_loop()
+        self.sources = []
+        self.viewers = set()
+        self.frames = 0
+        self.server = None
+        self._state = b'{"riders": []}'
+        self._timer = None
+
+    def add_source(self, name, power_tracker, gate):
+        '''
+        Show a rider on the dashboard
+        '''
+        self.sources.append((name, power_tracker, gate))
+
+    def remove_source(self, power_tracker):
+        self.sources = [source for source in self.sources if source[1] is not power_tracker]
+
+    def start(self):
+        self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self._timer = self.loop.call_later(1 / self.fps, self._tick)
+        LOGGER.debug(f"Serving the dashboard on http://{self.host}:{self.port}/")
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.server is not None:
+            self.server.close()
+            for viewer in list(self.viewers):
+                viewer.writer.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.server = None
+
+    def snapshot(self):
+        '''
+        The current state of every rider
+        '''
+        riders = []
+        for name, tracker, gate in self.sources:
+            riders.append({
+                "name": name,
+                "power": tracker.power,
+                "effective": tracker.get_effective_power(),
+                "required": tracker.get_required_power(),
+                "state": gate.state,
+                "disabled": gate.transitions[GATE_DISABLED],
+                "updated": tracker.timestamp,
+            })
+        return {"time": time.time(), "riders": riders}
+
+    def _tick(self):
+        '''
+        Build a frame at the frame rate and hand it to every viewer if anything changed
+        '''
+        self._timer = self.loop.call_later(1 / self.fps, self._tick)
+
+        snapshot = self.snapshot()
+        snapshot.pop("time")
+        state = json.dumps(snapshot).encode("utf-8")
+        if state == self._state:
+            return
+
+        self._state = state
+        self.frames += 1
+        frame = encode_frame(state)
+        for viewer in self.viewers:
+            viewer.offer(frame)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+
+            parts = request.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) >= 2 else ""
+
+            if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                await self._websocket(reader, writer, headers)
+            elif path == "/":
+                self._respond(writer, "200 OK", "text/html; charset=utf-8", PAGE.encode("utf-8"))
+            elif path == "/state":
+                self._respond(writer, "200 OK", "application/json", self._state)
+            else:
+                self._respond(writer, "404 Not Found", "text/plain; charset=utf-8", b"Not found\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _respond(self, writer, status, ctype, body):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + body)
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("latin-1")).digest()).decode("latin-1")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+
+        viewer = Viewer(writer)
+        viewer.offer(encode_frame(self._state))  # Something to show straight away
+        self.viewers.add(viewer)
+        sender = self.loop.create_task(viewer.send_frames())
+
+        try:
+            # Viewers only ever ping or close
+            while not sender.done():
+                opcode, payload = await read_frame(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(payload[:2], OP_CLOSE))
+                    break
+                if opcode == OP_PING:
+                    writer.write(encode_frame(payload, OP_PONG))
+        finally:
+            self.viewers.discard(viewer)
+            sender.cancel()
@@ -0,0 +1,346 @@
+'''
+Fake Bleak backend for load testing without any trainers
+
+A FakeFleet stands in for Bleak's discover() and BleakClient. Each
+FakeTrainer advertises the Cycling Power service and has a GATT tree shaped
+like a Kickr SNAP's, and sends Cycling Power Measurements at a configurable
+rate with jitter, dropped packets and dropped connections. Everything else
+(BLEScanner, BLEClient, the trainer plugins, trackers and gates) is the real
+code:
+
+    fleet = FakeFleet([FakeTrainer(f"KICKR {i}", rate=10) for i in range(8)])
+    fleet.install()
+    ...
+    fleet.uninstall()
+
+Packets are sent on an absolute schedule, so if the event loop falls behind
+they arrive late and back to back like a real backend's would. `lag` has
+how late each one was delivered.
+'''
+import math
+import zlib
+import random
+import struct
+import asyncio
+from array import array
+
+from bleak.exc import BleakError
+
+CYCLING_POWER_SERVICE_UUID = "00001818-0000-1000-8000-00805f9b34fb"
+CYCLING_POWER_MEASUREMENT_UUID = "00002a63-0000-1000-8000-00805f9b34fb"
+BATTERY_LEVEL_UUID = "00002a19-0000-1000-8000-00805f9b34fb"
+WAHOO_NOTIFY_UUID = "a026e005-0a7d-4ab3-97fa-f1500f9feb8b"
+CCCD_UUID = "00002902-0000-1000-8000-00805f9b34fb"
+
+#: Cycling Power Measurement payloads: flags and struct. Kickr is accumulated
+#: torque + wheel revolutions, full adds pedal balance and crank revolutions.
+PAYLOADS = {
+    "kickr": (0x0014, struct.Struct("<HhHIH")),
+    "full": (0x0035, struct.Struct("<HhBHIHHH")),
+}
+
+
+class FakeDescriptor:
+
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self.handle = handle
+
+
+class FakeCharacteristic:
+
+    def __init__(self, uuid, properties, description, handle, value=None, descriptors=()):
+        self.uuid = uuid
+        self.properties = list(properties)
+        self.description = description
+        self.handle = handle
+        self.value = value
+        self.descriptors = list(descriptors)
+
+
+class FakeService:
+
+    def __init__(self, uuid, description, characteristics):
+        self.uuid = uuid
+        self.description = description
+        self.characteristics = characteristics
+
+
+def kickr_services(name):
+    '''
+    A GATT tree like a Kickr SNAP's
+    '''
+    handles = iter(range(1, 1000))
+
+    def char(uuid, properties, description, value=None):
+        handle = next(handles)
+        descriptors = [FakeDescriptor(CCCD_UUID, next(handles))] if {"notify", "indicate"} & set(properties) else []
+        return FakeCharacteristic(uuid, properties, description, handle, value, descriptors)
+
+    return [
+        FakeService("00001800-0000-1000-8000-00805f9b34fb", "Generic Access Profile", [
+            char("00002a00-0000-1000-8000-00805f9b34fb", ["read"], "Device Name", name.encode("utf-8")),
+            char("00002a01-0000-1000-8000-00805f9b34fb", ["read"], "Appearance", b"\x80\x04"),
+        ]),
+        FakeService("0000180a-0000-1000-8000-00805f9b34fb", "Device Information", [
+            char("00002a29-0000-1000-8000-00805f9b34fb", ["read"], "Manufacturer Name String", b"Wahoo Fitness"),
+            char("00002a24-0000-1000-8000-00805f9b34fb", ["read"], "Model Number String", b"KICKR SNAP"),
+            char("00002a26-0000-1000-8000-00805f9b34fb", ["read"], "Firmware Revision String", b"1.0.0"),
+        ]),
+        FakeService("0000180f-0000-1000-8000-00805f9b34fb", "Battery Service", [
+            char(BATTERY_LEVEL_UUID, ["read", "notify"], "Battery Level", b"\x64"),
+        ]),
+        FakeService(CYCLING_POWER_SERVICE_UUID, "Cycling Power", [
+            char(CYCLING_POWER_MEASUREMENT_UUID, ["notify"], "Cycling Power Measurement"),
+            char("00002a65-0000-1000-8000-00805f9b34fb", ["read"], "Cycling Power Feature", b"\x0c\x00\x00\x00"),
+            char("00002a5d-0000-1000-8000-00805f9b34fb", ["read"], "Sensor Location", b"\x0d"),
+            char("00002a66-0000-1000-8000-00805f9b34fb", ["write", "indicate"], "Cycling Power Control Point"),
+        ]),
+        FakeService("a026ee01-0a7d-4ab3-97fa-f1500f9feb8b", "Wahoo Trainer", [
+            char(WAHOO_NOTIFY_UUID, ["write", "notify"], "Wahoo Trainer Control"),
+        ]),
+    ]
+
+
+class FakeTrainer:
+    '''
+    One emulated trainer.
+
+    rate: Cycling Power Measurements per second
+    jitter: Each interval varies by up to this fraction either way
+    dropout: Chance (0-1) that a packet is never sent
+    power: Mean watts, it wanders by `variation` watts over `period` seconds plus some noise
+    disconnect_after: Seconds into each connection the link drops, None to stay up
+    connect_failures: Connection attempts that fail before one works
+    op_delay: Seconds each connect/read/subscribe takes
+    '''
+
+    def __init__(self, name, address=None, rate=4.0, jitter=0.0, dropout=0.0, power=200.0, variation=30.0, period=60.0,
+                 payload="kickr", disconnect_after=None, connect_failures=0, op_delay=0.0, seed=None):
+        if address is None:
+            address = "FA:KE:" + ":".join(f"{b:02X}" for b in zlib.crc32(name.encode("utf-8")).to_bytes(4, "big"))
+        self.name = name
+        self.address = address
+        self.rate = rate
+        self.jitter = jitter
+        self.dropout = dropout
+        self.power = power
+        self.variation = variation
+        self.period = period
+        self.flags, self.struct = PAYLOADS[payload]
+        self.disconnect_after = disconnect_after
+        self.connect_failures = connect_failures
+        self.op_delay = op_delay
+        self.random = random.Random(seed if seed is not None else name)
+        self.services = kickr_services(name)
+        self.details = None
+        self.metadata = {"uuids": [CYCLING_POWER_SERVICE_UUID], "manufacturer_data": {}}
+
+        self.connects = 0
+        self.sent = 0
+        self.skipped = 0
+        self.lag = array("d")  # Seconds late for every packet delivered
+        self._wheel_revs = 0
+        self._started = None
+
+    def characteristic(self, uuid):
+        for service in self.services:
+            for char in service.characteristics:
+                if char.uuid == uuid:
+                    return char
+        raise BleakError(f"Characteristic {uuid} was not found")
+
+    def measurement(self, now):
+        '''
+        The next Cycling Power Measurement
+        '''
+        if self._started is None:
+            self._started = now
+        elapsed = now - self._started
+        watts = self.power + self.variation * math.sin(2 * math.pi * elapsed / self.period) + self.random.gauss(0, 5)
+        watts = max(0, min(int(watts), 2000))
+        self._wheel_revs += 2
+        event_time = int(elapsed * 2048) & 0xFFFF
+
+        if self.flags == 0x0014:
+            return bytearray(self.struct.pack(self.flags, watts, int(elapsed * 32) & 0xFFFF, self._wheel_revs, event_time))
+        return bytearray(self.struct.pack(self.flags, watts, 100, int(elapsed * 32) & 0xFFFF, self._wheel_revs, event_time,
+                                          self._wheel_revs // 3 & 0xFFFF, int(elapsed * 1024) & 0xFFFF))
+
+    def interval(self):
+        if not self.jitter:
+            return 1 / self.rate
+        return (1 + self.random.uniform(-self.jitter, self.jitter)) / self.rate
+
+
+class FakeBleakClient:
+    '''
+    Stands in for BleakClient, connected to a FakeTrainer
+    '''
+
+    def __init__(self, fleet, address, loop=None, timeout=10, **kwargs):
+        self.fleet = fleet
+        self.address = address
+        self.loop = loop or asyncio.get_event_loop()
+        self.timeout = timeout
+        self.trainer = fleet.by_address.get(address.upper())
+        self.services = []
+        self.connected = False
+        self._pumps = {}
+        self._disconnected_callback = None
+        self._drop_timer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.disconnect()
+
+    async def connect(self):
+        if self.trainer is None:
+            raise BleakError(f"Device with address {self.address} was not found")
+
+        await asyncio.sleep(self.trainer.op_delay)
+        self.trainer.connects += 1
+        if self.trainer.connects <= self.trainer.connect_failures:
+            raise BleakError(f"Failed to connect to {self.address}")
+
+        self.connected = True
+        self.services = self.trainer.services
+        if self.trainer.disconnect_after is not None:
+            self._drop_timer = self.loop.call_later(self.trainer.disconnect_after, self._drop)
+        return True
+
+    async def disconnect(self):
+        if self._drop_timer is not None:
+            self._drop_timer.cancel()
+            self._drop_timer = None
+        self._stop_pumps()
+        self.connected = False
+        return True
+
+    async def is_connected(self):
+        return self.connected
+
+    def set_disconnected_callback(self, callback):
+        self._disconnected_callback = callback
+
+    async def read_gatt_char(self, uuid):
+        self._check_connected()
+        await asyncio.sleep(self.trainer.op_delay)
+        return bytearray(self.trainer.characteristic(uuid).value or b"")
+
+    async def read_gatt_descriptor(self, handle):
+        self._check_connected()
+        await asyncio.sleep(self.trainer.op_delay)
+        return bytearray(b"\x00\x00")
+
+    async def start_notify(self, uuid, callback):
+        self._check_connected()
+        char = self.trainer.characteristic(uuid)
+        if "notify" not in char.properties and "indicate" not in char.properties:
+            raise BleakError(f"Characteristic {uuid} does not support notifications")
+        await asyncio.sleep(self.trainer.op_delay)
+
+        if uuid == CYCLING_POWER_MEASUREMENT_UUID:
+            pump = self._pump_measurements(uuid, callback)
+        elif uuid == BATTERY_LEVEL_UUID:
+            pump = self._pump_constant(uuid, callback, b"\x64", 60.0)
+        else:
+            pump = self._pump_constant(uuid, callback, b"\x01\x00", 1.0)
+        self._pumps[uuid] = self.loop.create_task(pump)
+
+    async def stop_notify(self, uuid):
+        self._check_connected()
+        await asyncio.sleep(self.trainer.op_delay)
+        pump = self._pumps.pop(uuid, None)
+        if pump is not None:
+            pump.cancel()
+
+    def _check_connected(self):
+        if not self.connected:
+            raise BleakError("Not connected")
+
+    def _stop_pumps(self):
+        for pump in self._pumps.values():
+            pump.cancel()
+        self._pumps = {}
+
+    def _drop(self):
+        '''
+        The link goes down
+        '''
+        self._drop_timer = None
+        self._stop_pumps()
+        self.connected = False
+        if self._disconnected_callback is not None:
+            self._disconnected_callback(self)
+
+    async def _pump_measurements(self, uuid, callback):
+        trainer = self.trainer
+        loop = self.loop
+        due = loop.time()
+
+        while True:
+            due += trainer.interval()
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif trainer.sent % 16 == 0:
+                await asyncio.sleep(0)  # Behind, catch up but don't starve the loop
+
+            if trainer.dropout and trainer.random.random() < trainer.dropout:
+                trainer.skipped += 1
+                continue
+
+            now = loop.time()
+            trainer.lag.append(now - due)
+            trainer.sent += 1
+            callback(uuid, trainer.measurement(now))
+
+    async def _pump_constant(self, uuid, callback, value, interval):
+        while True:
+            await asyncio.sleep(interval)
+            callback(uuid, bytearray(value))
+
+
+class FakeFleet:
+    '''
+    A set of FakeTrainers that discover() and BleakClient connect to
+    '''
+
+    def __init__(self, trainers, advertise_interval=0.1):
+        self.trainers = list(trainers)
+        self.by_address = {trainer.address.upper(): trainer for trainer in self.trainers}
+        self.advertise_interval = advertise_interval
+        self._saved = None
+
+    async def discover(self, timeout=5.0, loop=None, **kwargs):
+        '''
+        Every trainer is seen after an advertising interval
+        '''
+        await asyncio.sleep(min(timeout, self.advertise_interval))
+        return list(self.trainers)
+
+    def client(self, address, loop=None, timeout=10, **kwargs):
+        return FakeBleakClient(self, address, loop, timeout, **kwargs)
+
+    def install(self):
+        '''
+        Point motivation.ble at the fleet instead of Bleak
+        '''
+        from motivation import ble
+
+        if self._saved is None:
+            self._saved = (ble.BleakClient, ble.discover, ble.BleakScanner)
+        ble.BleakClient = self.client
+        ble.discover = self.discover
+        ble.BleakScanner = None  # discover() rounds
+
+    def uninstall(self):
+        from motivation import ble
+
+        if self._saved is not None:
+            ble.BleakClient, ble.discover, ble.BleakScanner = self._saved
+            self._saved = None
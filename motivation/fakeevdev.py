@@ -0,0 +1,186 @@
+'''
+Fake evdev module for trying the Linux controller proxy without a gamepad
+
+A FakeEvdev has the InputDevice, UInput, ecodes and list_devices names the
+proxy uses from evdev. Each FakeGamepad is an input device with an Xbox style
+set of buttons and axes, and anything sent from it goes to every open
+InputDevice for it through a pipe, so the proxy's select loop runs for real:
+
+    fake = FakeEvdev([FakeGamepad("/dev/input/event5")])
+    unix_open_controller(evdev=fake)
+    fake.gamepads[0].send((ecodes.EV_ABS, ecodes.ABS_X, 32767))
+    ...
+    fake.uinputs[0].state  # What the game would see
+
+UInput devices keep every event written to them in `events` and the latest
+value of each button and axis in `state`.
+'''
+import os
+import time
+import threading
+from types import SimpleNamespace
+from collections import namedtuple
+
+ecodes = SimpleNamespace(
+    EV_SYN=0x00, EV_KEY=0x01, EV_ABS=0x03, SYN_REPORT=0,
+    BTN_GAMEPAD=0x130, BTN_SOUTH=0x130, BTN_EAST=0x131, BTN_NORTH=0x133, BTN_WEST=0x134,
+    ABS_X=0x00, ABS_Y=0x01, ABS_Z=0x02, ABS_RX=0x03, ABS_RY=0x04, ABS_RZ=0x05,
+    ABS_GAS=0x09, ABS_BRAKE=0x0a, ABS_HAT0X=0x10, ABS_HAT0Y=0x11,
+)
+
+AbsInfo = namedtuple("AbsInfo", ("value", "min", "max", "fuzz", "flat", "resolution"))
+InputEvent = namedtuple("InputEvent", ("sec", "usec", "type", "code", "value"))
+
+STICK = AbsInfo(0, -32768, 32767, 16, 128, 0)
+TRIGGER = AbsInfo(0, 0, 1023, 0, 0, 0)
+HAT = AbsInfo(0, -1, 1, 0, 0, 0)
+
+#: Buttons and axes of an Xbox style gamepad
+GAMEPAD_CAPABILITIES = {
+    ecodes.EV_KEY: [ecodes.BTN_SOUTH, ecodes.BTN_EAST, ecodes.BTN_NORTH, ecodes.BTN_WEST],
+    ecodes.EV_ABS: [
+        (ecodes.ABS_X, STICK), (ecodes.ABS_Y, STICK), (ecodes.ABS_RX, STICK), (ecodes.ABS_RY, STICK),
+        (ecodes.ABS_Z, TRIGGER), (ecodes.ABS_RZ, TRIGGER), (ecodes.ABS_HAT0X, HAT), (ecodes.ABS_HAT0Y, HAT),
+    ],
+}
+
+#: A keyboard, for something that isn't a gamepad
+KEYBOARD_CAPABILITIES = {ecodes.EV_KEY: [1, 2, 3, 30]}
+
+
+class FakeGamepad:
+    '''
+    An input device. It doesn't have to be a gamepad, that's up to its capabilities.
+    '''
+
+    def __init__(self, path, name="Fake Gamepad", capabilities=GAMEPAD_CAPABILITIES):
+        self.path = path
+        self.name = name
+        self.capabilities = capabilities
+        self.handles = []  # Open InputDevices for this one
+        self.grabbed = False
+
+    def send(self, *events):
+        '''
+        Send (type, code, value) events followed by a SYN_REPORT
+        '''
+        now = time.time()
+        sec, usec = int(now), int(now % 1 * 1000000)
+        batch = [InputEvent(sec, usec, *event) for event in events]
+        batch.append(InputEvent(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+        for handle in list(self.handles):
+            handle.deliver(batch)
+
+
+class FakeInputDevice:
+    '''
+    An open gamepad. fd is readable whenever there are events to read().
+    '''
+
+    def __init__(self, gamepad):
+        self.gamepad = gamepad
+        self.path = gamepad.path
+        self.name = gamepad.name
+        self._events = []
+        self._grabbed = False
+        self._lock = threading.Lock()
+        self.fd, self._write_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+        gamepad.handles.append(self)
+
+    def capabilities(self):
+        return self.gamepad.capabilities
+
+    def grab(self):
+        if self.gamepad.grabbed:
+            raise OSError(16, "Device or resource busy")
+        self.gamepad.grabbed = self._grabbed = True
+
+    def ungrab(self):
+        if self._grabbed:
+            self.gamepad.grabbed = self._grabbed = False
+
+    def deliver(self, events):
+        with self._lock:
+            self._events.extend(events)
+        os.write(self._write_fd, b"\0")
+
+    def read(self):
+        '''
+        The events waiting, raises BlockingIOError if there aren't any like evdev does
+        '''
+        with self._lock:
+            try:
+                os.read(self.fd, 4096)
+            except BlockingIOError:
+                pass
+            if not self._events:
+                raise BlockingIOError(11, "Resource temporarily unavailable")
+            events, self._events = self._events, []
+        return iter(events)
+
+    def close(self):
+        if self.fd is None:
+            return
+        self.ungrab()  # Closing lets go of a grab, like the kernel does
+        self.gamepad.handles.remove(self)
+        os.close(self.fd)
+        os.close(self._write_fd)
+        self.fd = self._write_fd = None
+
+
+class FakeUInput:
+    '''
+    A virtual device, it keeps what's written to it
+    '''
+
+    def __init__(self, name=None):
+        self.name = name
+        self.events = []
+        self.state = {}  # (type, code) -> latest value
+        self.closed = False
+
+    def write(self, etype, code, value):
+        self.events.append((etype, code, value))
+        if etype != ecodes.EV_SYN:
+            self.state[(etype, code)] = value
+
+    def write_event(self, event):
+        self.write(event.type, event.code, event.value)
+
+    def syn(self):
+        self.write(ecodes.EV_SYN, ecodes.SYN_REPORT, 0)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeEvdev:
+    '''
+    Stands in for the evdev module with the given devices plugged in
+    '''
+    ecodes = ecodes
+
+    def __init__(self, gamepads):
+        self.gamepads = list(gamepads)
+        self.uinputs = []
+
+        fake = self
+
+        class UInput(FakeUInput):
+            @classmethod
+            def from_device(cls, device, name=None):
+                uinput = cls(name)
+                fake.uinputs.append(uinput)
+                return uinput
+
+        self.UInput = UInput
+
+    def list_devices(self):
+        return [gamepad.path for gamepad in self.gamepads]
+
+    def InputDevice(self, path):
+        for gamepad in self.gamepads:
+            if gamepad.path == path:
+                return FakeInputDevice(gamepad)
+        raise FileNotFoundError(2, "No such file or directory", path)
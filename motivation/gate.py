@@ -0,0 +1,183 @@
+'''
+Decides when the controller gets disabled based on the power tracker
+'''
+import time
+import logging
+import threading
+import collections
+
+from motivation import metrics
+from motivation.controller import disable_controller, enable_controller
+
+LOGGER = logging.getLogger(__name__)
+
+GATE_ENABLED = "enabled"
+GATE_DISABLED = "disabled"
+
+
+class GateStats:
+    '''
+    Keeps track of how long it takes from a power sample arriving to a gate decision
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def __str__(self):
+        return f"Gate decisions: {self.count}, Mean latency: {self.mean * 1000:.3f}ms, Max latency: {self.max * 1000:.3f}ms"
+
+
+class PowerGate:
+    '''
+    Event driven, edge triggered controller gate.
+
+    The power tracker is checked as soon as a new sample shows up. The gate is
+    a two state machine (GATE_ENABLED/GATE_DISABLED) and only calls the
+    controller backend when the state changes:
+
+    * ENABLED -> DISABLED when effective power drops below required - lower_band
+    * DISABLED -> ENABLED when effective power gets to required + upper_band
+
+    A state has to be held for at least min_dwell seconds before it can change
+    so power hovering around the threshold doesn't toggle the controller. A
+    pending change happens on the first sample after the dwell is up. A timer
+    on the event loop disables the controller straight away if the trainer goes
+    quiet for more than stale_timeout seconds.
+    '''
+
+    def __init__(self, power_tracker, loop, stale_timeout=3.0, lower_band=0.0, upper_band=0.0, min_dwell=0.0,
+                 on_disable=None, on_enable=None, debug=False):
+        self.power_tracker = power_tracker
+        self.loop = loop
+        self.stale_timeout = stale_timeout
+        self.lower_band = lower_band
+        self.upper_band = upper_band
+        self.min_dwell = min_dwell
+        self.on_disable = on_disable or self.disable
+        self.on_enable = on_enable or self.enable
+        self.debug = debug
+        self.stats = GateStats()
+        self.state = GATE_ENABLED
+        self.transitions = {GATE_ENABLED: 0, GATE_DISABLED: 0}
+        self.last_transition = None
+        self.history = collections.deque(maxlen=100)  # (timestamp, new state, effective power)
+        self.lock = threading.Lock()
+        self.running = False
+        self._started = None
+        self._timer = None
+
+    def start(self):
+        '''
+        Start listening for samples and watching for stale data
+        '''
+        self._started = time.perf_counter()
+        self.last_transition = self.power_tracker.clock()
+        self.power_tracker.add_listener(self.on_sample)
+        self.running = True
+        self._arm_stale_timer(self.stale_timeout)
+
+    def stop(self):
+        '''
+        Stop listening for samples
+        '''
+        self.power_tracker.remove_listener(self.on_sample)
+        self.running = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def on_sample(self, power_tracker):
+        '''
+        Called by the power tracker for every sample. Bleak might call the
+        notification handler from its own thread so this doesn't touch the loop.
+        '''
+        self.evaluate()
+        latency = time.perf_counter() - power_tracker.updated
+        self.stats.add(latency)
+        if metrics.enabled:
+            metrics.GATE_LATENCY.observe(latency)
+
+    def evaluate(self):
+        '''
+        Update the state from the tracker. Returns True if the controller is enabled.
+        '''
+        eff_power = self.power_tracker.get_effective_power()
+        req_power = self.power_tracker.get_required_power()
+
+        if self.state == GATE_ENABLED and eff_power < req_power - self.lower_band:
+            self._transition(GATE_DISABLED, eff_power)
+        elif self.state == GATE_DISABLED and eff_power >= req_power + self.upper_band:
+            self._transition(GATE_ENABLED, eff_power)
+
+        return self.state == GATE_ENABLED
+
+    def disable(self):
+        '''
+        Default action when we stop doing well enough
+        '''
+        LOGGER.info("YOU'RE DOING BAD!!")
+        disable_controller()
+
+    def enable(self):
+        '''
+        Default action when we're doing well enough again
+        '''
+        LOGGER.info("Back in the game!")
+        enable_controller()
+
+    def _transition(self, state, eff_power, force=False):
+        with self.lock:
+            now = self.power_tracker.clock()
+            if self.state == state:
+                return False
+            if not force and now - self.last_transition < self.min_dwell:
+                return False  # Hasn't been long enough, try again on the next sample
+
+            self.state = state
+            self.transitions[state] += 1
+            self.last_transition = now
+            self.history.append((now, state, eff_power))
+
+        if metrics.enabled:
+            (metrics.GATE_DISABLED if state == GATE_DISABLED else metrics.GATE_ENABLED).inc()
+
+        if state == GATE_DISABLED:
+            self.on_disable()
+        else:
+            self.on_enable()
+        return True
+
+    def _arm_stale_timer(self, delay):
+        if self.stale_timeout:
+            self._timer = self.loop.call_later(delay, self._check_stale)
+
+    def _check_stale(self):
+        '''
+        Rather than resetting the timer for every sample this just looks at the
+        age of the last sample and goes back to sleep until it could be stale.
+        '''
+        last = self.power_tracker.updated or self._started
+        age = time.perf_counter() - last
+
+        if age < self.stale_timeout:
+            self._arm_stale_timer(self.stale_timeout - age)
+            return
+
+        if self.state == GATE_ENABLED:
+            LOGGER.info(f"No power data for {age:.1f} seconds!")
+            self._transition(GATE_DISABLED, 0, force=True)
+        self._arm_stale_timer(self.stale_timeout)
@@ -1,6 +1,7 @@
 '''
 GATT Classes
 '''
+import asyncio
 
 
 class GATTUnsupportedOperation(Exception):
@@ -11,17 +12,54 @@ class GATTFailedToNotify(Exception):
     pass
 
 
+async def _limited(coro, limiter):
+    '''
+    Await a single BLE operation while holding the limiter (an asyncio.Semaphore) if there is one
+    '''
+    if limiter is None:
+        return await coro
+
+    async with limiter:
+        return await coro
+
+
+async def _await_all(coros, limiter):
+    '''
+    Await all the coroutines. One after the other without a limiter, otherwise
+    all at once and the limiter bounds how many BLE operations are in flight.
+    If one fails the rest are closed or cancelled before the error is raised.
+    '''
+    if limiter is None:
+        try:
+            for coro in coros:
+                await coro
+        except BaseException:
+            for coro in coros:
+                coro.close()  # Nothing for the ones already awaited
+            raise
+        return
+
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
 class GATTDevice:
     '''
     Class that represents a GATT BLE device
     '''
 
-    def __init__(self, uuid, device):
+    def __init__(self, uuid, device, metadata=None):
         self.uuid = uuid
         self.address = device.address
         self.name = device.name
         self.details = device.details
-        self.metadata = device.metadata
+        self.metadata = device.metadata if metadata is None else metadata
         self.device = device
 
     def __str__(self):
@@ -56,8 +94,8 @@ class GATTDescriptor:
 
         return self.value
 
-    async def parse(self):
-        await self.read()  # Ignore return. We just want to populate the initial value
+    async def parse(self, limiter=None):
+        await _limited(self.read(), limiter)  # Ignore return. We just want to populate the initial value
 
 
 class GATTCharacteristic:
@@ -72,6 +110,7 @@ class GATTCharacteristic:
         self.descriptors = []
         self.value = None
         self.error = None
+        self.notifying = False
 
     def __str__(self):
         return f"[Char] {self.uuid}: ({','.join(self.characteristic.properties)}) | Name: {self.characteristic.description}, Value: {self.value or self.error}"
@@ -97,32 +136,37 @@ class GATTCharacteristic:
 
         return self.value
 
-    async def notify(self, handler):
+    async def notify(self, handler, limiter=None):
         if not self.is_notify():
             raise GATTUnsupportedOperation()
 
         try:
-            await self.client.start_notify(self.uuid, handler)
+            await _limited(self.client.start_notify(self.uuid, handler), limiter)
         except Exception as e:
             raise GATTFailedToNotify(f"Could not enable notifications for {self.uuid}: {e}")
+        self.notifying = True
 
-    async def stop_notify(self):
+    async def stop_notify(self, limiter=None):
         if not self.is_notify():
             raise GATTUnsupportedOperation()
 
         try:
-            await self.client.stop_notify(self.uuid)
+            await _limited(self.client.stop_notify(self.uuid), limiter)
         except Exception as e:
             raise GATTFailedToNotify(f"Coult not disable notifications for {self.uuid}: {e}")
+        finally:
+            self.notifying = False
+
+    async def parse(self, limiter=None, read=True, descriptors=True):
+        reads = []
+        if read and self.is_read():
+            reads.append(_limited(self.read(), limiter))  # Ignore return. We just want to populate the initial value
 
-    async def parse(self):
-        if self.is_read():
-            await self.read()  # Ignore return. We just want to populate the initial value
+        self.descriptors = [GATTDescriptor(self.client, descriptor) for descriptor in self.characteristic.descriptors]
+        if descriptors:
+            reads.extend(desc.parse(limiter) for desc in self.descriptors)
 
-        for descriptor in self.characteristic.descriptors:
-            gatt_desc = GATTDescriptor(self.client, descriptor)
-            await gatt_desc.parse()
-            self.descriptors.append(gatt_desc)
+        await _await_all(reads, limiter)
 
 
 class GATTService:
@@ -143,24 +187,27 @@ class GATTService:
                 return char
         return None
 
-    async def notify(self, handler):
-        for char in self.characteristics:
-            if char.is_notify():
-                await char.notify(handler)
+    async def notify(self, handler, limiter=None, uuids=None):
+        '''
+        Subscribe to the characteristics in `uuids` (lower case), every one that can notify if it's None
+        '''
+        await _await_all([char.notify(handler, limiter) for char in self.characteristics
+                          if char.is_notify() and (uuids is None or char.uuid.lower() in uuids)], limiter)
 
-    async def stop_notify(self):
-        for char in self.characteristics:
-            if char.is_notify():
-                await char.stop_notify()
+    async def stop_notify(self, limiter=None):
+        await _await_all([char.stop_notify(limiter) for char in self.characteristics if char.notifying], limiter)
 
-    async def parse(self):
+    async def parse(self, limiter=None, reads=None):
         '''
-        Parse out the service characteristics
+        Parse out the service characteristics. Only the characteristics in `reads`
+        (lower case UUIDs) are read, with None every characteristic and descriptor is.
         '''
-        for char in self.service.characteristics:
-            gatt_char = GATTCharacteristic(self.client, char)
-            await gatt_char.parse()
-            self.characteristics.append(gatt_char)
+        self.characteristics = [GATTCharacteristic(self.client, char) for char in self.service.characteristics]
+        if reads is None:
+            await _await_all([char.parse(limiter) for char in self.characteristics], limiter)
+        else:
+            await _await_all([char.parse(limiter, char.uuid.lower() in reads, descriptors=False)
+                              for char in self.characteristics], limiter)
 
     def __str__(self):
         return f"[Service] {self.uuid}: {self.description}"
@@ -175,3 +222,27 @@ class GATTService:
                 service_str += "\t\t" + str(desc) + "\n"
 
         return service_str
+
+
+async def parse_services(client, limiter=None, reads=None):
+    '''
+    Parse all the services of a connected client. Only reads the characteristics
+    in `reads`, or everything (descriptors too) if it's None.
+    '''
+    services = [GATTService(client, service) for service in client.services]
+    await _await_all([service.parse(limiter, reads) for service in services], limiter)
+    return services
+
+
+async def notify_services(services, handler, limiter=None, uuids=None):
+    '''
+    Enable notifications for the characteristics in `uuids`, all of them if it's None
+    '''
+    await _await_all([service.notify(handler, limiter, uuids) for service in services], limiter)
+
+
+async def stop_notify_services(services, limiter=None):
+    '''
+    Disable notifications for everything that was subscribed to
+    '''
+    await _await_all([service.stop_notify(limiter) for service in services], limiter)
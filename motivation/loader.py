@@ -1,13 +1,29 @@
 '''
 Smart trainer plugin loader
+
+Plugins are indexed by device UUID without importing them. Built in plugins
+come from a manifest of the trainers directory that is cached on disk and only
+rebuilt when a module in there changes. Third party plugins are found through
+the "motivation.trainers" entry point group, the entry point name is the device
+UUID so they don't need importing to be indexed either, e.g.
+
+    entry_points={"motivation.trainers": ["00001818-0000-1000-8000-00805f9b34fb = my_package.trainer:MyTrainer"]}
+
+A plugin module is only imported when a device it supports shows up.
 '''
 import os
 import logging
+import importlib
 
-from motivation.trainers import SmartTrainer
+from motivation import cache
+from motivation.version import __version__
 
 LOGGER = logging.getLogger(__name__)
 
+ENTRY_POINT_GROUP = "motivation.trainers"
+MANIFEST_NAME = "trainers-manifest.json"
+TRAINERS_PACKAGE = "motivation.trainers"
+
 
 class TrainerPluginLoader:
     '''
@@ -16,9 +32,12 @@ class TrainerPluginLoader:
 
     _instance = None
 
-    def __init__(self):
-        self._plugins = []
-        self._load_trainers()
+    def __init__(self, use_cache=True, entry_points=True):
+        self.use_cache = use_cache
+        self._index = {}  # Device UUID -> "module:Class" or an entry point, not imported yet
+        self._plugins = {}  # Device UUID -> plugin class, imported
+        self._need_entry_points = entry_points  # Looking these up is slow, it waits until something isn't found
+        self._load_manifest()
 
     @classmethod
     def create(cls):
@@ -37,52 +56,154 @@ class TrainerPluginLoader:
         return cls._instance or cls.create()
 
     def __len__(self):
-        return len(self._plugins)
+        self._load_entry_points()
+        return len(self._index)
 
     def __iter__(self):
-        return iter(self._plugins)
+        '''
+        Iterate all the plugins. This imports every one of them.
+        '''
+        self._load_entry_points()
+        for trainer_uuid in list(self._index):
+            plugin = self.get_by_uuid(trainer_uuid)
+            if plugin is not None:
+                yield plugin
 
     def get_by_uuid(self, trainer_uuid):
         '''
-        Get a trainer plugin by Bluetooth GATT server UUID
+        Get a trainer plugin by Bluetooth GATT server UUID. The plugin is imported the first time it's asked for.
         '''
-        for plugin in self._plugins:
-            if plugin.DEVICE_UUID == trainer_uuid:
-                return plugin
-        return None
+        plugin = self._plugins.get(trainer_uuid)
+        if plugin is not None:
+            return plugin
+
+        trainer_uuid = trainer_uuid.lower()
+        ref = self._index.get(trainer_uuid)
+        if ref is None:
+            self._load_entry_points()
+            ref = self._index.get(trainer_uuid)
+            if ref is None:
+                return None
+
+        plugin = self._import(trainer_uuid, ref)
+        if plugin is not None:
+            self._plugins[trainer_uuid] = plugin
+        return plugin
 
     def is_supported_device(self, trainer_uuid):
         '''
-        Determine if a device is supported by UUID
+        Determine if a device is supported by UUID. Doesn't import anything.
         '''
-        return self.get_by_uuid(trainer_uuid) is not None
+        if trainer_uuid in self._plugins:
+            return True
+
+        trainer_uuid = trainer_uuid.lower()
+        if trainer_uuid not in self._index:
+            self._load_entry_points()
+        return trainer_uuid in self._index
+
+    def _import(self, trainer_uuid, ref):
+        try:
+            if isinstance(ref, str):
+                modname, _, clsname = ref.partition(":")
+                plugin = getattr(importlib.import_module(modname), clsname)
+            else:
+                plugin = ref.load()
+        except Exception as e:  # pragma: no cover
+            LOGGER.exception(f"Error: failed to load trainer plugin {ref} for {trainer_uuid}: {e}")
+            self._index.pop(trainer_uuid, None)
+            return None
+
+        LOGGER.debug(f"Loaded trainer class {plugin.__name__} for {trainer_uuid}")
+        return plugin
+
+    def _add(self, trainer_uuid, ref):
+        trainer_uuid = trainer_uuid.lower()
+        if trainer_uuid in self._index:
+            LOGGER.warning(f"Ignoring trainer plugin {ref}, {self._index[trainer_uuid]} already handles {trainer_uuid}")
+            return
+        self._index[trainer_uuid] = ref
+
+    def _load_manifest(self):
+        '''
+        Index the built in plugins from the cached manifest, or rebuild it if the trainers directory changed
+        '''
+        signature = self._manifest_signature()
+        manifest = cache.load(MANIFEST_NAME) if self.use_cache else None
+
+        if not manifest or manifest.get("signature") != signature:
+            manifest = {"signature": signature, "plugins": self._build_manifest()}
+            if self.use_cache:
+                cache.save(MANIFEST_NAME, manifest)
+
+        for trainer_uuid, ref in manifest["plugins"].items():
+            self._add(trainer_uuid, ref)
+
+    def _manifest_signature(self):
+        plugin_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), "trainers")
+        signature = [__version__, plugin_path]
 
-    def _load_trainers(self):
+        for module in sorted(os.listdir(plugin_path)):
+            if module.endswith(".py"):
+                stat = os.stat(os.path.join(plugin_path, module))
+                signature.append([module, stat.st_mtime_ns, stat.st_size])
+
+        return signature
+
+    def _build_manifest(self):
         '''
-        Load the available trainer plugins
+        Import the modules in the trainers directory and find the plugins in them
         '''
-        import importlib
         import inspect
+        from motivation.trainers import SmartTrainer
 
-        plugin_path = os.path.abspath(os.path.dirname(__file__))
-        plugin_path = os.path.join(plugin_path, "trainers")
-
-        for module in os.listdir(plugin_path):
-            fullpath = os.path.join(plugin_path, module)
+        plugins = {}
+        plugin_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), "trainers")
 
-            if module == "__init__.py":
-                continue  # Skip
-            if os.path.isdir(fullpath):
+        for module in sorted(os.listdir(plugin_path)):
+            if module == "__init__.py" or not module.endswith(".py"):
                 continue  # Skip
 
-            modname = '.trainers.' + os.path.splitext(module)[0]
+            modname = f"{TRAINERS_PACKAGE}.{os.path.splitext(module)[0]}"
             try:
-                mod = importlib.import_module(modname, __package__)
+                mod = importlib.import_module(modname)
             except Exception as e:  # pragma: no cover
                 LOGGER.exception(f"Error: failed to load trainer plugin {modname}: {e}")
                 continue
 
             for _, cls in inspect.getmembers(mod, inspect.isclass):
-                if issubclass(cls, SmartTrainer) and cls is not SmartTrainer and cls not in self._plugins:
+                if not issubclass(cls, SmartTrainer) or cls.DEVICE_UUID is None:
+                    continue  # Not a plugin, or a base class shared by plugins
+                if cls.__module__ != modname:
+                    continue  # Imported from somewhere else, that module gets its own entry
+                if cls.DEVICE_UUID.lower() not in plugins:
                     LOGGER.debug(f"Found trainer class {cls.__name__}")
-                    self._plugins.append(cls)
+                    plugins[cls.DEVICE_UUID.lower()] = f"{modname}:{cls.__name__}"
+                    self._plugins[cls.DEVICE_UUID.lower()] = cls
+
+        return plugins
+
+    def _load_entry_points(self):
+        '''
+        Index third party plugins, only done once
+        '''
+        if not self._need_entry_points:
+            return
+        self._need_entry_points = False
+
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:  # pragma: no cover (Python 3.7)
+            try:
+                from importlib_metadata import entry_points
+            except ImportError:
+                return
+
+        eps = entry_points()
+        if hasattr(eps, "select"):
+            eps = eps.select(group=ENTRY_POINT_GROUP)
+        else:  # pragma: no cover (Python < 3.10)
+            eps = eps.get(ENTRY_POINT_GROUP, [])
+
+        for ep in eps:
+            self._add(ep.name, ep)
@@ -0,0 +1,299 @@
+'''
+Latency and throughput metrics for the notification -> decode -> track -> gate pipeline
+
+Metrics are off until something turns them on with enable(), the hot paths
+only check the module's `enabled` flag. Histograms have fixed buckets so an
+observation is a bisect and a couple of additions. Updates aren't locked, a
+lost increment when two threads collide is cheaper than a lock per packet.
+
+They can be served in the Prometheus text format with MetricsServer and/or
+printed every few seconds with StatsDumper.
+'''
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+
+LOGGER = logging.getLogger(__name__)
+
+#: Buckets (seconds) for things that take microseconds to milliseconds
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1)
+
+#: Buckets (seconds) for the time between notifications
+INTERVAL_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+enabled = False
+
+
+class Counter:
+    '''
+    A value that only goes up
+    '''
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    '''
+    A value that goes up and down
+    '''
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Histogram:
+    '''
+    Counts observations in fixed buckets
+    '''
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.sum / self.count
+
+    def quantile(self, q):
+        '''
+        Estimate a quantile, it's the upper bound of the bucket it falls in
+        '''
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target and seen:
+                return bound
+        return float("inf") if self.counts[-1] else 0.0
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            yield f"{self.name}_bucket", dict(self.labels, le=le), cumulative
+        yield f"{self.name}_sum", self.labels, self.sum
+        yield f"{self.name}_count", self.labels, self.count
+
+
+class Registry:
+    '''
+    All the metrics, by name and labels
+    '''
+
+    def __init__(self):
+        self.metrics = {}
+
+    def __iter__(self):
+        return iter(self.metrics.values())
+
+    def counter(self, name, help, labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=None):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labels=None):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            metric = self.metrics[key] = cls(name, help, labels=labels, **kwargs)
+        return metric
+
+    def render(self):
+        '''
+        Prometheus text exposition format
+        '''
+        lines = []
+        described = set()
+
+        for metric in sorted(self, key=lambda m: m.name):
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_str = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                    lines.append(f"{name}{{{label_str}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        '''
+        Human readable one line per metric
+        '''
+        lines = []
+        for metric in sorted(self, key=lambda m: (m.name, sorted(m.labels.items()))):
+            labels = "".join(f" {key}={val}" for key, val in metric.labels.items())
+            if metric.kind == "histogram":
+                lines.append(f"{metric.name}{labels}: count={metric.count} mean={_format_seconds(metric.mean)} "
+                             f"p50<={_format_seconds(metric.quantile(0.5))} p99<={_format_seconds(metric.quantile(0.99))}")
+            else:
+                lines.append(f"{metric.name}{labels}: {metric.value}")
+        return "\n".join(lines)
+
+
+def _format_seconds(secs):
+    if secs >= 1:
+        return f"{secs:.2f}s"
+    if secs >= 1e-3:
+        return f"{secs * 1e3:.2f}ms"
+    return f"{secs * 1e6:.1f}us"
+
+
+REGISTRY = Registry()
+
+NOTIFICATION_INTERVAL = REGISTRY.histogram("motivation_notification_interval_seconds",
+                                           "Time between notifications from the trainer", INTERVAL_BUCKETS)
+NOTIFICATION_LATENCY = REGISTRY.histogram("motivation_notification_latency_seconds",
+                                          "Notification arriving to the gate decision being made")
+DECODE_TIME = REGISTRY.histogram("motivation_decode_seconds", "Time to decode a notification")
+TRACKER_UPDATE_TIME = REGISTRY.histogram("motivation_tracker_update_seconds", "Time for the power tracker to take a sample")
+GATE_LATENCY = REGISTRY.histogram("motivation_gate_latency_seconds", "Power sample to the gate decision being made")
+GATE_DISABLED = REGISTRY.counter("motivation_gate_transitions_total", "Controller enabled/disabled transitions",
+                                 {"state": "disabled"})
+GATE_ENABLED = REGISTRY.counter("motivation_gate_transitions_total", "Controller enabled/disabled transitions",
+                                {"state": "enabled"})
+NOTIFICATIONS = REGISTRY.counter("motivation_notifications_total", "Notifications received")
+NOTIFICATIONS_DROPPED = REGISTRY.counter("motivation_notifications_dropped_total",
+                                         "Notifications nothing was listening for")
+NOTIFICATIONS_MALFORMED = REGISTRY.counter("motivation_notifications_malformed_total",
+                                           "Notifications that failed to decode")
+QUEUE_DEPTH = REGISTRY.gauge("motivation_queue_depth", "Notifications waiting to be decoded")
+QUEUE_COALESCED = REGISTRY.counter("motivation_queue_overflow_total", "Queued notifications lost to a full queue",
+                                   {"policy": "coalesce"})
+QUEUE_DROPPED = REGISTRY.counter("motivation_queue_overflow_total", "Queued notifications lost to a full queue",
+                                 {"policy": "drop-oldest"})
+QUEUE_BLOCKED = REGISTRY.counter("motivation_queue_blocked_total", "Times the notification callback waited for room in the queue")
+
+
+def enable():
+    '''
+    Start collecting metrics
+    '''
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+class MetricsServer:
+    '''
+    Serves the registry at http://host:port/metrics from the event loop
+    '''
+
+    def __init__(self, port, host="127.0.0.1", registry=REGISTRY):
+        self.port = port
+        self.host = host
+        self.registry = registry
+        self.loop = asyncio.get_event_loop()
+        self.server = None
+
+    def start(self):
+        self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        LOGGER.debug(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # Headers aren't needed
+
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, ctype, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", self.registry.render()
+            else:
+                status, ctype, body = "404 Not Found", "text/plain; charset=utf-8", "Not found, try /metrics\n"
+
+            body = body.encode("utf-8")
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class StatsDumper:
+    '''
+    Prints the registry summary every `interval` seconds from the event loop
+    '''
+
+    def __init__(self, interval, registry=REGISTRY, out=None):
+        self.interval = interval
+        self.registry = registry
+        self.out = out
+        self.loop = asyncio.get_event_loop()
+        self._timer = None
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._timer = self.loop.call_later(self.interval, self._dump)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _dump(self):
+        text = f"--- Metrics at {time.perf_counter() - self._started:.0f}s ---\n{self.registry.summary()}"
+        if self.out is None:
+            LOGGER.info(text)  # Through the console so it doesn't garble the status line
+        else:
+            print(text, file=self.out)
+        self._timer = self.loop.call_later(self.interval, self._dump)
@@ -0,0 +1,243 @@
+'''
+Queued notification handling
+
+By default every notification is decoded, tracked and gated inside Bleak's
+callback. With a NotificationPipeline the callback only records the raw
+packet, stamps it and puts it on a bounded queue. A task on the event loop
+drains the queue in batches, so a slow step or a burst of packets doesn't
+hold up the BLE callback. When the queue is full the overflow policy decides:
+
+    OVERFLOW_COALESCE     The sender's newest queued packet is replaced by the one coming in
+    OVERFLOW_DROP_OLDEST  The oldest packet is dropped
+    OVERFLOW_BLOCK        The callback waits for room (on the loop's own thread it works through a batch itself)
+
+Samples keep the time the packet arrived, not when it was decoded.
+'''
+import time
+import asyncio
+import threading
+import collections
+
+from motivation import metrics
+
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_BLOCK = "block"
+
+OVERFLOW_POLICIES = (OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK)
+
+
+class PipelineStats:
+    '''
+    Queue depth and what happened to the packets that didn't fit
+    '''
+
+    def __init__(self):
+        self.received = 0
+        self.processed = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.max_depth = 0
+
+    def __str__(self):
+        mean_batch = self.processed / self.batches if self.batches else 0.0
+        return (f"Queued: {self.received}, Processed: {self.processed} in {self.batches} batches "
+                f"(mean {mean_batch:.1f}), Max depth: {self.max_depth}, Coalesced: {self.coalesced}, "
+                f"Dropped: {self.dropped}, Blocked: {self.blocked}")
+
+
+class NotificationPipeline:
+    '''
+    Bounded queue between Bleak's notification callback and the trainer's
+    decoders. Subscribe with `handler`, start() and stop() it on the event loop.
+    '''
+
+    def __init__(self, trainer, loop, maxsize=64, overflow=OVERFLOW_COALESCE, batch_size=32):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}")
+
+        self.trainer = trainer
+        self.loop = loop
+        self.maxsize = max(1, maxsize)
+        self.overflow = overflow
+        self.batch_size = max(1, batch_size)
+        self.clock = trainer.power_tracker.clock
+        self.queue = collections.deque()  # [received, sender, data]
+        self._coalesce = overflow == OVERFLOW_COALESCE
+        self._latest = {}  # Sender -> its newest queued entry, only kept when coalescing
+        self.lock = threading.Lock()
+        self.space = threading.Condition(self.lock)
+        self.stats = PipelineStats()
+        self._wakeup = None
+        self._idle = True
+        self._task = None
+        self._loop_thread = None
+        self._last_notification = None
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def start(self):
+        '''
+        Start the task that drains the queue
+        '''
+        self._wakeup = asyncio.Event()
+        self._loop_thread = threading.get_ident()
+        self._task = self.loop.create_task(self._consume())
+
+    async def stop(self):
+        '''
+        Stop the consumer and process whatever is still queued
+        '''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        while self._drain():
+            pass
+
+        with self.lock:
+            self.space.notify_all()
+
+    def handler(self, sender, data):
+        '''
+        Called by Bleak for every notification, might be on Bleak's own thread
+        '''
+        received = self.clock()
+        trainer = self.trainer
+
+        if metrics.enabled:
+            start = time.perf_counter()
+            metrics.NOTIFICATIONS.inc()
+            if self._last_notification is not None:
+                metrics.NOTIFICATION_INTERVAL.observe(start - self._last_notification)
+            self._last_notification = start
+
+        # Recorded as it arrives so a recording has every packet, even ones that get dropped
+        if trainer.recorder is not None:
+            trainer.recorder.record_notification(trainer.senders.get(sender, sender), data)
+
+        with self.lock:
+            queue = self.queue
+            if len(queue) >= self.maxsize:
+                entry = self._latest.get(sender) if self._coalesce else None
+                if entry is not None:
+                    # Still waiting to be decoded, it gets the latest data instead
+                    entry[0] = received
+                    entry[2] = data
+                    self.stats.received += 1
+                    self.stats.coalesced += 1
+                    if metrics.enabled:
+                        metrics.QUEUE_COALESCED.inc()
+                    return
+                self._overflow()
+
+            entry = [received, sender, data]
+            queue.append(entry)
+            if self._coalesce:
+                self._latest[sender] = entry
+            stats = self.stats
+            stats.received += 1
+            if len(queue) > stats.max_depth:
+                stats.max_depth = len(queue)
+            if metrics.enabled:
+                metrics.QUEUE_DEPTH.set(len(queue))
+
+            wake = self._idle
+            self._idle = False
+
+        if wake and self._wakeup is not None:
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _overflow(self):
+        '''
+        Make room for one more packet, called with the lock held
+        '''
+        queue = self.queue
+
+        if self.overflow != OVERFLOW_BLOCK:
+            # Dropping oldest, or coalescing a sender with nothing queued to replace
+            entry = queue.popleft()
+            if self._coalesce:
+                self._forget(entry)
+            self.stats.dropped += 1
+            if metrics.enabled:
+                metrics.QUEUE_DROPPED.inc()
+
+        else:
+            self.stats.blocked += 1
+            if metrics.enabled:
+                metrics.QUEUE_BLOCKED.inc()
+
+            if threading.get_ident() == self._loop_thread or self._task is None:
+                # Waiting here would hold up the consumer too, do its work instead
+                self.lock.release()
+                try:
+                    self._drain()
+                finally:
+                    self.lock.acquire()
+            else:
+                while len(queue) >= self.maxsize and self._task is not None:
+                    self.space.wait(1.0)
+
+            if len(queue) >= self.maxsize:
+                self._forget(queue.popleft())  # Stopped while waiting
+                self.stats.dropped += 1
+
+    def _forget(self, entry):
+        '''
+        An entry's left the queue, it can't be coalesced into any more. Called with the lock held.
+        '''
+        if self._latest.get(entry[1]) is entry:
+            del self._latest[entry[1]]
+
+    def _drain(self):
+        '''
+        Decode up to batch_size queued packets. Returns how many there were.
+        '''
+        with self.lock:
+            queue = self.queue
+            count = min(self.batch_size, len(queue))
+            batch = [queue.popleft() for _ in range(count)]
+            if self._coalesce:
+                if not queue:
+                    self._latest.clear()
+                else:
+                    for entry in batch:
+                        self._forget(entry)
+            if not queue:
+                self._idle = True
+            if self.overflow == OVERFLOW_BLOCK:
+                self.space.notify_all()
+            if metrics.enabled:
+                metrics.QUEUE_DEPTH.set(len(queue))
+
+        if not count:
+            return 0
+
+        trainer = self.trainer
+        for received, sender, data in batch:
+            trainer.received = received
+            trainer.decode_notification(sender, data)
+            if metrics.enabled:
+                metrics.NOTIFICATION_LATENCY.observe(self.clock() - received)
+        trainer.received = None
+
+        self.stats.processed += count
+        self.stats.batches += 1
+        return count
+
+    async def _consume(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._drain():
+                await asyncio.sleep(0)  # Let the rest of the loop in between batches
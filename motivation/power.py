@@ -1,8 +1,12 @@
 '''
 Used to track power
 '''
+import math
+import time
 import threading
 
+from motivation.window import RollingWindow
+
 
 class PowerTracker:
     '''
@@ -15,7 +19,13 @@ class PowerTracker:
         self.lock = threading.Lock()
         self.power = 0
         self.req_power = req_power
-        self._instance = self
+        self.schedule = None
+        self.started = None  # Timestamp of the first sample, the workout starts there
+        self.updated = None
+        self.timestamp = None
+        self.clock = time.perf_counter  # Where sample timestamps come from when not given
+        self._listeners = []
+        PowerTracker._instance = self
 
     @classmethod
     def get(cls):
@@ -24,12 +34,36 @@ class PowerTracker:
         '''
         return cls._instance
 
-    def set_power(self, power):
+    def add_listener(self, callback):
+        '''
+        Register a callable that's called with this tracker after every new sample
+        '''
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        '''
+        Unregister a callable added with add_listener
+        '''
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def set_power(self, power, timestamp=None):
         '''
-        Value directly from device
+        Value directly from device. The timestamp (seconds) defaults to the tracker's clock.
         '''
         with self.lock:
             self.power = power
+            self.updated = time.perf_counter()
+            if timestamp is None:
+                timestamp = self.clock()
+            # A late sample doesn't take the workout's elapsed time backwards
+            if self.timestamp is None or timestamp > self.timestamp:
+                self.timestamp = timestamp
+            if self.started is None:
+                self.started = self.timestamp
+
+        for callback in self._listeners:
+            callback(self)
 
     def get_effective_power(self):
         '''
@@ -38,12 +72,28 @@ class PowerTracker:
         '''
         raise NotImplementedError
 
+    def set_schedule(self, schedule):
+        '''
+        Follow a workout (motivation.workout.Schedule) instead of a fixed required power
+        '''
+        self.schedule = schedule
+
+    def get_required_power(self):
+        '''
+        The power we need to be at or above
+        '''
+        if self.schedule is None:
+            return self.req_power
+        with self.lock:
+            elapsed = 0.0 if self.started is None else self.timestamp - self.started
+        return self.schedule.target(elapsed)
+
     def pass_fail(self):
         '''
         Are we doing well enough?
         '''
         eff_power = self.get_effective_power()
-        return eff_power >= self.req_power
+        return eff_power >= self.get_required_power()
 
 
 class AveragePowerTracker(PowerTracker):
@@ -51,16 +101,16 @@ class AveragePowerTracker(PowerTracker):
     Track average power output
     '''
 
-    def __init__(self):
+    def __init__(self, req_power):
         self.running_sum = 0
         self.count = 0
-        super().__init__()
+        super().__init__(req_power)
 
-    def set_power(self, power):
-        with self.lock():
+    def set_power(self, power, timestamp=None):
+        with self.lock:
             self.running_sum += power
             self.count += 1
-        super().set_power(power)
+        super().set_power(power, timestamp)
 
     def get_effective_power(self):
         '''
@@ -84,3 +134,94 @@ class RawPowerTracker(PowerTracker):
         '''
         with self.lock:
             return self.power
+
+
+class RollingPowerTracker(PowerTracker):
+    '''
+    Track time weighted average power over the last `window` seconds (e.g. 3s, 30s, 5 min)
+    '''
+
+    def __init__(self, req_power, window=30.0, resolution=1.0):
+        self.window = RollingWindow(window, resolution)
+        super().__init__(req_power)
+
+    def set_power(self, power, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        with self.lock:
+            self.window.add(power, timestamp)
+        super().set_power(power, timestamp)
+
+    def get_effective_power(self):
+        with self.lock:
+            return self.window.average
+
+
+class EWMAPowerTracker(PowerTracker):
+    '''
+    Track an exponentially weighted moving average of power. The weight of each
+    sample depends on the time since the last one so the trainer's sample rate
+    doesn't matter, time_constant is in seconds.
+    '''
+
+    def __init__(self, req_power, time_constant=30.0):
+        self.time_constant = time_constant
+        self.average = None
+        self.last_time = None
+        super().__init__(req_power)
+
+    def set_power(self, power, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        with self.lock:
+            if self.average is None:
+                self.average = power
+            elif timestamp > self.last_time:
+                alpha = 1 - math.exp((self.last_time - timestamp) / self.time_constant)
+                self.average += alpha * (power - self.average)
+            if self.last_time is None or timestamp > self.last_time:
+                self.last_time = timestamp  # A late sample would inflate the next one's weight
+        super().set_power(power, timestamp)
+
+    def get_effective_power(self):
+        with self.lock:
+            return self.average or 0
+
+
+class NormalizedPowerTracker(PowerTracker):
+    '''
+    Track Normalized Power. Every second the 30s rolling average is raised to
+    the 4th power and averaged, NP is the 4th root of that. Until there's a
+    full window of data the rolling average is used instead.
+    '''
+
+    def __init__(self, req_power, window=30.0):
+        self.rolling = RollingWindow(window)
+        self.sum_fourth = 0.0
+        self.ticks = 0
+        self.start = None
+        self.next_tick = None
+        super().__init__(req_power)
+
+    def set_power(self, power, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        with self.lock:
+            self.rolling.add(power, timestamp)
+
+            if self.start is None:
+                self.start = timestamp
+                self.next_tick = timestamp + self.rolling.window
+            elif timestamp >= self.next_tick:
+                # Normally one tick, but after a dropout every missed second counts the same
+                ticks = int(timestamp - self.next_tick) + 1
+                self.sum_fourth += ticks * self.rolling.average ** 4
+                self.ticks += ticks
+                self.next_tick += ticks
+        super().set_power(power, timestamp)
+
+    def get_effective_power(self):
+        with self.lock:
+            if not self.ticks:
+                return self.rolling.average
+            return (self.sum_fourth / self.ticks) ** 0.25
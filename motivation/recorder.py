@@ -1,4 +1,289 @@
 '''
 Activity recording functionality (save to file)
+
+Sessions are written as a header followed by fixed size little endian records
+so they can be appended to cheaply and read back with mmap without parsing.
+
+    Header: magic, version, record size, created (epoch seconds), device UUID, device name
+    Record: timestamp (epoch seconds), kind, channel, length, payload
+
+Record kinds:
+
+    RECORD_CHANNEL       Maps a channel number to the notification sender (UUID string) in the payload
+    RECORD_NOTIFICATION  Raw notification data from the channel
+    RECORD_SAMPLE        Decoded sample, payload is the power and effective power as float32
 '''
+import os
+import mmap
+import time
+import uuid
+import struct
+import logging
+import threading
+import collections
+
+MAGIC = b"MOTV"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHd16s32s")
+RECORD = struct.Struct("<dBBH36s")
+SAMPLE = struct.Struct("<ff")
+
+#: Payload bytes per record. Enough for a Cycling Power Measurement with every
+#: optional field. Longer notifications are truncated, the length field keeps
+#: the original size.
+PAYLOAD_SIZE = RECORD.size - struct.calcsize("<dBBH")
+
+RECORD_CHANNEL = 0
+RECORD_NOTIFICATION = 1
+RECORD_SAMPLE = 2
+
+SESSION_EXT = ".mot"
+
+LOGGER = logging.getLogger(__name__)
+
+Record = collections.namedtuple("Record", ("timestamp", "kind", "channel", "length", "payload"))
+Header = collections.namedtuple("Header", ("version", "record_size", "created", "device_uuid", "device_name"))
+
+
+class InvalidSessionFile(Exception):
+    pass
+
+
+class SessionRecorder:
+    '''
+    Records raw notifications and decoded samples for a session. The record_*
+    methods only queue things up, a background thread packs and writes them
+    every `interval` seconds (or sooner once `batch_size` records are waiting)
+    so disk I/O never happens on the notification path. The file is created
+    when recording starts, so a session that never gets going leaves nothing.
+    '''
+
+    def __init__(self, directory, device_uuid=None, device_name="", interval=1.0, batch_size=256, tag=None):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.created = time.time()
+        filename = time.strftime("session-%Y%m%d-%H%M%S", time.localtime(self.created))
+        if tag:
+            filename += "-" + "".join(c if c.isalnum() else "_" for c in tag)  # Tells sessions started together apart
+        self.path = os.path.join(directory, filename + SESSION_EXT)
+        self.written = 0
+        self.error = None  # Set if writing failed, nothing more is recorded after that
+        self._pending = collections.deque()
+        self._channels = {}
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+        self._fh = None
+        self._header = HEADER.pack(
+            MAGIC, VERSION, RECORD.size, self.created,
+            uuid.UUID(device_uuid).bytes if device_uuid else bytes(16),
+            (device_name or "").encode("utf-8")[:32]
+        )
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        '''
+        Create the file and start the writer thread
+        '''
+        self._fh = open(self.path, "wb")
+        self._fh.write(self._header)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="motivation-recorder", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        '''
+        Write whatever is left and close the file
+        '''
+        if self._thread is not None:
+            self._running = False
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+
+        if self._fh is not None and not self._fh.closed:
+            if self.error is None:
+                self._flush_or_fail()
+            self._fh.close()
+
+    def record_notification(self, sender, data, timestamp=None):
+        '''
+        Queue a raw notification. Safe to call from any thread.
+        '''
+        if self.error is not None:
+            return
+        self._pending.append((timestamp or time.time(), RECORD_NOTIFICATION, sender, bytes(data)))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def record_sample(self, power_tracker):
+        '''
+        Queue a decoded sample. Meant to be added as a PowerTracker listener.
+        '''
+        if self.error is not None:
+            return
+        self._pending.append((time.time(), RECORD_SAMPLE, None, (power_tracker.power, power_tracker.get_effective_power())))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        '''
+        Pack and write everything that's queued. Only called from the writer thread (or after it's stopped).
+        '''
+        count = len(self._pending)
+        if not count:
+            return
+
+        buf = bytearray()
+        for _ in range(count):
+            timestamp, kind, sender, value = self._pending.popleft()
+
+            if kind == RECORD_SAMPLE:
+                buf += RECORD.pack(timestamp, kind, 0, SAMPLE.size, SAMPLE.pack(*value))
+                continue
+
+            channel = self._channels.get(sender)
+            if channel is None:
+                channel = self._add_channel(buf, timestamp, sender)
+            buf += RECORD.pack(timestamp, kind, channel, len(value), value)
+
+        self._fh.write(buf)
+        self._fh.flush()
+        self.written += len(buf) // RECORD.size
+
+    def _add_channel(self, buf, timestamp, sender):
+        channel = len(self._channels)
+        if channel > 0xFF:
+            raise ValueError(f"Too many notification senders to record {sender}")
+
+        name = str(sender).encode("utf-8")
+        buf += RECORD.pack(timestamp, RECORD_CHANNEL, channel, len(name), name)
+        self._channels[sender] = channel
+        return channel
+
+    def _flush_or_fail(self):
+        '''
+        flush(), but a failure (e.g. disk full) stops the recording instead of
+        killing the writer thread and leaving records to pile up
+        '''
+        try:
+            self.flush()
+        except Exception as e:
+            self.error = e
+            self._pending.clear()
+            LOGGER.error(f"Recording to {self.path} stopped: {e}")
+
+    def _run(self):
+        while self._running and self.error is None:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self._flush_or_fail()
+
+
+class SessionReader:
+    '''
+    Memory mapped reader for a recorded session. Opening is constant time no
+    matter how long the session is, records are unpacked when accessed.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, "rb")
+
+        try:
+            size = os.fstat(self._fh.fileno()).st_size
+            if size < HEADER.size:
+                raise InvalidSessionFile(f"{path} is too small to be a session file")
+
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, record_size, created, device_uuid, device_name = HEADER.unpack_from(self._mm)
+            if magic != MAGIC:
+                raise InvalidSessionFile(f"{path} is not a session file")
+            if version != VERSION or record_size != RECORD.size:
+                raise InvalidSessionFile(f"{path} is an unsupported version ({version})")
+        except Exception:
+            self.close()
+            raise
+
+        self.header = Header(
+            version, record_size, created,
+            str(uuid.UUID(bytes=device_uuid)) if any(device_uuid) else None,
+            device_name.rstrip(b"\x00").decode("utf-8", "replace")
+        )
+        # A partially written record at the end (e.g. crash) is ignored
+        self.count = (size - HEADER.size) // RECORD.size
+        self._channels = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.count
+        if not 0 <= idx < self.count:
+            raise IndexError(idx)
+        return Record._make(RECORD.unpack_from(self._mm, HEADER.size + idx * RECORD.size))
+
+    def __iter__(self):
+        with self.buffer as buf:
+            for values in RECORD.iter_unpack(buf):
+                yield Record._make(values)
+
+    def close(self):
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._fh.close()
+
+    @property
+    def buffer(self):
+        '''
+        Zero copy view of all the complete records
+        '''
+        return memoryview(self._mm)[HEADER.size:HEADER.size + self.count * RECORD.size]
+
+    @property
+    def channels(self):
+        '''
+        Channel number -> notification sender
+        '''
+        if self._channels is None:
+            self._channels = {}
+            for record in self:
+                if record.kind == RECORD_CHANNEL:
+                    self._channels[record.channel] = record.payload[:record.length].decode("utf-8")
+        return self._channels
+
+    def notifications(self):
+        '''
+        Yield (timestamp, sender, data) for every recorded notification
+        '''
+        channels = {}
+        with self.buffer as buf:
+            for timestamp, kind, channel, length, payload in RECORD.iter_unpack(buf):
+                if kind == RECORD_NOTIFICATION:
+                    yield timestamp, channels[channel], payload[:min(length, PAYLOAD_SIZE)]
+                elif kind == RECORD_CHANNEL:
+                    channels[channel] = payload[:length].decode("utf-8")
 
+    def samples(self):
+        '''
+        Yield (timestamp, power, effective power) for every recorded sample
+        '''
+        with self.buffer as buf:
+            for timestamp, kind, _, _, payload in RECORD.iter_unpack(buf):
+                if kind == RECORD_SAMPLE:
+                    yield (timestamp,) + SAMPLE.unpack_from(payload)
@@ -0,0 +1,133 @@
+'''
+Replay recorded sessions through the trainer plugins without a trainer
+'''
+import time
+import asyncio
+
+from motivation.gate import PowerGate
+from motivation.loader import TrainerPluginLoader
+
+
+class UnsupportedSession(Exception):
+    pass
+
+
+class ReplayCharacteristic:
+    '''
+    Stands in for a GATTCharacteristic for one recorded notification sender
+    '''
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.characteristic = self  # No handle, senders were recorded by UUID
+        self.descriptors = []
+
+    def is_notify(self):
+        return True
+
+
+class ReplayService:
+    '''
+    Stands in for a GATTService holding all the recorded characteristics
+    '''
+
+    description = "Replay"
+
+    def __init__(self, characteristics):
+        self.uuid = None
+        self.characteristics = characteristics
+
+
+class ReplayStats:
+    '''
+    What happened during a replay
+    '''
+
+    def __init__(self):
+        self.packets = 0
+        self.failures = 0
+        self.elapsed = 0.0
+        self.duration = 0.0
+
+    @property
+    def packets_per_second(self):
+        if not self.elapsed:
+            return 0.0
+        return self.packets / self.elapsed
+
+    def __str__(self):
+        return (f"Replayed {self.packets} packets ({self.duration:.1f}s of riding) in {self.elapsed:.3f}s, "
+                f"{self.packets_per_second:.0f} packets/s, {self.failures} controller disables")
+
+
+class ReplayClient:
+    '''
+    Stands in for BLEClient. Feeds the notifications from a recorded session
+    into the trainer plugin at real time (speed 1), N times real time (speed N)
+    or as fast as possible (speed 0). Tracker timestamps come from the recording
+    so the results are the same at any speed.
+    '''
+
+    def __init__(self, reader, power_tracker, speed=1.0, debug=False, lower_band=0.0, upper_band=0.0, min_dwell=0.0):
+        self.reader = reader
+        self.power_tracker = power_tracker
+        self.speed = speed
+        self.debug = debug
+        self.loop = asyncio.get_event_loop()
+        self.stats = ReplayStats()
+        self.now = 0.0
+
+        uuid = reader.header.device_uuid
+        trainer_cls = TrainerPluginLoader.get().get_by_uuid(uuid)
+        if trainer_cls is None:
+            raise UnsupportedSession(f"No trainer plugin for {uuid}")
+
+        self.trainer = trainer_cls(self.power_tracker, self)
+        self.services = [ReplayService([ReplayCharacteristic(uuid) for uuid in reader.channels.values()])]
+        self.trainer.build_dispatch(self.services)
+
+        # Deterministic: the tracker sees recorded time, not wall time
+        self.power_tracker.clock = lambda: self.now
+        self.gate = PowerGate(self.power_tracker, self.loop, stale_timeout=None, lower_band=lower_band, upper_band=upper_band,
+                              min_dwell=min_dwell, on_disable=self._on_disable, on_enable=self._on_enable, debug=debug)
+
+    def get_service_with_characteristic(self, char_uuid):
+        return self.services[0]
+
+    def run(self):
+        '''
+        Run the replay
+        '''
+        self.loop.run_until_complete(self._run())
+        return self.stats
+
+    def _on_disable(self):
+        self.stats.failures += 1
+
+    def _on_enable(self):
+        pass
+
+    async def _run(self):
+        handler = self.trainer.notification_handler
+        first = None
+        start = time.perf_counter()
+
+        self.gate.start()
+        try:
+            for timestamp, sender, data in self.reader.notifications():
+                if first is None:
+                    first = timestamp
+                self.now = timestamp - first
+
+                if self.speed:
+                    delay = self.now / self.speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                handler(sender, data)
+                self.stats.packets += 1
+        finally:
+            self.gate.stop()
+
+        self.stats.elapsed = time.perf_counter() - start
+        self.stats.duration = self.now
@@ -0,0 +1,209 @@
+'''
+Run several trainers at once on one event loop, e.g. a room full of riders
+'''
+import time
+import asyncio
+import logging
+
+from bleak.exc import BleakError
+
+from motivation.ble import BLEClient, BLEClientConnectionFailed
+from motivation.gate import GATE_DISABLED
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SessionStats:
+    '''
+    How much work one session's notifications cost. CPU time is the handler's
+    thread time so sessions sharing the process can be compared.
+    '''
+
+    def __init__(self):
+        self.notifications = 0
+        self.cpu = 0.0
+        self.max_cpu = 0.0
+        self.started = None
+        self.stopped = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.stopped or time.perf_counter()) - self.started
+
+    @property
+    def cpu_percent(self):
+        if not self.elapsed:
+            return 0.0
+        return self.cpu / self.elapsed * 100
+
+    @property
+    def mean_cpu(self):
+        if not self.notifications:
+            return 0.0
+        return self.cpu / self.notifications
+
+    def __str__(self):
+        return (f"Notifications: {self.notifications}, CPU: {self.cpu * 1000:.1f}ms ({self.cpu_percent:.2f}%), "
+                f"Mean handler CPU: {self.mean_cpu * 1e6:.1f}us, Max handler CPU: {self.max_cpu * 1e6:.1f}us")
+
+
+class Session:
+    '''
+    One rider: a device with its own tracker, gate, client and (optional) recorder.
+    Only a session with controller=True drives the controller backend, the
+    others just say when their rider drops below or gets back above target.
+    '''
+
+    def __init__(self, device, power_tracker, recorder=None, controller=False, client_cls=BLEClient, **client_options):
+        self.device = device
+        self.name = device.name
+        self.power_tracker = power_tracker
+        self.recorder = recorder
+        self.stats = SessionStats()
+        self.error = None
+
+        self.client = client_cls(device, power_tracker, recorder=recorder, **client_options)
+        self.gate = self.client.gate
+        if not controller:
+            self.gate.on_disable = lambda: LOGGER.info(f"{self.name}: YOU'RE DOING BAD!!")
+            self.gate.on_enable = lambda: LOGGER.info(f"{self.name}: Back in the game!")
+
+        # The client subscribes with whatever the trainer's handler is when it connects. Queued
+        # notifications are decoded by the pipeline's task, time that instead. With an acquisition
+        # process the decoding happens over there, time feeding its samples to the tracker.
+        if isinstance(self.client, BLEClient):
+            target = self.client.trainer
+            name = "notification_handler" if self.client.pipeline is None else "decode_notification"
+        else:
+            target, name = self.client, "process_sample"
+        handler = getattr(target, name)
+        setattr(target, name, lambda *args: self._timed(handler, *args))
+
+    def _timed(self, handler, *args):
+        start = time.thread_time()
+        handler(*args)
+        cpu = time.thread_time() - start
+
+        stats = self.stats
+        stats.notifications += 1
+        stats.cpu += cpu
+        if cpu > stats.max_cpu:
+            stats.max_cpu = cpu
+
+    async def run(self):
+        '''
+        Connect and ride until stopped. Errors are kept on the session so one
+        bad connection doesn't take the others down.
+        '''
+        self.stats.started = time.perf_counter()
+        try:
+            if self.recorder is not None:
+                with self.recorder:
+                    await self.client.run_async()
+            else:
+                await self.client.run_async()
+        except (BleakError, BLEClientConnectionFailed, asyncio.TimeoutError, OSError) as e:
+            self.error = e
+            LOGGER.error(f"{self.name}: Failed to connect to {self.device.address}: {e}")
+        except asyncio.CancelledError:
+            raise  # An Exception before Python 3.8
+        except Exception as e:
+            self.error = e
+            LOGGER.exception(f"{self.name}: Session failed: {e}")
+        finally:
+            self.stats.stopped = time.perf_counter()
+
+    def stop(self):
+        self.client.stop()
+
+    def report(self):
+        '''
+        Per session summary
+        '''
+        lines = [f"{self.name} ({self.device.address})"]
+        if self.error is not None:
+            lines.append(f"\tFailed: {self.error}")
+        lines.append(f"\tEffective power: {self.power_tracker.get_effective_power():.1f}w, "
+                     f"Gate: {self.gate.state}, Disabled {self.gate.transitions[GATE_DISABLED]} times")
+        if self.client.timings:
+            lines.append("\t" + ", ".join(f"{phase.capitalize()}: {secs:.3f}s" for phase, secs in self.client.timings.items()))
+        lines.append(f"\t{self.stats}")
+        lines.append(f"\t{self.gate.stats}")
+        if self.client.pipeline is not None:
+            lines.append(f"\t{self.client.pipeline.stats}")
+        if not isinstance(self.client, BLEClient):
+            lines.append(f"\t{self.client.stats}")
+        if self.recorder is not None:
+            lines.append(f"\tRecorded {self.recorder.written} records to {self.recorder.path}")
+            if self.recorder.error is not None:
+                lines.append(f"\tRecording stopped early: {self.recorder.error}")
+        return "\n".join(lines)
+
+
+class SessionManager:
+    '''
+    Connects N trainers concurrently on a single event loop. The devices come
+    from one scan and the plugin loader is shared, every session gets its own
+    tracker and gate.
+    '''
+
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.loop = asyncio.get_event_loop()
+        self.sessions = []
+        self.elapsed = 0.0
+        self.cpu = 0.0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(self.sessions)
+
+    def add(self, device, power_tracker, recorder=None, controller=False, **client_options):
+        '''
+        Add a session for a device. client_options are passed on to the client, a BLEClient unless client_cls is given.
+        '''
+        client_options.setdefault("debug", self.debug)
+        session = Session(device, power_tracker, recorder, controller, **client_options)
+        self.sessions.append(session)
+        return session
+
+    def run(self):
+        '''
+        Run every session until they're all stopped. Cntrl-C stops them all.
+        '''
+        start, cpu_start = time.perf_counter(), time.process_time()
+        task = self.loop.create_task(self.run_async())
+
+        try:
+            self.loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            # Let every session clean up its notifications
+            LOGGER.info("Clean exit...")
+            self.stop()
+            self.loop.run_until_complete(task)
+
+        self.elapsed = time.perf_counter() - start
+        self.cpu = time.process_time() - cpu_start
+
+    async def run_async(self):
+        await asyncio.gather(*(session.run() for session in self.sessions))
+
+    def stop(self):
+        '''
+        Ask every session to disconnect
+        '''
+        for session in self.sessions:
+            session.stop()
+
+    def report(self):
+        '''
+        Summary of every session and the process as a whole
+        '''
+        lines = [session.report() for session in self.sessions]
+        cpu_percent = self.cpu / self.elapsed * 100 if self.elapsed else 0.0
+        lines.append(f"{len(self.sessions)} sessions in {self.elapsed:.1f}s, process CPU: {self.cpu:.3f}s ({cpu_percent:.1f}%)")
+        return "\n".join(lines)
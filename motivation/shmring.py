@@ -0,0 +1,226 @@
+'''
+Lock free ring of records in shared memory
+
+One process writes, any number of processes read straight out of the shared
+memory, nothing is pickled or sent down a pipe. Records have the same fields
+as a recorded session (see motivation.recorder):
+
+    Header: magic, version, slot size, capacity, records written
+    Channels: MAX_CHANNELS notification senders (UUID strings), each filled in before it's first used
+    Slot: sequence, timestamp, kind, channel, length, payload
+
+Samples (RECORD_SAMPLE) have the tracker clock timestamp and the power as a
+float64 payload. Notifications (RECORD_NOTIFICATION) have the wall clock
+timestamp and the raw data, like the recorder.
+
+There are no locks between processes. The writer zeroes a slot's sequence
+number, fills the slot in and then sets the sequence to the record's index + 1.
+A reader copies a slot and checks the sequence before and after. If it isn't
+the one expected the record isn't there yet, or the writer has lapped the
+reader and the reader skips ahead to the oldest record still in the ring,
+counting what it missed. Readers never write to the ring so a slow one can't
+hold up the writer.
+
+Close readers before their ring. Closing the ring closes any reader that's
+still open, reading from a closed reader raises ValueError.
+'''
+import time
+import struct
+import logging
+import threading
+from multiprocessing import shared_memory
+
+from motivation.recorder import RECORD_SAMPLE, RECORD_NOTIFICATION, PAYLOAD_SIZE
+
+MAGIC = b"MOTR"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHQQ")
+WRITTEN = struct.Struct("<Q")
+CHANNEL = struct.Struct(f"<{PAYLOAD_SIZE}s")
+SEQUENCE = struct.Struct("<Q")
+BODY = struct.Struct(f"<dBBH{PAYLOAD_SIZE}s")
+SAMPLE_POWER = struct.Struct("<d")
+
+#: Notification senders a ring can name
+MAX_CHANNELS = 16
+
+#: Slots in a ring by default. Notifications and samples both take one.
+RING_SIZE = 4096
+
+SLOT_SIZE = SEQUENCE.size + BODY.size
+WRITTEN_OFFSET = HEADER.size - WRITTEN.size
+CHANNELS_OFFSET = HEADER.size
+SLOTS_OFFSET = CHANNELS_OFFSET + MAX_CHANNELS * CHANNEL.size
+
+LOGGER = logging.getLogger(__name__)
+
+
+class InvalidRing(Exception):
+    pass
+
+
+class SampleRing:
+    '''
+    Records in a block of shared memory. create() one in the process that owns
+    it and attach() to it by name from the others. Only one process writes.
+    '''
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        self.lock = threading.Lock()  # Bleak might call back on more than one thread in the writer
+        self.written = 0
+        self._channels = {}
+        self._readers = []
+
+        magic, version, slot_size, self.capacity, _ = HEADER.unpack_from(self.buf)
+        if magic != MAGIC or version != VERSION or slot_size != SLOT_SIZE:
+            self.close()
+            raise InvalidRing(f"{shm.name} isn't a version {VERSION} sample ring")
+
+    @classmethod
+    def create(cls, capacity=RING_SIZE):
+        '''
+        A new, empty ring. It's removed when this one is closed.
+        '''
+        shm = shared_memory.SharedMemory(create=True, size=SLOTS_OFFSET + capacity * SLOT_SIZE)
+        HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, SLOT_SIZE, capacity, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        '''
+        A ring another process created
+        '''
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def head(self):
+        '''
+        How many records have been written. Only a hint for readers, the slot sequence numbers are what count.
+        '''
+        return WRITTEN.unpack_from(self.buf, WRITTEN_OFFSET)[0]
+
+    def reader(self, start=None):
+        '''
+        A reader starting at record `start`, by default the next one written
+        '''
+        reader = RingReader(self, start)
+        self._readers.append(reader)
+        return reader
+
+    def sender(self, channel):
+        '''
+        The notification sender for a channel
+        '''
+        return CHANNEL.unpack_from(self.buf, CHANNELS_OFFSET + channel * CHANNEL.size)[0].rstrip(b"\x00").decode("utf-8")
+
+    def write(self, timestamp, kind, channel, length, payload):
+        with self.lock:
+            index = self.written
+            offset = SLOTS_OFFSET + index % self.capacity * SLOT_SIZE
+            buf = self.buf
+            SEQUENCE.pack_into(buf, offset, 0)
+            BODY.pack_into(buf, offset + SEQUENCE.size, timestamp, kind, channel, length, payload)
+            SEQUENCE.pack_into(buf, offset, index + 1)
+            self.written = index + 1
+            WRITTEN.pack_into(buf, WRITTEN_OFFSET, index + 1)
+
+    def write_sample(self, timestamp, power):
+        self.write(timestamp, RECORD_SAMPLE, 0, SAMPLE_POWER.size, SAMPLE_POWER.pack(power))
+
+    def record_notification(self, sender, data, timestamp=None):
+        '''
+        Same as SessionRecorder.record_notification so the ring can stand in for the trainer's recorder
+        '''
+        channel = self._channels.get(sender)
+        if channel is None:
+            channel = self._add_channel(sender)
+        self.write(timestamp or time.time(), RECORD_NOTIFICATION, channel, len(data), bytes(data[:PAYLOAD_SIZE]))
+
+    def _add_channel(self, sender):
+        with self.lock:
+            channel = len(self._channels)
+            if channel >= MAX_CHANNELS:
+                raise ValueError(f"Too many notification senders to pass on {sender}")
+
+            # Named before any record uses it so readers always find it
+            CHANNEL.pack_into(self.buf, CHANNELS_OFFSET + channel * CHANNEL.size, str(sender).encode("utf-8"))
+            self._channels[sender] = channel
+            return channel
+
+    def close(self):
+        '''
+        Let go of the shared memory, removing it if this process created it.
+        Readers still open are closed first.
+        '''
+        if self.buf is None:
+            return
+        for reader in list(self._readers):
+            reader.close()
+
+        self.buf = None  # Our reference to shm.buf, shm.close() releases it
+        try:
+            self.shm.close()
+        except BufferError as e:
+            # Something else still has a view of the memory, it's unmapped once that's gone
+            LOGGER.warning(f"Shared memory {self.shm.name} is still in use: {e}")
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingReader:
+    '''
+    One reader's place in a ring. Each reader has its own so consumers don't affect each other.
+    '''
+
+    def __init__(self, ring, start=None):
+        self.ring = ring
+        self.cursor = ring.head() if start is None else start
+        self.missed = 0
+
+    def read(self, limit=None):
+        '''
+        Records written since the last read, oldest first, as (timestamp, kind, channel, length, payload)
+        '''
+        ring = self.ring
+        if ring is None:
+            raise ValueError("Read from a closed ring reader")
+        buf = ring.buf
+        capacity = ring.capacity
+        records = []
+
+        while limit is None or len(records) < limit:
+            cursor = self.cursor
+            offset = SLOTS_OFFSET + cursor % capacity * SLOT_SIZE
+            expected = cursor + 1
+
+            sequence = SEQUENCE.unpack_from(buf, offset)[0]
+            if sequence == expected:
+                record = BODY.unpack_from(buf, offset + SEQUENCE.size)
+                if SEQUENCE.unpack_from(buf, offset)[0] == expected:
+                    records.append(record)
+                    self.cursor = expected
+                    continue
+            elif sequence < expected and (sequence or ring.head() <= cursor):
+                break  # Not written yet, or being written right now
+
+            # Lapped, the slot has (or is getting) a newer record
+            oldest = max(expected, ring.head() - capacity + 1)
+            self.missed += oldest - cursor
+            self.cursor = oldest
+
+        return records
+
+    def close(self):
+        '''
+        Stop reading, do this before the ring is closed
+        '''
+        if self.ring is not None:
+            self.ring._readers.remove(self)
+            self.ring = None
@@ -1,7 +1,24 @@
 '''
 Defines the base class for a smart trainer
 '''
-import os
+import time
+import logging
+import functools
+
+from motivation import metrics
+
+LOGGER = logging.getLogger(__name__)
+
+
+def notification(char_uuid):
+    '''
+    Decorator for SmartTrainer methods that decode notifications from a
+    characteristic. The method is called with the raw notification data.
+    '''
+    def decorator(func):
+        func.notification_uuid = char_uuid.lower()
+        return func
+    return decorator
 
 
 class SmartTrainer:
@@ -14,9 +31,154 @@ class SmartTrainer:
     #: for the devices discovered. This must be set by subclasses
     DEVICE_UUID = None
 
+    #: Characteristic UUID -> decoder method name. Built from the
+    #: methods decorated with @notification, don't set this directly.
+    #: Only these characteristics are subscribed to.
+    DECODERS = {}
+
+    #: Characteristic UUIDs to read once when connecting, the values end up
+    #: in startup_values. Nothing else is read.
+    STARTUP_READS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        decoders = dict(cls.DECODERS)
+        for name, member in vars(cls).items():
+            char_uuid = getattr(member, "notification_uuid", None)
+            if char_uuid is not None:
+                decoders[char_uuid] = name
+        cls.DECODERS = decoders
+
     def __init__(self, power_tracker, client):
         self.power_tracker = power_tracker
         self.client = client
+        self.debug = client.debug
+        self.recorder = None
+        self.dispatch = {}
+        self.senders = {}  # Sender -> characteristic UUID, notifications are recorded by UUID
+        self.startup_values = {}
+        self.received = None  # When the notification being decoded arrived (tracker clock) if it was queued
+        self._last_notification = None
+
+    @classmethod
+    def subscriptions(cls):
+        '''
+        Lower case UUIDs of the characteristics to subscribe to
+        '''
+        return frozenset(cls.DECODERS)
+
+    @classmethod
+    def startup_reads(cls):
+        '''
+        Lower case UUIDs of the characteristics to read when connecting
+        '''
+        return frozenset(uuid.lower() for uuid in cls.STARTUP_READS)
+
+    def build_dispatch(self, services):
+        '''
+        Build the sender -> decoder table once discovery is done. Bleak passes
+        the characteristic UUID (or handle on some backends) as the sender so
+        both are mapped. senders maps both to the UUID, that's what gets recorded.
+        '''
+        dispatch = {}
+        senders = {}
+        reads = self.startup_reads()
+
+        for service in services:
+            for char in service.characteristics:
+                senders[char.uuid] = char.uuid
+                handle = getattr(char.characteristic, "handle", None)
+                if handle is not None:
+                    senders[handle] = char.uuid
+
+                if char.uuid.lower() in reads and getattr(char, "value", None) is not None:
+                    self.startup_values[char.uuid.lower()] = char.value
+
+                name = self.DECODERS.get(char.uuid.lower())
+                if name is not None:
+                    decoder = getattr(self, name)
+                elif self.debug and char.is_notify():
+                    decoder = functools.partial(self.dump_notification, service)
+                else:
+                    continue
+
+                dispatch[char.uuid] = decoder
+                if handle is not None:
+                    dispatch[handle] = decoder
+
+        self.dispatch = dispatch
+        self.senders = senders
+        return dispatch
+
+    def dump_notification(self, service, data):
+        '''
+        Debug decoder for characteristics the plugin doesn't know about
+        '''
+        fmt_data = " ".join("%02x".upper() % b for b in data)
+        LOGGER.debug(f"{service.description}: {fmt_data}")
 
     def notification_handler(self, sender, data):
-        raise NotImplementedError
+        '''
+        Called by Bleak for every notification
+        '''
+        if metrics.enabled:
+            return self._measured_notification_handler(sender, data)
+
+        if self.recorder is not None:
+            self.recorder.record_notification(self.senders.get(sender, sender), data)
+
+        decoder = self.dispatch.get(sender)
+        if decoder is None:
+            return
+
+        try:
+            decoder(data)
+        except Exception as e:
+            # B/c otherwise the exception would be lost
+            LOGGER.warning(f"Failed to handle notification from {sender}: {e}")
+
+    def decode_notification(self, sender, data):
+        '''
+        Decode a notification that's already been recorded, used when notifications are queued
+        '''
+        decoder = self.dispatch.get(sender)
+        if decoder is None:
+            if metrics.enabled:
+                metrics.NOTIFICATIONS_DROPPED.inc()
+            return
+
+        try:
+            decoder(data)
+        except Exception as e:
+            if metrics.enabled:
+                metrics.NOTIFICATIONS_MALFORMED.inc()
+            LOGGER.warning(f"Failed to handle notification from {sender}: {e}")
+
+    def _measured_notification_handler(self, sender, data):
+        '''
+        notification_handler with metrics. The gate decides as part of the
+        decoder call so the time it takes is the notification to decision latency.
+        '''
+        start = time.perf_counter()
+        metrics.NOTIFICATIONS.inc()
+        if self._last_notification is not None:
+            metrics.NOTIFICATION_INTERVAL.observe(start - self._last_notification)
+        self._last_notification = start
+
+        if self.recorder is not None:
+            self.recorder.record_notification(self.senders.get(sender, sender), data)
+
+        decoder = self.dispatch.get(sender)
+        if decoder is None:
+            metrics.NOTIFICATIONS_DROPPED.inc()
+            return
+
+        try:
+            decoder(data)
+        except Exception as e:
+            metrics.NOTIFICATIONS_MALFORMED.inc()
+            LOGGER.warning(f"Failed to handle notification from {sender}: {e}")
+            return
+
+        metrics.NOTIFICATION_LATENCY.observe(time.perf_counter() - start)
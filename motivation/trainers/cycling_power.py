@@ -0,0 +1,203 @@
+'''
+Bluetooth SIG Cycling Power Service (0x1818) support shared by trainer plugins
+'''
+import time
+import struct
+import logging
+import operator
+import collections
+
+from motivation import metrics
+from motivation.trainers import SmartTrainer, notification
+
+LOGGER = logging.getLogger(__name__)
+
+CYCLING_POWER_SERVICE_UUID = "00001818-0000-1000-8000-00805f9b34fb"
+CYCLING_POWER_MEASUREMENT_UUID = "00002a63-0000-1000-8000-00805f9b34fb"
+CYCLING_POWER_FEATURE_UUID = "00002a65-0000-1000-8000-00805f9b34fb"
+
+# Cycling Power Measurement (0x2A63) is a uint16 flags field and a sint16
+# instantaneous power (watts). The flags decide which of the optional fields
+# below follow, in this order. All little endian.
+#
+# (flag bit, struct format, field names)
+MEASUREMENT_FIELDS = (
+    (0x0001, "B", ("pedal_power_balance",)),  # 1/2 percent
+    (0x0004, "H", ("accumulated_torque",)),  # 1/32 Nm
+    (0x0010, "IH", ("wheel_revolutions", "last_wheel_event_time")),  # 1/2048 s
+    (0x0020, "HH", ("crank_revolutions", "last_crank_event_time")),  # 1/1024 s
+    (0x0040, "hh", ("max_force", "min_force")),  # Newtons
+    (0x0080, "hh", ("max_torque", "min_torque")),  # 1/32 Nm
+    (0x0100, "3s", ("extreme_angles",)),  # Two packed uint12, degrees
+    (0x0200, "H", ("top_dead_spot_angle",)),  # Degrees
+    (0x0400, "H", ("bottom_dead_spot_angle",)),  # Degrees
+    (0x0800, "H", ("accumulated_energy",)),  # kJ
+)
+
+# Flags that don't add a field
+PEDAL_POWER_BALANCE_LEFT = 0x0002
+ACCUMULATED_TORQUE_CRANK_BASED = 0x0008
+OFFSET_COMPENSATION_INDICATOR = 0x1000
+
+
+class CyclingPowerMeasurement(collections.namedtuple("CyclingPowerMeasurement", ("flags", "power") + tuple(
+        name for _, _, names in MEASUREMENT_FIELDS for name in names))):
+    '''
+    A decoded cycling power measurement. Fields that weren't in the packet are None.
+    Values are as sent by the device, the properties convert to real units.
+    '''
+
+    __slots__ = ()
+
+    @property
+    def pedal_balance_percent(self):
+        if self.pedal_power_balance is None:
+            return None
+        return self.pedal_power_balance / 2
+
+    @property
+    def accumulated_torque_nm(self):
+        if self.accumulated_torque is None:
+            return None
+        return self.accumulated_torque / 32
+
+    @property
+    def wheel_event_seconds(self):
+        if self.last_wheel_event_time is None:
+            return None
+        return self.last_wheel_event_time / 2048
+
+    @property
+    def crank_event_seconds(self):
+        if self.last_crank_event_time is None:
+            return None
+        return self.last_crank_event_time / 1024
+
+    @property
+    def max_angle(self):
+        if self.extreme_angles is None:
+            return None
+        return int.from_bytes(self.extreme_angles, "little") & 0xFFF
+
+    @property
+    def min_angle(self):
+        if self.extreme_angles is None:
+            return None
+        return int.from_bytes(self.extreme_angles, "little") >> 12
+
+
+class MeasurementLayout:
+    '''
+    The compiled struct for one flags value and how to map it onto a CyclingPowerMeasurement
+    '''
+
+    def __init__(self, flags):
+        fmt = "<Hh"
+        present = ["flags", "power"]
+
+        for bit, field_fmt, names in MEASUREMENT_FIELDS:
+            if flags & bit:
+                fmt += field_fmt
+                present.extend(names)
+
+        self.flags = flags
+        self.struct = struct.Struct(fmt)
+
+        # Where each field is in the unpacked values, worked out once so decoding is just the
+        # unpack and an itemgetter. Missing fields point at the None added to the end.
+        missing = len(present)
+        self.fields = operator.itemgetter(*(
+            present.index(name) if name in present else missing for name in CyclingPowerMeasurement._fields))
+
+    def decode(self, data):
+        return CyclingPowerMeasurement._make(self.fields(self.struct.unpack_from(data) + _MISSING))
+
+
+class LayoutCache(dict):
+    '''
+    Layouts by flags value. Devices only ever send a few different flags values
+    so each one is compiled the first time it's seen and cached.
+    '''
+
+    def __missing__(self, flags):
+        layout = self[flags] = MeasurementLayout(flags)
+        return layout
+
+
+_LAYOUTS = LayoutCache()
+_MISSING = (None,)
+
+
+def get_layout(flags):
+    '''
+    Get the compiled layout for a flags value
+    '''
+    return _LAYOUTS[flags]
+
+
+def decode_measurement(data):
+    '''
+    Decode a Cycling Power Measurement notification. Raises struct.error if the
+    packet is too short for what its flags say is in it.
+    '''
+    if len(data) < 2:
+        raise struct.error(f"Need at least 2 bytes for the flags, got {len(data)}")
+
+    return _LAYOUTS[data[0] | (data[1] << 8)].decode(data)
+
+
+class CyclingPowerTrainer(SmartTrainer):
+    '''
+    Base class for trainers that implement the standard Cycling Power Service.
+    Plugins subclass this and set DEVICE_UUID.
+    '''
+
+    #: Which optional measurement fields the device supports
+    STARTUP_READS = (CYCLING_POWER_FEATURE_UUID,)
+
+    def __init__(self, power_tracker, client):
+        super().__init__(power_tracker, client)
+        self.measurement = None
+
+    @property
+    def features(self):
+        '''
+        Cycling Power Feature flags (uint32), None if they weren't read
+        '''
+        value = self.startup_values.get(CYCLING_POWER_FEATURE_UUID)
+        if value is None or len(value) < 4:
+            return None
+        return int.from_bytes(value[:4], "little")
+
+    @notification(CYCLING_POWER_MEASUREMENT_UUID)
+    def _handle_cycling_power(self, data):
+        '''
+        Handle a cycling power measurement notification. This runs for every
+        packet so nothing gets formatted unless we're debugging.
+        '''
+        if metrics.enabled:
+            start = time.perf_counter()
+
+        try:
+            measurement = decode_measurement(data)
+        except struct.error as e:
+            if metrics.enabled:
+                metrics.NOTIFICATIONS_MALFORMED.inc()
+            LOGGER.warning(f"Failed to unpack cycling power data ({len(data)} bytes): {e}")
+            return
+
+        self.measurement = measurement
+
+        if metrics.enabled:
+            decoded = time.perf_counter()
+            metrics.DECODE_TIME.observe(decoded - start)
+            self.power_tracker.set_power(measurement.power, self.received)
+            # The tracker stamps `updated` once it has the sample, right before the gate is told about it
+            metrics.TRACKER_UPDATE_TIME.observe(self.power_tracker.updated - decoded)
+        else:
+            self.power_tracker.set_power(measurement.power, self.received)
+
+        if self.debug:
+            fmt_data = " ".join("%02x".upper() % b for b in data)
+            LOGGER.debug(f"Cycling Power: {fmt_data}")
+            LOGGER.debug(f"Power: {measurement.power}w, Effective: {self.power_tracker.get_effective_power()}w")
@@ -0,0 +1,103 @@
+'''
+Fixed size, time based rolling windows
+'''
+import math
+from array import array
+
+
+class RollingWindow:
+    '''
+    Time weighted average over the last `window` seconds.
+
+    Each sample's power is held until the next sample arrives and that energy
+    (watts * seconds) is added to fixed width time buckets. The buckets live in
+    preallocated arrays used as a ring buffer, so memory and the cost per sample
+    don't depend on how long the session runs or how fast the trainer sends data.
+    '''
+
+    def __init__(self, window, resolution=1.0):
+        self.window = window
+        self.resolution = resolution
+        self.size = max(1, math.ceil(window / resolution))
+        self.energy = array("d", bytes(8 * self.size))
+        self.duration = array("d", bytes(8 * self.size))
+        self.total_energy = 0.0
+        self.total_duration = 0.0
+        self.bucket = None  # Absolute number of the newest bucket
+        self.last_power = None
+        self.last_time = None
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        for idx in range(self.size):
+            self.energy[idx] = 0.0
+            self.duration[idx] = 0.0
+        self.total_energy = 0.0
+        self.total_duration = 0.0
+
+    def add(self, power, timestamp):
+        '''
+        Add a sample. Timestamps are in seconds, one earlier than the last sample
+        is treated as arriving at the same time so nothing is counted twice.
+        '''
+        if self.last_time is not None:
+            if timestamp < self.last_time:
+                timestamp = self.last_time
+            elif timestamp > self.last_time:
+                self._accumulate(self.last_power, self.last_time, timestamp)
+        self.last_power = power
+        self.last_time = timestamp
+
+    @property
+    def average(self):
+        '''
+        Time weighted average power over the window
+        '''
+        if self.total_duration <= 0:
+            return self.last_power or 0
+        return self.total_energy / self.total_duration
+
+    def _advance(self, bucket):
+        '''
+        Make bucket the newest one, clearing out the buckets that fall off the end of the window
+        '''
+        if self.bucket is None:
+            self.bucket = bucket
+            return
+
+        steps = bucket - self.bucket
+        if steps <= 0:
+            return
+
+        if steps >= self.size:
+            self.clear()
+        else:
+            for step in range(1, steps + 1):
+                idx = (self.bucket + step) % self.size
+                self.total_energy -= self.energy[idx]
+                self.total_duration -= self.duration[idx]
+                self.energy[idx] = 0.0
+                self.duration[idx] = 0.0
+
+        self.bucket = bucket
+
+    def _accumulate(self, power, start, end):
+        # Anything older than the window would just get cleared out again
+        start = max(start, end - self.window)
+
+        while start < end:
+            bucket = int(start // self.resolution)
+            self._advance(bucket)
+
+            stop = min(end, (bucket + 1) * self.resolution)
+            elapsed = stop - start
+            if elapsed <= 0:
+                break  # Float rounding right on a bucket boundary
+            idx = bucket % self.size
+            self.energy[idx] += power * elapsed
+            self.duration[idx] += elapsed
+            self.total_energy += power * elapsed
+            self.total_duration += elapsed
+            start = stop
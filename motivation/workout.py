@@ -0,0 +1,154 @@
+'''
+Workouts: required power that changes over the ride
+
+A workout is a list of segments:
+
+    {"power": 150, "duration": "5:00"}          Hold 150w for 5 minutes
+    {"ramp": [100, 200], "duration": 600}       Go from 100w to 200w over 10 minutes
+    {"repeat": 4, "segments": [...]}            The segments 4 times over
+
+Power is in watts or a percentage of FTP ("88%"), durations are seconds or
+m:ss / h:mm:ss. A workout is compiled once into a table of breakpoints
+(start time, power, watts per second) so the target at any point in the ride
+is a bisect and a multiply. After the last segment its final target holds.
+'''
+from bisect import bisect_right
+
+#: Most breakpoints a workout can compile to, so a typo'd repeat can't eat all the memory
+MAX_BREAKPOINTS = 100000
+
+
+class InvalidWorkout(Exception):
+    pass
+
+
+class Schedule:
+    '''
+    A compiled workout. times is sorted, powers and slopes line up with it.
+    '''
+
+    def __init__(self, times, powers, slopes, name=""):
+        self.times = times
+        self.powers = powers
+        self.slopes = slopes
+        self.name = name
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return self.times[-1]
+
+    def target(self, elapsed):
+        '''
+        Required power `elapsed` seconds into the workout
+        '''
+        idx = bisect_right(self.times, elapsed) - 1
+        if idx < 0:
+            idx = 0
+            elapsed = 0.0
+        return self.powers[idx] + self.slopes[idx] * (elapsed - self.times[idx])
+
+
+def parse_duration(value):
+    '''
+    Seconds from a number or a [h:]mm:ss string
+    '''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    elif isinstance(value, str):
+        try:
+            seconds = 0.0
+            for part in value.split(":"):
+                seconds = seconds * 60 + float(part)
+        except ValueError:
+            raise InvalidWorkout(f"Bad duration: {value!r}")
+    else:
+        raise InvalidWorkout(f"Bad duration: {value!r}")
+
+    if seconds <= 0:
+        raise InvalidWorkout(f"Durations must be more than 0: {value!r}")
+    return seconds
+
+
+def parse_power(value, ftp=None):
+    '''
+    Watts from a number or a percentage of FTP
+    '''
+    if isinstance(value, str) and value.strip().endswith("%"):
+        if not ftp:
+            raise InvalidWorkout(f"{value} needs an FTP, set one with --ftp or in your profile")
+        try:
+            return float(value.strip()[:-1]) * ftp / 100
+        except ValueError:
+            raise InvalidWorkout(f"Bad power: {value!r}")
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0:
+        return float(value)
+    raise InvalidWorkout(f"Bad power: {value!r}")
+
+
+def _compile_segments(segments, ftp, times, powers, slopes, elapsed):
+    '''
+    Append breakpoints for a list of segments starting at `elapsed`. Returns the time they end.
+    '''
+    if not isinstance(segments, list):
+        raise InvalidWorkout("segments must be a list")
+
+    for segment in segments:
+        if not isinstance(segment, dict):
+            raise InvalidWorkout(f"Bad segment: {segment!r}")
+
+        if "repeat" in segment:
+            count = segment["repeat"]
+            if not isinstance(count, int) or count < 1:
+                raise InvalidWorkout(f"Bad repeat count: {count!r}")
+            # Every pass has to add a step or MAX_BREAKPOINTS never stops it
+            repeated = segment.get("segments")
+            if not repeated or not isinstance(repeated, list):
+                raise InvalidWorkout(f"A repeat needs a list of segments: {segment!r}")
+            for _ in range(count):
+                elapsed = _compile_segments(repeated, ftp, times, powers, slopes, elapsed)
+            continue
+
+        duration = parse_duration(segment.get("duration"))
+        if "ramp" in segment:
+            ramp = segment["ramp"]
+            if not isinstance(ramp, list) or len(ramp) != 2:
+                raise InvalidWorkout(f"A ramp is [from, to]: {ramp!r}")
+            start, end = parse_power(ramp[0], ftp), parse_power(ramp[1], ftp)
+        elif "power" in segment:
+            start = end = parse_power(segment["power"], ftp)
+        else:
+            raise InvalidWorkout(f"Segment needs power, ramp or repeat: {segment!r}")
+
+        if len(times) >= MAX_BREAKPOINTS:
+            raise InvalidWorkout(f"More than {MAX_BREAKPOINTS} steps, check your repeats")
+        times.append(elapsed)
+        powers.append(start)
+        slopes.append((end - start) / duration)
+        elapsed += duration
+
+    return elapsed
+
+
+def compile_workout(workout, ftp=None):
+    '''
+    Compile a parsed workout document into a Schedule. The workout's own "ftp" is
+    used if one isn't given.
+    '''
+    if not isinstance(workout, dict):
+        raise InvalidWorkout("A workout is an object with a list of segments")
+
+    ftp = ftp or workout.get("ftp")
+    times, powers, slopes = [], [], []
+    end = _compile_segments(workout.get("segments"), ftp, times, powers, slopes, 0.0)
+    if not times:
+        raise InvalidWorkout("The workout has no segments")
+
+    # The last target holds once the workout's over
+    times.append(end)
+    powers.append(powers[-1] + slopes[-1] * (end - times[-2]))
+    slopes.append(0.0)
+
+    return Schedule(times, powers, slopes, workout.get("name", ""))
@@ -0,0 +1,18 @@
+'''
+Shared fixtures
+'''
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def loop():
+    '''
+    A fresh event loop, set as the current one for code that calls get_event_loop()
+    '''
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
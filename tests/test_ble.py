@@ -0,0 +1,81 @@
+'''
+BLEClient reconnect tests against motivation.fakeble
+'''
+import asyncio
+
+import pytest
+
+from motivation.ble import BLEClient
+from motivation.fakeble import FakeFleet, FakeTrainer, FakeBleakClient
+from motivation.power import RawPowerTracker
+
+
+class SilentDropClient(FakeBleakClient):
+    '''
+    A backend that never says the link dropped and raises when asked if it's still up
+    '''
+
+    def set_disconnected_callback(self, callback):
+        pass
+
+    async def is_connected(self):
+        self._check_connected()
+        return True
+
+
+class SilentDropFleet(FakeFleet):
+
+    def client(self, address, loop=None, timeout=10, **kwargs):
+        return SilentDropClient(self, address, loop, timeout, **kwargs)
+
+
+@pytest.fixture
+def trainer(loop):
+    trainer = FakeTrainer("KICKR", rate=50, disconnect_after=0.05)
+    fleet = SilentDropFleet([trainer])
+    fleet.install()
+    yield trainer
+    fleet.uninstall()
+
+
+def make_client(trainer, link_check):
+    client = BLEClient(trainer, RawPowerTracker(0), stale_timeout=0, reconnect=True, initial_backoff=0.01,
+                       max_backoff=0.01)
+    client.LINK_CHECK = link_check
+    return client
+
+
+async def wait_for(condition, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out")
+
+
+def test_reconnects_when_the_link_check_raises(loop, trainer):
+    client = make_client(trainer, 0.01)
+
+    async def ride():
+        task = loop.create_task(client.run_async())
+        await wait_for(lambda: client.reconnects >= 2 or task.done())
+        client.stop()
+        await task
+
+    loop.run_until_complete(ride())
+    assert client.reconnects >= 2
+    assert trainer.connects >= 3
+
+
+def test_stopping_after_an_unnoticed_drop(loop, trainer):
+    client = make_client(trainer, 60.0)
+
+    async def ride():
+        task = loop.create_task(client.run_async())
+        await wait_for(lambda: client.gate.running)
+        await asyncio.sleep(0.1)  # The link's gone but nothing's checked
+        client.stop()
+        await task
+
+    loop.run_until_complete(ride())
+    assert trainer.connects == 1
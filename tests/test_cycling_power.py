@@ -0,0 +1,74 @@
+'''
+Cycling Power Measurement decoding tests against packets built by hand from the spec
+'''
+import struct
+
+import pytest
+
+from motivation.trainers.cycling_power import decode_measurement, get_layout, CyclingPowerMeasurement
+
+
+def test_power_only():
+    m = decode_measurement(bytes.fromhex("0000 c800"))
+    assert (m.flags, m.power) == (0, 200)
+    assert all(value is None for value in m[2:])
+
+
+def test_power_is_signed():
+    assert decode_measurement(bytes.fromhex("0000 f6ff")).power == -10
+
+
+def test_kickr_torque_and_wheel():
+    # Accumulated torque 320/32 Nm, 10 wheel revolutions at 2048/2048 s
+    m = decode_measurement(bytes.fromhex("1400 c800 4001 0a000000 0008"))
+    assert m.power == 200
+    assert m.accumulated_torque == 320
+    assert m.accumulated_torque_nm == 10.0
+    assert m.wheel_revolutions == 10
+    assert m.last_wheel_event_time == 2048
+    assert m.wheel_event_seconds == 1.0
+    assert m.pedal_power_balance is None
+    assert m.crank_revolutions is None
+
+
+def test_pedal_balance_and_crank():
+    # Balance 101/2 %, left reference flag, 7 crank revolutions at 512/1024 s
+    m = decode_measurement(bytes.fromhex("2300 fa00 65 0700 0002"))
+    assert m.flags == 0x0023
+    assert m.pedal_power_balance == 101
+    assert m.pedal_balance_percent == 50.5
+    assert m.crank_revolutions == 7
+    assert m.crank_event_seconds == 0.5
+    assert m.wheel_revolutions is None
+
+
+def test_force_torque_and_angles():
+    # Max/min force 300/-50 N, max/min torque 64/-32, angles 350 and 170 degrees, dead spots 10 and 190
+    m = decode_measurement(bytes.fromhex("c007 6400 2c01 ceff 4000 e0ff 5ea10a 0a00 be00"))
+    assert (m.max_force, m.min_force) == (300, -50)
+    assert (m.max_torque, m.min_torque) == (64, -32)
+    assert (m.max_angle, m.min_angle) == (350, 170)
+    assert (m.top_dead_spot_angle, m.bottom_dead_spot_angle) == (10, 190)
+    assert m.accumulated_energy is None
+
+
+def test_every_field():
+    packet = bytes.fromhex("ff0f 2c01 64 4001 0a000000 0008 0700 0002 2c01 ceff 4000 e0ff 5ea10a 0a00 be00 0500")
+    m = decode_measurement(packet)
+    assert m == CyclingPowerMeasurement(0x0FFF, 300, 100, 320, 10, 2048, 7, 512, 300, -50, 64, -32, b"\x5e\xa1\x0a",
+                                        10, 190, 5)
+
+
+def test_trailing_bytes_are_ignored():
+    assert decode_measurement(bytes.fromhex("0008 6400 0500 ffff")).accumulated_energy == 5
+
+
+@pytest.mark.parametrize("packet", ["", "14", "1400 c800 4001 0a000000"])
+def test_short_packets_raise(packet):
+    with pytest.raises(struct.error):
+        decode_measurement(bytes.fromhex(packet))
+
+
+def test_layouts_are_cached():
+    assert get_layout(0x0014) is get_layout(0x0014)
+    assert get_layout(0x0014).struct.format == "<HhHIH"
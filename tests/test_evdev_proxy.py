@@ -0,0 +1,106 @@
+'''
+EvdevProxy tests, with motivation.fakeevdev standing in for the gamepad
+'''
+import time
+
+import pytest
+
+from motivation import fakeevdev
+from motivation.fakeevdev import FakeEvdev, FakeGamepad, ecodes
+from motivation.controller import unix
+from motivation.controller.unix import EvdevProxy, GamepadNotFound
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def fake():
+    return FakeEvdev([FakeGamepad("/dev/input/event3", "Keyboard", fakeevdev.KEYBOARD_CAPABILITIES),
+                      FakeGamepad("/dev/input/event5")])
+
+
+@pytest.fixture
+def proxy(fake):
+    proxy = EvdevProxy(evdev=fake)
+    proxy.open()
+    yield proxy
+    proxy.close()
+
+
+def test_finds_the_gamepad(proxy, fake):
+    assert proxy.path == "/dev/input/event5"
+    assert fake.gamepads[1].grabbed
+
+
+def test_forwards_while_enabled(proxy, fake):
+    fake.gamepads[1].send((ecodes.EV_KEY, ecodes.BTN_SOUTH, 1))
+    wait_for(lambda: proxy.forwarded == 2)
+    assert fake.uinputs[0].state == {(ecodes.EV_KEY, ecodes.BTN_SOUTH): 1}
+
+
+def test_disable_releases_buttons_and_axes(proxy, fake):
+    gamepad, uinput = fake.gamepads[1], fake.uinputs[0]
+    gamepad.send((ecodes.EV_KEY, ecodes.BTN_SOUTH, 1), (ecodes.EV_ABS, ecodes.ABS_X, 32767),
+                 (ecodes.EV_ABS, ecodes.ABS_RZ, 1023), (ecodes.EV_ABS, ecodes.ABS_HAT0Y, -1))
+    wait_for(lambda: proxy.forwarded == 5)
+
+    proxy.disable()
+    assert uinput.state[(ecodes.EV_KEY, ecodes.BTN_SOUTH)] == 0
+    assert uinput.state[(ecodes.EV_ABS, ecodes.ABS_X)] == 0
+    assert uinput.state[(ecodes.EV_ABS, ecodes.ABS_RZ)] == 0
+    assert uinput.state[(ecodes.EV_ABS, ecodes.ABS_HAT0Y)] == 0
+    assert uinput.events[-1] == (ecodes.EV_SYN, ecodes.SYN_REPORT, 0)
+
+    written = len(uinput.events)
+    gamepad.send((ecodes.EV_ABS, ecodes.ABS_Y, -32768))
+    wait_for(lambda: proxy.dropped == 2)
+    assert len(uinput.events) == written
+
+
+def test_close_stops_the_thread(fake):
+    proxy = EvdevProxy(evdev=fake)
+    proxy.open()
+    thread = proxy._thread
+    proxy.close()
+
+    assert not thread.is_alive()
+    assert not fake.gamepads[1].grabbed
+    assert fake.uinputs[0].closed
+    assert not fake.gamepads[1].handles
+
+
+def test_failed_grab_doesnt_leak(fake):
+    busy = fake.InputDevice("/dev/input/event5")
+    busy.grab()
+
+    proxy = EvdevProxy(evdev=fake)
+    with pytest.raises(OSError):
+        proxy.open()
+
+    assert fake.gamepads[1].handles == [busy]
+    assert not fake.uinputs
+    busy.close()
+    assert not fake.gamepads[1].grabbed
+
+
+def test_open_controller_fails_up_front():
+    fake = FakeEvdev([FakeGamepad("/dev/input/event3", "Keyboard", fakeevdev.KEYBOARD_CAPABILITIES)])
+    with pytest.raises(GamepadNotFound):
+        unix.unix_open_controller(evdev=fake)
+    assert unix._proxy is None
+
+
+def test_open_controller_uses_the_given_evdev(fake):
+    unix.unix_open_controller(evdev=fake)
+    try:
+        unix.unix_disable_controller()
+        assert unix._proxy.evdev is fake
+        assert not unix._proxy.enabled
+    finally:
+        unix.unix_close_controller()
+    assert unix._proxy is None
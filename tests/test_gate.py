@@ -0,0 +1,107 @@
+'''
+PowerGate state machine tests
+'''
+import asyncio
+
+import pytest
+
+from motivation.gate import PowerGate, GATE_ENABLED, GATE_DISABLED
+from motivation.power import RawPowerTracker
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def tracker():
+    tracker = RawPowerTracker(200)
+    tracker.clock = Clock()
+    return tracker
+
+
+def make_gate(tracker, loop, **options):
+    options.setdefault("stale_timeout", 0)
+    calls = []
+    gate = PowerGate(tracker, loop, on_disable=lambda: calls.append(GATE_DISABLED),
+                     on_enable=lambda: calls.append(GATE_ENABLED), **options)
+    gate.start()
+    return gate, calls
+
+
+def ride(tracker, *powers, step=1.0):
+    for power in powers:
+        tracker.clock.now += step
+        tracker.set_power(power)
+
+
+def test_threshold_edges(tracker, loop):
+    gate, calls = make_gate(tracker, loop)
+
+    ride(tracker, 200)
+    assert gate.state == GATE_ENABLED  # At the target is good enough
+    ride(tracker, 199.9)
+    assert gate.state == GATE_DISABLED
+    ride(tracker, 199.9, 150)
+    assert calls == [GATE_DISABLED]  # Only on the edge
+    ride(tracker, 200)
+    assert gate.state == GATE_ENABLED
+    assert calls == [GATE_DISABLED, GATE_ENABLED]
+    assert gate.transitions == {GATE_ENABLED: 1, GATE_DISABLED: 1}
+
+
+def test_hysteresis_bands(tracker, loop):
+    gate, calls = make_gate(tracker, loop, lower_band=10, upper_band=20)
+
+    ride(tracker, 190)
+    assert gate.state == GATE_ENABLED  # Exactly at required - lower_band
+    ride(tracker, 189)
+    assert gate.state == GATE_DISABLED
+    ride(tracker, 200, 219)
+    assert gate.state == GATE_DISABLED  # Back at the target isn't enough
+    ride(tracker, 220)
+    assert gate.state == GATE_ENABLED
+    assert calls == [GATE_DISABLED, GATE_ENABLED]
+
+
+def test_min_dwell_defers_changes(tracker, loop):
+    gate, calls = make_gate(tracker, loop, min_dwell=5)
+
+    ride(tracker, 100, step=2)
+    assert gate.state == GATE_ENABLED  # 2s in, the start counts as a transition
+    ride(tracker, 100, step=3)
+    assert gate.state == GATE_DISABLED  # 5s in, happens on the first sample after the dwell
+    assert gate.last_transition == 5.0
+
+    ride(tracker, 300, step=1)
+    assert gate.state == GATE_DISABLED
+    ride(tracker, 100, 300, step=2)
+    assert gate.state == GATE_ENABLED  # Only the state at each sample matters, not what came between
+    assert calls == [GATE_DISABLED, GATE_ENABLED]
+
+
+def test_stale_data_disables(tracker, loop):
+    gate, calls = make_gate(tracker, loop, stale_timeout=0.05)
+    ride(tracker, 300)
+
+    loop.run_until_complete(asyncio.sleep(0.15))
+    assert gate.state == GATE_DISABLED
+    assert calls == [GATE_DISABLED]  # Once, not every time the timer goes off
+
+    ride(tracker, 300)
+    assert gate.state == GATE_ENABLED
+    gate.stop()
+    assert not gate.running
+    ride(tracker, 100)
+    assert gate.state == GATE_ENABLED  # Stopped gates don't see samples
+
+
+def test_history(tracker, loop):
+    gate, _ = make_gate(tracker, loop)
+    ride(tracker, 100, 250)
+    assert list(gate.history) == [(1.0, GATE_DISABLED, 100), (2.0, GATE_ENABLED, 250)]
@@ -0,0 +1,65 @@
+'''
+GATT helper tests
+'''
+import gc
+import asyncio
+import warnings
+
+import pytest
+
+from motivation.gatt import _await_all
+
+
+class Operations:
+    '''
+    BLE operations that take a moment, one of them fails
+    '''
+
+    def __init__(self, count, failing):
+        self.count = count
+        self.failing = failing
+        self.finished = []
+        self.cancelled = []
+
+    async def run(self, idx):
+        try:
+            await asyncio.sleep(0.01 * idx)
+        except asyncio.CancelledError:
+            self.cancelled.append(idx)
+            raise
+        if idx == self.failing:
+            raise OSError(f"Operation {idx} failed")
+        self.finished.append(idx)
+
+    def coros(self):
+        return [self.run(idx) for idx in range(self.count)]
+
+
+@pytest.mark.parametrize("limit", [None, 2])
+def test_all_finish(loop, limit):
+    ops = Operations(5, None)
+    limiter = asyncio.Semaphore(limit) if limit else None
+    loop.run_until_complete(_await_all(ops.coros(), limiter))
+    assert sorted(ops.finished) == [0, 1, 2, 3, 4]
+
+
+def test_failure_closes_the_rest_without_a_limiter(loop):
+    ops = Operations(5, 1)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        with pytest.raises(OSError):
+            loop.run_until_complete(_await_all(ops.coros(), None))
+        gc.collect()
+
+    assert ops.finished == [0]
+    assert not [w for w in caught if issubclass(w.category, RuntimeWarning)]
+
+
+def test_failure_cancels_the_rest_with_a_limiter(loop):
+    ops = Operations(5, 1)
+    with pytest.raises(OSError):
+        loop.run_until_complete(_await_all(ops.coros(), asyncio.Semaphore(5)))
+
+    assert ops.finished == [0]
+    assert sorted(ops.cancelled) == [2, 3, 4]
+    assert all(task.done() for task in asyncio.all_tasks(loop))
@@ -0,0 +1,19 @@
+'''
+The CLI's import time budget (see benchmarks.importtime)
+'''
+import os
+
+from benchmarks.importtime import python_import_times, forbidden_imports, BUDGET_MS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_cli_import_is_lazy_and_in_budget():
+    times = python_import_times(["-c", "import motivation.cli.__main__"], cwd=ROOT)
+    assert "motivation.cli.__main__" in times
+
+    # bleak, numpy, the trainer plugins and the rest are only imported by the sub-command that needs them
+    assert forbidden_imports(times) == []
+
+    total_ms = sum(times.values()) / 1000
+    assert total_ms <= BUDGET_MS, f"Importing the CLI took {total_ms:.1f} ms (budget {BUDGET_MS:.1f} ms)"
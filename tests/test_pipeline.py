@@ -0,0 +1,131 @@
+'''
+NotificationPipeline overflow policy tests
+'''
+import asyncio
+import threading
+
+import pytest
+
+from motivation.pipeline import NotificationPipeline, OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+class Recorder:
+
+    def __init__(self):
+        self.notifications = []
+
+    def record_notification(self, sender, data, timestamp=None):
+        self.notifications.append((sender, data))
+
+
+class Trainer:
+    '''
+    Keeps what it's asked to decode, and when each packet arrived
+    '''
+
+    def __init__(self):
+        self.power_tracker = type("Tracker", (), {"clock": Clock()})()
+        self.recorder = Recorder()
+        self.senders = {}
+        self.received = None
+        self.decoded = []
+
+    def decode_notification(self, sender, data):
+        self.decoded.append((sender, data, self.received))
+
+
+def send(pipeline, *packets):
+    for packet in packets:
+        pipeline.handler(packet[0], packet)
+
+
+def drain(pipeline):
+    while pipeline._drain():
+        pass
+    return [data for _, data, _ in pipeline.trainer.decoded]
+
+
+def test_coalesce_replaces_the_senders_newest_packet():
+    pipeline = NotificationPipeline(Trainer(), None, 4, OVERFLOW_COALESCE)
+    send(pipeline, "a1", "a2", "b1", "a3")
+    send(pipeline, "a4", "b2")  # Full
+
+    assert drain(pipeline) == ["a1", "a2", "b2", "a4"]
+    stats = pipeline.stats
+    assert (stats.received, stats.coalesced, stats.dropped, stats.processed) == (6, 2, 0, 4)
+    assert stats.max_depth == 4
+
+    # Replaced packets keep the time the latest one arrived
+    assert [received for _, _, received in pipeline.trainer.decoded] == [1.0, 2.0, 6.0, 5.0]
+    # The recorder still has every one
+    assert len(pipeline.trainer.recorder.notifications) == 6
+
+
+def test_coalesce_drops_the_oldest_for_a_new_sender():
+    pipeline = NotificationPipeline(Trainer(), None, 3, OVERFLOW_COALESCE)
+    send(pipeline, "a1", "a2", "a3", "b1")
+
+    assert drain(pipeline) == ["a2", "a3", "b1"]
+    assert (pipeline.stats.coalesced, pipeline.stats.dropped) == (0, 1)
+
+
+def test_coalesce_doesnt_touch_decoded_packets():
+    pipeline = NotificationPipeline(Trainer(), None, 2, OVERFLOW_COALESCE, batch_size=1)
+    send(pipeline, "a1", "b1")
+    pipeline._drain()  # a1 is gone, its slot with it
+    send(pipeline, "a2", "a3")  # a3 replaces a2, not a1
+
+    assert drain(pipeline) == ["a1", "b1", "a3"]
+    assert (pipeline.stats.coalesced, pipeline.stats.dropped) == (1, 0)
+    assert pipeline._latest == {}
+
+
+def test_drop_oldest():
+    pipeline = NotificationPipeline(Trainer(), None, 3, OVERFLOW_DROP_OLDEST)
+    send(pipeline, "a1", "a2", "a3", "a4", "a5")
+
+    assert drain(pipeline) == ["a3", "a4", "a5"]
+    assert (pipeline.stats.received, pipeline.stats.dropped, pipeline.stats.coalesced) == (5, 2, 0)
+
+
+def test_block_on_the_loop_thread_works_through_a_batch():
+    pipeline = NotificationPipeline(Trainer(), None, 2, OVERFLOW_BLOCK, batch_size=1)
+    send(pipeline, "a1", "a2", "a3")
+
+    assert [data for _, data, _ in pipeline.trainer.decoded] == ["a1"]
+    assert drain(pipeline) == ["a1", "a2", "a3"]
+    assert (pipeline.stats.blocked, pipeline.stats.dropped) == (1, 0)
+
+
+def test_block_from_another_thread_waits_for_room(loop):
+    pipeline = NotificationPipeline(Trainer(), loop, 2, OVERFLOW_BLOCK, batch_size=1)
+    packets = [f"a{idx}" for idx in range(50)]
+
+    async def run():
+        pipeline.start()
+        sender = threading.Thread(target=send, args=[pipeline] + packets)
+        sender.start()
+        while sender.is_alive():
+            await asyncio.sleep(0.001)
+        sender.join()
+        await pipeline.stop()
+
+    loop.run_until_complete(run())
+    assert [data for _, data, _ in pipeline.trainer.decoded] == packets
+    assert pipeline.stats.dropped == 0
+    assert pipeline.stats.max_depth <= 2
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        NotificationPipeline(Trainer(), None, 2, "shrug")
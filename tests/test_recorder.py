@@ -0,0 +1,102 @@
+'''
+SessionRecorder / SessionReader round trip tests
+'''
+import os
+
+import pytest
+
+from motivation.recorder import (
+    SessionRecorder, SessionReader, InvalidSessionFile, HEADER, RECORD, PAYLOAD_SIZE,
+    RECORD_CHANNEL, RECORD_NOTIFICATION, RECORD_SAMPLE,
+)
+
+DEVICE_UUID = "c3b6a9a6-2a65-4c2f-8e0b-6a7b8c9d0e1f"
+POWER = "00002a63-0000-1000-8000-00805f9b34fb"
+CONTROL = "00002ad9-0000-1000-8000-00805f9b34fb"
+
+
+class Tracker:
+
+    def __init__(self, power, effective_power):
+        self.power = power
+        self.effective_power = effective_power
+
+    def get_effective_power(self):
+        return self.effective_power
+
+
+def record_session(directory):
+    '''
+    Write a short session, returns the recorder and what was recorded in order
+    '''
+    recorder = SessionRecorder(str(directory), DEVICE_UUID, "KICKR SNAP 1234")
+    sent = [
+        (1.0, POWER, b"\x00\x00\x96\x00"),
+        (1.5, CONTROL, b"\x80\x05\x01"),
+        (2.0, POWER, b"\x00\x00\xa0\x00"),
+        (2.5, POWER, bytes(range(PAYLOAD_SIZE + 4))),  # Too long, truncated
+    ]
+    with recorder:
+        for timestamp, sender, data in sent[:2]:
+            recorder.record_notification(sender, data, timestamp)
+        recorder.record_sample(Tracker(150.0, 137.5))
+        for timestamp, sender, data in sent[2:]:
+            recorder.record_notification(sender, data, timestamp)
+        recorder.record_sample(Tracker(160.0, 141.25))
+    return recorder, sent
+
+
+def test_round_trip(tmp_path):
+    recorder, sent = record_session(tmp_path)
+    assert recorder.error is None
+
+    with SessionReader(recorder.path) as reader:
+        assert reader.header.device_uuid == DEVICE_UUID
+        assert reader.header.device_name == "KICKR SNAP 1234"
+        assert reader.header.created == recorder.created
+        assert len(reader) == recorder.written == 8
+
+        kinds = [(record.kind, record.channel) for record in reader]
+        assert kinds == [
+            (RECORD_CHANNEL, 0), (RECORD_NOTIFICATION, 0),
+            (RECORD_CHANNEL, 1), (RECORD_NOTIFICATION, 1),
+            (RECORD_SAMPLE, 0),
+            (RECORD_NOTIFICATION, 0), (RECORD_NOTIFICATION, 0),
+            (RECORD_SAMPLE, 0),
+        ]
+        assert reader.channels == {0: POWER, 1: CONTROL}
+        assert reader[-1] == list(reader)[-1]
+
+        expected = [(timestamp, sender, data[:PAYLOAD_SIZE]) for timestamp, sender, data in sent]
+        assert list(reader.notifications()) == expected
+        assert reader[6].length == PAYLOAD_SIZE + 4  # The original size is kept
+
+        samples = list(reader.samples())
+        assert [sample[1:] for sample in samples] == [(150.0, 137.5), (160.0, 141.25)]
+        assert recorder.created <= samples[0][0] <= samples[1][0]
+
+
+def test_partial_record_at_the_end_is_ignored(tmp_path):
+    recorder, sent = record_session(tmp_path)
+    with open(recorder.path, "ab") as fh:
+        fh.write(bytes(RECORD.size // 2))
+
+    with SessionReader(recorder.path) as reader:
+        assert len(reader) == 8
+        assert len(list(reader.notifications())) == len(sent)
+        with pytest.raises(IndexError):
+            reader[8]
+
+
+def test_no_file_until_started(tmp_path):
+    recorder = SessionRecorder(str(tmp_path))
+    recorder.close()
+    assert not os.path.exists(recorder.path)
+
+
+@pytest.mark.parametrize("content", [b"MOTV", b"NOPE" + bytes(HEADER.size)])
+def test_invalid_file(tmp_path, content):
+    path = tmp_path / "bad.mot"
+    path.write_bytes(content)
+    with pytest.raises(InvalidSessionFile):
+        SessionReader(str(path))
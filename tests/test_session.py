@@ -0,0 +1,65 @@
+'''
+SessionManager tests, with a client that stands in for BLEClient
+'''
+import asyncio
+
+import pytest
+
+from motivation.ble import UnsupportedTrainer
+from motivation.gate import PowerGate
+from motivation.gatt import GATTFailedToNotify
+from motivation.power import RawPowerTracker
+from motivation.session import SessionManager
+
+
+class Device:
+    def __init__(self, name):
+        self.name = name
+        self.address = name
+
+
+class FakeClient:
+    '''
+    Sends a few samples and finishes, or raises `error` once it's connected
+    '''
+
+    def __init__(self, device, power_tracker, recorder=None, error=None, debug=False):
+        self.power_tracker = power_tracker
+        self.gate = PowerGate(power_tracker, asyncio.get_event_loop(), stale_timeout=0)
+        self.error = error
+        self.timings = {}
+        self.pipeline = None
+        self.stats = ""
+        self.samples = 0
+
+    def process_sample(self, power):
+        self.power_tracker.set_power(power)
+        self.samples += 1
+
+    async def run_async(self):
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        for power in (100, 200, 300):
+            await asyncio.sleep(0.01)
+            self.process_sample(power)
+
+    def stop(self):
+        pass
+
+
+@pytest.mark.parametrize("error", [GATTFailedToNotify("No notify"), UnsupportedTrainer(), asyncio.TimeoutError(),
+                                   RuntimeError("Bug")])
+def test_one_failed_session_doesnt_stop_the_others(loop, error):
+    manager = SessionManager()
+    bad = manager.add(Device("bad"), RawPowerTracker(150), client_cls=FakeClient, error=error)
+    good = manager.add(Device("good"), RawPowerTracker(150), client_cls=FakeClient)
+
+    manager.run()
+
+    assert bad.error is error
+    assert good.error is None
+    assert good.client.samples == 3
+    assert good.stats.notifications == 3
+    assert f"Failed: {error}" in bad.report()
+    assert not [task for task in asyncio.all_tasks(loop) if not task.done()]
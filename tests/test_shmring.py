@@ -0,0 +1,116 @@
+'''
+SampleRing tests, writer and reader in the same process
+'''
+import pytest
+
+from motivation import shmring
+from motivation.recorder import RECORD_SAMPLE, RECORD_NOTIFICATION
+from motivation.shmring import SampleRing, SAMPLE_POWER, SEQUENCE, SLOTS_OFFSET, SLOT_SIZE
+
+
+@pytest.fixture
+def ring():
+    ring = SampleRing.create(8)
+    yield ring
+    ring.close()
+
+
+def powers(records):
+    return [SAMPLE_POWER.unpack_from(payload)[0] for _, kind, _, _, payload in records if kind == RECORD_SAMPLE]
+
+
+def test_round_trip(ring):
+    reader = ring.reader()
+    ring.write_sample(1.0, 150.0)
+    ring.record_notification("00002a63-0000-1000-8000-00805f9b34fb", b"\x00\x00\x96\x00", 2.0)
+
+    sample, notification = reader.read()
+    assert sample[:2] == (1.0, RECORD_SAMPLE)
+    assert powers([sample]) == [150.0]
+    timestamp, kind, channel, length, payload = notification
+    assert (timestamp, kind, length, payload[:length]) == (2.0, RECORD_NOTIFICATION, 4, b"\x00\x00\x96\x00")
+    assert ring.sender(channel) == "00002a63-0000-1000-8000-00805f9b34fb"
+    assert reader.read() == []
+
+
+def test_attached_ring_sees_the_same_records(ring):
+    other = SampleRing.attach(ring.name)
+    try:
+        reader = other.reader(0)
+        ring.write_sample(1.0, 200.0)
+        assert powers(reader.read()) == [200.0]
+    finally:
+        other.close()
+
+
+def test_lapped_reader_skips_ahead(ring):
+    reader = ring.reader(0)
+    for idx in range(20):
+        ring.write_sample(float(idx), float(idx))
+
+    records = reader.read()
+    assert powers(records) == [float(idx) for idx in range(20 - len(records), 20)]
+    assert len(records) + reader.missed == 20
+    assert reader.missed >= 20 - ring.capacity
+
+    ring.write_sample(20.0, 20.0)
+    assert powers(reader.read()) == [20.0]
+
+
+def test_slot_being_written_isnt_read(ring):
+    reader = ring.reader()
+    ring.write_sample(0.0, 100.0)
+    reader.read()
+
+    # The writer has zeroed the next slot's sequence but not finished the record
+    SEQUENCE.pack_into(ring.buf, SLOTS_OFFSET + 1 * SLOT_SIZE, 0)
+    assert reader.read() == []
+    assert reader.missed == 0
+
+    ring.write_sample(1.0, 110.0)
+    assert powers(reader.read()) == [110.0]
+
+
+def test_record_overwritten_while_copying_is_missed(ring, monkeypatch):
+    reader = ring.reader(0)
+    ring.write_sample(0.0, 100.0)
+    body = shmring.BODY
+
+    class Lapping:
+        '''
+        The writer laps the reader while it's copying the first record
+        '''
+        size = body.size
+
+        def unpack_from(self, buf, offset):
+            record = body.unpack_from(buf, offset)
+            monkeypatch.setattr(shmring, "BODY", body)
+            for idx in range(1, ring.capacity + 1):
+                ring.write_sample(float(idx), 100.0 + idx)
+            return record
+
+    monkeypatch.setattr(shmring, "BODY", Lapping())
+    records = reader.read()
+
+    assert 100.0 not in powers(records)  # Torn, never handed out
+    assert powers(records)[-1] == 100.0 + ring.capacity
+    assert len(records) + reader.missed == ring.capacity + 1
+
+
+def test_closing_the_ring_closes_its_readers():
+    ring = SampleRing.create(8)
+    reader = ring.reader()
+    ring.close()
+
+    with pytest.raises(ValueError):
+        reader.read()
+
+
+def test_close_with_a_view_still_held():
+    ring = SampleRing.create(8)
+    view = ring.buf[:8]
+    ring.close()  # Logs it rather than raising
+
+    view.release()
+    with pytest.raises(FileNotFoundError):
+        SampleRing.attach(ring.name)
@@ -0,0 +1,51 @@
+'''
+RollingWindow tests
+'''
+import pytest
+
+from motivation.power import EWMAPowerTracker
+from motivation.window import RollingWindow
+
+
+def test_time_weighted_average():
+    window = RollingWindow(10)
+    window.add(100, 0.0)
+    window.add(200, 2.0)
+    window.add(200, 4.0)
+    assert window.average == pytest.approx((100 * 2 + 200 * 2) / 4)
+
+
+def test_old_samples_fall_out_of_the_window():
+    window = RollingWindow(5)
+    window.add(100, 0.0)
+    window.add(300, 10.0)
+    window.add(300, 15.0)
+    assert window.average == pytest.approx(300)
+
+
+def test_out_of_order_timestamp_isnt_counted_twice():
+    window = RollingWindow(30)
+    window.add(100, 0.0)
+    window.add(100, 10.0)
+    window.add(500, 5.0)  # Late, treated as arriving at 10s
+    window.add(100, 20.0)
+
+    # 0-10s at 100w then 10-20s at 500w
+    assert window.total_duration == pytest.approx(20.0)
+    assert window.average == pytest.approx(300)
+    assert window.last_time == 20.0
+
+
+def test_late_sample_doesnt_wind_the_ewma_clock_back():
+    late, in_order = EWMAPowerTracker(0, time_constant=10), EWMAPowerTracker(0, time_constant=10)
+    for tracker in (late, in_order):
+        tracker.set_power(100, 0.0)
+        tracker.set_power(100, 10.0)
+    late.set_power(500, 5.0)  # Late, the average doesn't move
+    assert late.get_effective_power() == pytest.approx(100)
+    assert late.last_time == 10.0
+    assert late.timestamp == 10.0  # The workout clock doesn't go back either
+
+    for tracker in (late, in_order):
+        tracker.set_power(200, 11.0)
+    assert late.get_effective_power() == pytest.approx(in_order.get_effective_power())
@@ -0,0 +1,92 @@
+'''
+Workout compiling tests
+'''
+import pytest
+
+import json
+
+from motivation import config
+from motivation.workout import compile_workout, parse_duration, InvalidWorkout, MAX_BREAKPOINTS
+
+WORKOUT = {"segments": [
+    {"power": 100, "duration": "1:00"},
+    {"ramp": [100, 200], "duration": 100},
+    {"repeat": 2, "segments": [{"power": "120%", "duration": 30}, {"power": 150, "duration": 30}]},
+]}
+
+
+@pytest.fixture
+def schedule():
+    return compile_workout(WORKOUT, ftp=250)
+
+
+def test_breakpoints(schedule):
+    assert schedule.times == [0.0, 60.0, 160.0, 190.0, 220.0, 250.0, 280.0]
+    assert schedule.duration == 280.0
+
+
+@pytest.mark.parametrize("elapsed, target", [
+    (0.0, 100), (30.0, 100),
+    (60.0, 100), (110.0, 150), (159.9, 199.9),  # The ramp
+    (160.0, 300), (189.9, 300), (190.0, 150), (220.0, 300), (250.0, 150),
+])
+def test_targets(schedule, elapsed, target):
+    assert schedule.target(elapsed) == pytest.approx(target)
+
+
+def test_before_the_start_is_the_first_target(schedule):
+    assert schedule.target(-5.0) == 100
+
+
+def test_the_last_target_holds_after_the_end(schedule):
+    assert schedule.target(280.0) == 150
+    assert schedule.target(10000.0) == 150
+
+
+def test_a_ramp_at_the_end_holds_where_it_finished():
+    schedule = compile_workout({"segments": [{"ramp": [100, 300], "duration": 200}]})
+    assert schedule.target(100.0) == pytest.approx(200)
+    assert schedule.target(200.0) == pytest.approx(300)
+    assert schedule.target(500.0) == pytest.approx(300)
+
+
+@pytest.mark.parametrize("value, seconds", [(90, 90.0), ("90", 90.0), ("1:30", 90.0), ("1:00:00", 3600.0)])
+def test_durations(value, seconds):
+    assert parse_duration(value) == seconds
+
+
+def test_percentages_need_an_ftp():
+    with pytest.raises(InvalidWorkout, match="FTP"):
+        compile_workout({"segments": [{"power": "50%", "duration": 10}]})
+    assert compile_workout({"ftp": 300, "segments": [{"power": "50%", "duration": 10}]}).target(0) == 150
+
+
+def test_load_workout_by_name(tmp_path, monkeypatch):
+    monkeypatch.setenv("MOTIVATION_CONFIG_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "_config", {"ftp": 200})
+    (tmp_path / config.WORKOUTS_DIR).mkdir()
+    (tmp_path / config.WORKOUTS_DIR / "intervals.json").write_text(json.dumps(WORKOUT))
+
+    schedule = config.load_workout("intervals")
+    assert schedule.name == "intervals"
+    assert schedule.target(170.0) == pytest.approx(240)
+
+
+@pytest.mark.parametrize("repeat", [
+    {"repeat": 100000000, "segments": []},
+    {"repeat": 100000000},
+    {"repeat": 100000000, "segments": [{"repeat": 100000000, "segments": []}]},
+    {"repeat": 0, "segments": [{"power": 100, "duration": 60}]},
+    {"repeat": -1, "segments": [{"power": 100, "duration": 60}]},
+])
+def test_bad_repeats_are_rejected(repeat):
+    with pytest.raises(InvalidWorkout):
+        compile_workout({"segments": [{"power": 100, "duration": 60}, repeat]})
+
+
+def test_huge_repeats_hit_the_limit():
+    workout = {"segments": [{"repeat": 100000000, "segments": [
+        {"repeat": 100000000, "segments": [{"power": 100, "duration": 1}]}
+    ]}]}
+    with pytest.raises(InvalidWorkout, match=str(MAX_BREAKPOINTS)):
+        compile_workout(workout)